@@ -0,0 +1,497 @@
+import base64
+import http.client
+import json
+import os
+import queue
+import ssl
+import threading
+import urllib.parse
+from cryptography.hazmat.primitives import serialization
+from peridio_evk.binary_store import store_binary
+from peridio_evk.executor import DEFAULT_JOBS
+from peridio_evk.log import (
+    log_cli_command,
+    log_cli_response,
+    log_cli_stderr,
+    log_task,
+)
+from peridio_evk.upload import (
+    DEFAULT_PART_SIZE,
+    UploadError,
+    get_checkpoint_path,
+    read_checkpoint,
+    upload_binary_parts,
+    write_checkpoint,
+)
+from peridio_evk.utils import (
+    SubprocessResult,
+    get_config_path,
+    read_evk_config,
+    read_json_file,
+    set_api_backend,
+)
+
+DEFAULT_BASE_URL = "https://api.cremini.peridio.com"
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "PATCH", "DELETE"}
+
+
+class ConnectionPool:
+    """
+    A bounded pool of persistent HTTP/1.1 connections to a single origin.
+
+    Connections are kept alive between requests and handed back to the pool,
+    so consecutive API calls share one TCP connection and TLS session instead
+    of paying a handshake each time.
+    """
+
+    def __init__(self, origin, max_connections=DEFAULT_JOBS, timeout=60):
+        parsed = urllib.parse.urlsplit(origin)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._ssl_context = (
+            ssl.create_default_context() if self.scheme == "https" else None
+        )
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                context=self._ssl_context,
+            )
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout
+        )
+
+    def request(self, method, path, body=None, headers=None):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._connect()
+                reused = False
+
+            try:
+                sent = False
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                    sent = True
+                    response = conn.getresponse()
+                except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    # The server closed an idle keep-alive connection; retry
+                    # once on a fresh one. A request that was sent in full may
+                    # have been processed, so only idempotent ones are
+                    # replayed; a POST could otherwise create twice.
+                    conn.close()
+                    if not reused or (
+                        sent and method not in IDEMPOTENT_METHODS
+                    ):
+                        raise
+                    conn = self._connect()
+                    conn.request(method, path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                data = response.read()
+            except BaseException:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PeridioAPI:
+    """
+    In-process replacement for the peridio CLI.
+
+    peridio_cli hands the same argument vectors it would execute to cli(),
+    which translates them to Peridio Cloud API requests over pooled
+    keep-alive connections. Results are returned as SubprocessResult with the
+    response body on stdout (success) or stderr (failure), matching what the
+    CLI prints, so call sites do not change.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url=DEFAULT_BASE_URL,
+        max_connections=DEFAULT_JOBS,
+        part_size=DEFAULT_PART_SIZE,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.part_size = part_size
+        # Binaries are created concurrently and each uploads its parts
+        # concurrently, so the parts in flight are bounded across binaries.
+        self.upload_slots = threading.BoundedSemaphore(max_connections)
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, profile, max_connections=DEFAULT_JOBS):
+        """
+        Build a client from the profile and api_key that do_initialize wrote
+        to the CLI config.json and credentials.json.
+        """
+        config_path = get_config_path()
+        config = read_json_file(os.path.join(config_path, "config.json"))
+        credentials = read_json_file(
+            os.path.join(config_path, "credentials.json")
+        )
+        if profile not in credentials:
+            raise ValueError(f"No credentials found for profile '{profile}'")
+
+        base_url = (
+            os.getenv("PERIDIO_BASE_URL")
+            or config.get("profiles", {}).get(profile, {}).get("base_url")
+            or DEFAULT_BASE_URL
+        )
+        return cls(
+            credentials[profile]["api_key"],
+            base_url=base_url,
+            max_connections=max_connections,
+        )
+
+    def signing_key_pair(self, name):
+        # Key pairs are added to config.json while cohorts are provisioned,
+        # so they are looked up at use time rather than cached.
+        config = read_json_file(os.path.join(get_config_path(), "config.json"))
+        return config.get("signing_key_pairs", {})[name]
+
+    def _pool(self, origin):
+        with self._pools_lock:
+            pool = self._pools.get(origin)
+            if pool is None:
+                pool = ConnectionPool(origin, self.max_connections)
+                self._pools[origin] = pool
+            return pool
+
+    def close(self):
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Send a request to an absolute URL or to a path relative to the API
+        base URL and return (status, body bytes).
+        """
+        if url.startswith("/"):
+            url = self.base_url + url
+        parsed = urllib.parse.urlsplit(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        target = parsed.path or "/"
+        if parsed.query:
+            target = f"{target}?{parsed.query}"
+        return self._pool(origin).request(method, target, body, headers)
+
+    def api(self, method, path, payload=None, query=None):
+        if query:
+            path = f"{path}?{urllib.parse.urlencode(query)}"
+        headers = {
+            "Authorization": f"Token {self.api_key}",
+            "Accept": "application/json",
+            "User-Agent": "peridio-evk",
+        }
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        status, data = self.request(method, path, body, headers)
+        return status, data.decode("utf-8")
+
+    def cli(self, command):
+        log_cli_command(command)
+        resource, action, args = parse_cli_command(command)
+        handler = ROUTES.get((resource, action))
+        if handler is None:
+            return SubprocessResult(
+                "", f"Unsupported API operation: {resource} {action}", 1
+            )
+
+        try:
+            status, text = handler(self, args)
+        except Exception as e:
+            log_cli_stderr(str(e))
+            return SubprocessResult("", str(e), 1)
+
+        if 200 <= status < 300:
+            if text != "":
+                log_cli_response(json.dumps(json.loads(text), indent=2))
+            return SubprocessResult(text, "", 0)
+
+        log_cli_stderr(text)
+        return SubprocessResult("", text, 1)
+
+
+def use_backend(backend, jobs=DEFAULT_JOBS):
+    """
+    Route peridio_cli calls through the built-in client when backend is
+    'api', using the profile recorded in the EVK config.
+    """
+    if backend == "api":
+        log_task("Using built-in Peridio API client")
+        set_api_backend(
+            PeridioAPI.from_profile(
+                read_evk_config()["profile"], max_connections=jobs
+            )
+        )
+
+
+def parse_cli_command(command):
+    """
+    Split a peridio CLI argument vector into (resource, action, args) where
+    args maps option names in snake_case to their values.
+    """
+    args = {}
+    positional = []
+    i = 1
+    while i < len(command):
+        token = command[i]
+        if token.startswith("--"):
+            value = command[i + 1] if i + 1 < len(command) else ""
+            args[token[2:].replace("-", "_")] = value
+            i += 2
+        else:
+            positional.append(token)
+            i += 1
+    args.pop("profile", None)
+    resource = positional[0] if positional else None
+    action = positional[1] if len(positional) > 1 else None
+    return resource, action, args
+
+
+def _pick(args, *keys):
+    return {key: args[key] for key in keys if key in args}
+
+
+def _read_base64(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def _create(path, *keys):
+    return lambda api, args: api.api("POST", path, _pick(args, *keys))
+
+
+def _list(path):
+    return lambda api, args: api.api(
+        "GET", path, query=_pick(args, "search", "limit", "order", "page")
+    )
+
+
+def _users_me(api, args):
+    return api.api("GET", "/users/me")
+
+
+def _artifacts_create(api, args):
+    payload = _pick(args, "organization_prn", "name", "description")
+    if "custom_metadata" in args:
+        payload["custom_metadata"] = json.loads(args["custom_metadata"])
+    return api.api("POST", "/artifacts", payload)
+
+
+def _binaries_create(api, args):
+    # Mirrors the CLI: create the binary record, upload the content in parts,
+    # sign the content hash with the configured key pair and mark it signed.
+    content_path = args["content_path"]
+    digest = bytes.fromhex(store_binary(content_path))
+    size = os.path.getsize(content_path)
+
+    checkpoint_path = get_checkpoint_path(
+        args["artifact_version_prn"], args["target"], digest.hex()
+    )
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint:
+        binary_prn = checkpoint["binary_prn"]
+    else:
+        payload = {
+            "artifact_version_prn": args["artifact_version_prn"],
+            "target": args["target"],
+            "hash": digest.hex(),
+            "size": size,
+            "description": args.get("description", args["target"]),
+        }
+        if "custom_metadata" in args:
+            payload["custom_metadata"] = json.loads(args["custom_metadata"])
+        status, text = api.api("POST", "/binaries", payload)
+        if status >= 300:
+            return status, text
+        binary_prn = json.loads(text)["binary"]["prn"]
+        checkpoint = {
+            "binary_prn": binary_prn,
+            "part_size": api.part_size,
+            "completed": [],
+        }
+        write_checkpoint(checkpoint_path, checkpoint)
+
+    try:
+        upload_binary_parts(
+            api,
+            binary_prn,
+            content_path,
+            checkpoint_path,
+            checkpoint,
+            api.max_connections,
+            api.upload_slots,
+        )
+    except UploadError as e:
+        return e.status, e.body
+
+    status, text = api.api(
+        "PATCH", f"/binaries/{binary_prn}", {"state": "hashable"}
+    )
+    if status >= 300:
+        return status, text
+
+    key_pair_name = args.get("signing_key_pair")
+    if key_pair_name:
+        key_pair = api.signing_key_pair(key_pair_name)
+        with open(key_pair["signing_key_private_path"], "rb") as f:
+            private_key = serialization.load_pem_private_key(
+                f.read(), password=None
+            )
+        status, text = api.api(
+            "POST",
+            "/binary_signatures",
+            {
+                "binary_prn": binary_prn,
+                "signing_key_prn": key_pair["signing_key_prn"],
+                "signature": private_key.sign(digest).hex().upper(),
+            },
+        )
+        if status >= 300:
+            return status, text
+
+    status, text = api.api(
+        "PATCH", f"/binaries/{binary_prn}", {"state": "signed"}
+    )
+    if status < 300:
+        os.remove(checkpoint_path)
+    return status, text
+
+
+def _bundles_create(api, args):
+    payload = _pick(args, "organization_prn", "name")
+    payload["artifact_version_prns"] = args["artifact_version_prns"].split()
+    return api.api("POST", "/bundles", payload)
+
+
+def _releases_create(api, args):
+    payload = _pick(
+        args,
+        "organization_prn",
+        "bundle_prn",
+        "cohort_prn",
+        "name",
+        "schedule_date",
+        "version",
+        "version_requirement",
+    )
+    if "disabled" in args:
+        payload["disabled"] = args["disabled"] == "true"
+    if "phase_value" in args:
+        payload["phase_value"] = float(args["phase_value"])
+    if "phase_tags" in args:
+        payload["phase_tags"] = args["phase_tags"].split()
+    return api.api("POST", "/releases", payload)
+
+
+def _devices_create(api, args):
+    payload = _pick(args, "identifier", "cohort_prn", "target")
+    payload["tags"] = args.get("tags", "").split()
+    product_name = urllib.parse.quote(args["product_name"], safe="")
+    return api.api("POST", f"/products/{product_name}/devices", payload)
+
+
+def _device_certificates_create(api, args):
+    product_name = urllib.parse.quote(args["product_name"], safe="")
+    identifier = urllib.parse.quote(args["device_identifier"], safe="")
+    return api.api(
+        "POST",
+        f"/products/{product_name}/devices/{identifier}/certificates",
+        {"cert": _read_base64(args["certificate_path"])},
+    )
+
+
+def _ca_certificates_get(api, args):
+    serial = urllib.parse.quote(args["ca_certificate_serial"], safe="")
+    return api.api("GET", f"/ca_certificates/{serial}")
+
+
+def _ca_certificates_create_verification_code(api, args):
+    return api.api("POST", "/ca_certificates/verification_codes")
+
+
+def _ca_certificates_create(api, args):
+    payload = {
+        "certificate": _read_base64(args["certificate_path"]),
+        "verification_certificate": _read_base64(
+            args["verification_certificate_path"]
+        ),
+        "description": args.get("description"),
+    }
+    if "jitp_cohort_prn" in args or "jitp_product_name" in args:
+        payload["jitp"] = {
+            "cohort_prn": args.get("jitp_cohort_prn"),
+            "product_name": args.get("jitp_product_name"),
+            "tags": args.get("jitp_tags", "").split(),
+            "description": args.get("jitp_description"),
+            "target": args.get("jitp_target"),
+        }
+    return api.api("POST", "/ca_certificates", payload)
+
+
+ROUTES = {
+    ("users", "me"): _users_me,
+    ("products-v2", "create"): _create("/products", "organization_prn", "name"),
+    ("products-v2", "list"): _list("/products"),
+    ("cohorts", "create"): _create(
+        "/cohorts", "organization_prn", "product_prn", "name", "description"
+    ),
+    ("cohorts", "list"): _list("/cohorts"),
+    ("artifacts", "create"): _artifacts_create,
+    ("artifacts", "list"): _list("/artifacts"),
+    ("artifact-versions", "create"): _create(
+        "/artifact_versions", "artifact_prn", "version", "description"
+    ),
+    ("artifact-versions", "list"): _list("/artifact_versions"),
+    ("binaries", "create"): _binaries_create,
+    ("binaries", "list"): _list("/binaries"),
+    ("bundles", "create"): _bundles_create,
+    ("bundles", "list"): _list("/bundles"),
+    ("releases", "create"): _releases_create,
+    ("releases", "list"): _list("/releases"),
+    ("devices", "create"): _devices_create,
+    ("device-certificates", "create"): _device_certificates_create,
+    ("signing-keys", "create"): _create(
+        "/signing_keys", "organization_prn", "value", "name"
+    ),
+    ("signing-keys", "list"): _list("/signing_keys"),
+    ("ca-certificates", "get"): _ca_certificates_get,
+    ("ca-certificates", "create-verification-code"): (
+        _ca_certificates_create_verification_code
+    ),
+    ("ca-certificates", "create"): _ca_certificates_create,
+}
@@ -0,0 +1,192 @@
+import codecs
+import fcntl
+import json
+import os
+import select
+import shutil
+import signal
+import sys
+import termios
+import time
+import tty
+
+# Reads start at MIN_READ_SIZE and double, up to MAX_READ_SIZE, whenever a
+# read fills the buffer, so bulk output like dmesg needs few system calls
+# while interactive keystrokes stay cheap.
+MIN_READ_SIZE = 16 * 1024
+MAX_READ_SIZE = 1024 * 1024
+
+
+class SessionRecorder:
+    """
+    Record terminal output in the asciicast v2 format, which can be replayed
+    with 'asciinema play'.
+    """
+
+    def __init__(self, path, width, height):
+        self.file = open(path, "w", encoding="utf-8")
+        self.start = time.monotonic()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        header = {
+            "version": 2,
+            "width": width,
+            "height": height,
+            "timestamp": int(time.time()),
+            "env": {"TERM": os.environ.get("TERM", "xterm")},
+        }
+        self.file.write(json.dumps(header) + "\n")
+
+    def _event(self, kind, data):
+        elapsed = round(time.monotonic() - self.start, 6)
+        self.file.write(json.dumps([elapsed, kind, data]) + "\n")
+
+    def output(self, data):
+        # The decoder carries multi-byte characters split across reads.
+        text = self.decoder.decode(data)
+        if text:
+            self._event("o", text)
+
+    def resize(self, width, height):
+        self._event("r", f"{width}x{height}")
+
+    def close(self):
+        text = self.decoder.decode(b"", final=True)
+        if text:
+            self._event("o", text)
+        self.file.close()
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return flags
+
+
+def _write_some(fd, buffer):
+    try:
+        written = os.write(fd, buffer)
+    except BlockingIOError:
+        return
+    del buffer[:written]
+
+
+def attach_exec(api, exec_id, sock, record_path=None):
+    """
+    Connect the local terminal to a started TTY exec session.
+
+    Bytes are passed through unchanged in both directions. All descriptors
+    are non-blocking and output that cannot be written yet is kept in a
+    buffer, so a slow terminal never blocks keystrokes and vice versa. The
+    terminal size is sent when the session starts and on every SIGWINCH.
+    """
+    stdin_fd = sys.stdin.fileno()
+    stdout_fd = sys.stdout.fileno()
+    sock_fd = sock.fileno()
+    sys.stdout.flush()
+
+    def resize():
+        width, height = shutil.get_terminal_size()
+        try:
+            api.exec_resize(exec_id, height=height, width=width)
+        except Exception:
+            pass
+        if recorder:
+            recorder.resize(width, height)
+
+    width, height = shutil.get_terminal_size()
+    recorder = (
+        SessionRecorder(record_path, width, height) if record_path else None
+    )
+    # SIGWINCH wakes select through a pipe instead of interrupting it.
+    wakeup_read, wakeup_write = os.pipe()
+    _set_nonblocking(wakeup_read)
+    _set_nonblocking(wakeup_write)
+    previous_wakeup_fd = signal.set_wakeup_fd(wakeup_write)
+    previous_handler = signal.signal(signal.SIGWINCH, lambda *_: None)
+
+    # On a terminal stdin and stdout usually share one open file
+    # description, and with it the O_NONBLOCK flag, so both are read before
+    # either is changed.
+    old_tty_settings = termios.tcgetattr(stdin_fd)
+    stdin_flags = fcntl.fcntl(stdin_fd, fcntl.F_GETFL)
+    stdout_flags = fcntl.fcntl(stdout_fd, fcntl.F_GETFL)
+    _set_nonblocking(stdin_fd)
+    _set_nonblocking(stdout_fd)
+    sock.setblocking(False)
+    to_container = bytearray()
+    to_terminal = bytearray()
+    read_size = MIN_READ_SIZE
+    stdin_open = True
+    try:
+        tty.setraw(stdin_fd)
+        resize()
+        while True:
+            # Stop reading a side whose output is not being consumed, which
+            # pushes back on the sender instead of buffering without bound.
+            readers = [wakeup_read]
+            if len(to_terminal) < MAX_READ_SIZE:
+                readers.append(sock_fd)
+            if stdin_open and len(to_container) < MAX_READ_SIZE:
+                readers.append(stdin_fd)
+            writers = []
+            if to_container:
+                writers.append(sock_fd)
+            if to_terminal:
+                writers.append(stdout_fd)
+            readable, writable, _ = select.select(readers, writers, [])
+
+            if wakeup_read in readable:
+                try:
+                    os.read(wakeup_read, 512)
+                except BlockingIOError:
+                    pass
+                resize()
+
+            if stdin_fd in readable:
+                try:
+                    data = os.read(stdin_fd, MIN_READ_SIZE)
+                except BlockingIOError:
+                    data = None
+                if data == b"":
+                    stdin_open = False
+                elif data:
+                    to_container += data
+
+            if sock_fd in readable:
+                try:
+                    data = sock.recv(read_size)
+                except BlockingIOError:
+                    data = None
+                if data == b"":
+                    break
+                if data:
+                    if len(data) == read_size:
+                        read_size = min(read_size * 2, MAX_READ_SIZE)
+                    to_terminal += data
+                    if recorder:
+                        recorder.output(data)
+
+            if sock_fd in writable:
+                try:
+                    sent = sock.send(to_container)
+                    del to_container[:sent]
+                except BlockingIOError:
+                    pass
+            if stdout_fd in writable:
+                _write_some(stdout_fd, to_terminal)
+
+        # Flush what the session printed last before restoring the terminal,
+        # waiting for the terminal to accept more instead of spinning.
+        while to_terminal:
+            select.select([], [stdout_fd], [])
+            _write_some(stdout_fd, to_terminal)
+    finally:
+        termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_tty_settings)
+        fcntl.fcntl(stdin_fd, fcntl.F_SETFL, stdin_flags)
+        fcntl.fcntl(stdout_fd, fcntl.F_SETFL, stdout_flags)
+        signal.signal(signal.SIGWINCH, previous_handler)
+        signal.set_wakeup_fd(previous_wakeup_fd)
+        os.close(wakeup_read)
+        os.close(wakeup_write)
+        if recorder:
+            recorder.close()
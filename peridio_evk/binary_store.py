@@ -0,0 +1,140 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from peridio_evk.utils import get_config_path, read_json_file
+
+HASH_WINDOW_SIZE = 8 * 1024 * 1024
+
+_manifest_lock = threading.Lock()
+
+
+def get_artifacts_path():
+    return os.path.join(get_config_path(), "evk-data", "artifacts")
+
+
+def get_binary_store_path():
+    return os.path.join(get_artifacts_path(), "sha256")
+
+
+def get_manifest_path():
+    return os.path.join(get_artifacts_path(), "manifest.json")
+
+
+def hash_file(file_path):
+    """
+    Return the SHA-256 hex digest of a file, hashing it through a read-only
+    memory map in HASH_WINDOW_SIZE windows so large images are never copied
+    into Python memory.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return sha256.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, HASH_WINDOW_SIZE):
+                    sha256.update(view[offset : offset + HASH_WINDOW_SIZE])
+            finally:
+                view.release()
+    return sha256.hexdigest()
+
+
+def _read_manifest():
+    manifest = read_json_file(get_manifest_path())
+    manifest.setdefault("files", {})
+    manifest.setdefault("binaries", {})
+    return manifest
+
+
+def _write_manifest(manifest):
+    manifest_path = get_manifest_path()
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def store_binary(file_path):
+    """
+    Add a binary to the content-addressed store and return its SHA-256.
+
+    The digest is cached against the file's size and mtime, so a file that
+    is already in the manifest is not hashed again. The named file and the
+    store entry are hardlinked, so binaries with identical content occupy
+    disk space once.
+
+    A write in place to any name of a stored file changes the store entry
+    too, so an existing entry is hashed again before it replaces a named
+    file. An entry that no longer matches its digest is replaced with the
+    named file instead.
+    """
+    st = os.stat(file_path)
+    with _manifest_lock:
+        entry = _read_manifest()["files"].get(file_path)
+    if (
+        entry
+        and entry["size"] == st.st_size
+        and entry["mtime_ns"] == st.st_mtime_ns
+    ):
+        return entry["sha256"]
+
+    sha256 = hash_file(file_path)
+    store_path = get_binary_store_path()
+    os.makedirs(store_path, exist_ok=True)
+    blob_path = os.path.join(store_path, sha256)
+    try:
+        if not os.path.exists(blob_path):
+            os.link(file_path, blob_path)
+        elif os.path.samefile(blob_path, file_path):
+            pass
+        elif hash_file(blob_path) == sha256:
+            tmp_path = f"{file_path}.link"
+            os.link(blob_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        else:
+            tmp_path = f"{blob_path}.{threading.get_ident()}.link"
+            os.link(file_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        # Filesystems without hardlink support still get the hash cache.
+        pass
+
+    st = os.stat(file_path)
+    with _manifest_lock:
+        manifest = _read_manifest()
+        manifest["files"][file_path] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": sha256,
+        }
+        _write_manifest(manifest)
+    return sha256
+
+
+def get_stored_binary_prn(sha256, artifact_version_prn, target):
+    """
+    Return the PRN of the binary uploaded with this content for an artifact
+    version and target, or None.
+
+    A Peridio Cloud binary belongs to one artifact version and target, so
+    identical content under another version or target cannot reuse it and
+    is uploaded again. The lookup matters when the state store has no
+    record of the binary, for example after --refresh.
+    """
+    with _manifest_lock:
+        binaries = _read_manifest()["binaries"].get(sha256, {})
+    return binaries.get(f"{artifact_version_prn}:{target}")
+
+
+def put_stored_binary_prn(sha256, artifact_version_prn, target, binary_prn):
+    with _manifest_lock:
+        manifest = _read_manifest()
+        binaries = manifest["binaries"].setdefault(sha256, {})
+        binaries[f"{artifact_version_prn}:{target}"] = binary_prn
+        _write_manifest(manifest)
@@ -1,9 +1,21 @@
 import click
 from peridio_evk.commands.initialize import initialize
+from peridio_evk.commands.plan import plan, apply
+from peridio_evk.commands.certificates import certificates
+from peridio_evk.commands.bench import (
+    benchmark_certificates,
+    benchmark_crypto,
+    benchmark_density,
+)
 from peridio_evk.commands.devices import (
     devices_start,
     devices_stop,
+    devices_logs,
+    devices_status,
     device_attach,
+    devices_rotate_certs,
+    device_env,
+    devices_env_set,
 )
 
 
@@ -13,9 +25,20 @@ def cli():
 
 
 cli.add_command(initialize)
+cli.add_command(plan)
+cli.add_command(apply)
 cli.add_command(devices_start)
 cli.add_command(devices_stop)
+cli.add_command(devices_logs)
+cli.add_command(devices_status)
 cli.add_command(device_attach)
+cli.add_command(devices_rotate_certs)
+cli.add_command(device_env)
+cli.add_command(devices_env_set)
+cli.add_command(certificates)
+cli.add_command(benchmark_certificates)
+cli.add_command(benchmark_crypto)
+cli.add_command(benchmark_density)
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,425 @@
+import click
+import os
+import re
+import tempfile
+import time
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import serialization
+from peridio_evk.crypto import (
+    DEFAULT_KEY_ALGORITHM,
+    KEY_ALGORITHMS,
+    build_end_entity_certificate,
+    create_end_entity_csr,
+    create_intermediate_ca_csr,
+    create_root_ca,
+    generate_private_key,
+    sign_end_entity_csr,
+    sign_intermediate_ca_csr,
+    signature_hash,
+    verify_certificate_signature,
+)
+from peridio_evk.commands.devices import (
+    DEFAULT_CONTAINER_JOBS,
+    get_container_resource_limits,
+    get_device_image,
+    get_device_status,
+    iter_log_lines,
+    parse_log_timestamp,
+    peridio_json_template,
+    read_fleet,
+    resource_limit_options,
+    start_device_containers,
+)
+from peridio_evk.executor import latency_summary, run_parallel
+from peridio_evk.issuer import benchmark_issuance
+from peridio_evk.log import log_task, log_info, log_error
+from peridio_evk.utils import (
+    get_config_path,
+    get_container_client,
+    write_json_file,
+)
+
+DEFAULT_POLL_PATTERN = r"(?i)\brelease\b.*\b(poll|check)"
+
+
+@click.command(name="benchmark-certificates")
+@click.option(
+    "--count",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="Number of device certificates to issue (Optional)",
+)
+@click.option(
+    "--processes",
+    required=False,
+    type=click.IntRange(min=1),
+    default=None,
+    help="Worker processes, defaults to the number of CPUs (Optional)",
+)
+@click.option(
+    "--baseline/--no-baseline",
+    default=True,
+    show_default=True,
+    help="Also time the per-file CSR signing path for comparison (Optional)",
+)
+@click.option(
+    "--key-algorithm",
+    required=False,
+    type=click.Choice(KEY_ALGORITHMS),
+    default=DEFAULT_KEY_ALGORITHM,
+    show_default=True,
+    help="Key algorithm of the CA and device keys (Optional)",
+)
+def benchmark_certificates(count, processes, baseline, key_algorithm):
+    with tempfile.TemporaryDirectory() as work_path:
+        log_task("Creating benchmark CA")
+        root_key = os.path.join(work_path, "root-private-key.pem")
+        root_cert = os.path.join(work_path, "root-certificate.pem")
+        signer_key = os.path.join(work_path, "intermediate-private-key.pem")
+        signer_csr = os.path.join(work_path, "intermediate-signing-request.pem")
+        signer_cert = os.path.join(work_path, "intermediate-certificate.pem")
+        create_root_ca("Benchmark Root CA", root_key, root_cert, key_algorithm)
+        create_intermediate_ca_csr(
+            "Benchmark Intermediate CA", signer_key, signer_csr, key_algorithm
+        )
+        sign_intermediate_ca_csr(root_key, root_cert, signer_csr, signer_cert)
+
+        log_task(f"Issuing {count} certificates in batch")
+        with open(signer_key, "rb") as f:
+            signer_key_pem = f.read()
+        with open(signer_cert, "rb") as f:
+            signer_cert_pem = f.read()
+        result = benchmark_issuance(
+            count, signer_key_pem, signer_cert_pem, processes, key_algorithm
+        )
+        log_info(
+            f"Batch: {result['count']} certs in {result['seconds']:.2f}s ({result['rate']:.0f} certs/s)"
+        )
+
+        if baseline:
+            log_task(f"Issuing {count} certificates one file at a time")
+            devices_path = os.path.join(work_path, "devices")
+            os.makedirs(devices_path)
+            start = time.perf_counter()
+            for index in range(count):
+                prefix = os.path.join(devices_path, f"BENCH-{index:06d}")
+                create_end_entity_csr(
+                    f"BENCH-{index:06d}",
+                    f"{prefix}-private-key.pem",
+                    f"{prefix}-signing-request.pem",
+                    key_algorithm,
+                )
+                sign_end_entity_csr(
+                    signer_key,
+                    signer_cert,
+                    f"{prefix}-signing-request.pem",
+                    f"{prefix}-certificate.pem",
+                )
+            seconds = time.perf_counter() - start
+            log_info(
+                f"Per-file: {count} certs in {seconds:.2f}s ({count / seconds:.0f} certs/s)"
+            )
+            log_info(f"Speedup: {seconds / result['seconds']:.1f}x")
+
+
+@click.command(name="benchmark-crypto")
+@click.option(
+    "--count",
+    required=False,
+    type=click.IntRange(min=1),
+    default=500,
+    show_default=True,
+    help="Operations to time per measurement (Optional)",
+)
+@click.option(
+    "--key-algorithm",
+    "key_algorithms",
+    required=False,
+    multiple=True,
+    type=click.Choice(KEY_ALGORITHMS),
+    help="Key algorithm to measure, may be repeated, defaults to all (Optional)",
+)
+def benchmark_crypto(count, key_algorithms):
+    results = []
+    with tempfile.TemporaryDirectory() as work_path:
+        for key_algorithm in key_algorithms or KEY_ALGORITHMS:
+            log_task(f"Measuring {key_algorithm}")
+            results.append(
+                measure_key_algorithm(key_algorithm, count, work_path)
+            )
+
+    log_task("Operations per second")
+    log_info(
+        f"{'algorithm':<10} {'keygen':>10} {'csr':>10} {'sign':>10} {'verify':>10}"
+    )
+    for result in results:
+        log_info(
+            f"{result['key_algorithm']:<10} {result['keygen']:>10.0f} {result['csr']:>10.0f} {result['sign']:>10.0f} {result['verify']:>10.0f}"
+        )
+
+
+def measure_key_algorithm(key_algorithm, count, work_path):
+    """
+    Time key generation, CSR creation, certificate signing by an issuer of
+    the same algorithm, and certificate verification. Returns operations
+    per second for each.
+    """
+    ca_key = os.path.join(work_path, f"{key_algorithm}-ca-private-key.pem")
+    ca_cert = os.path.join(work_path, f"{key_algorithm}-ca-certificate.pem")
+    create_root_ca(
+        f"Benchmark CA {key_algorithm}", ca_key, ca_cert, key_algorithm
+    )
+    with open(ca_key, "rb") as f:
+        issuer_key = serialization.load_pem_private_key(f.read(), None)
+    with open(ca_cert, "rb") as f:
+        issuer_cert = x509.load_pem_x509_certificate(f.read())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "BENCH")])
+
+    def rate(func, items):
+        start = time.perf_counter()
+        output = [func(item) for item in items]
+        seconds = time.perf_counter() - start
+        return output, count / seconds if seconds > 0 else 0.0
+
+    keys, keygen_rate = rate(
+        lambda _: generate_private_key(key_algorithm), range(count)
+    )
+    _csrs, csr_rate = rate(
+        lambda key: x509.CertificateSigningRequestBuilder()
+        .subject_name(subject)
+        .sign(key, signature_hash(key)),
+        keys,
+    )
+    certs, sign_rate = rate(
+        lambda key: build_end_entity_certificate(
+            subject, key.public_key(), issuer_key, issuer_cert
+        ),
+        keys,
+    )
+    _verified, verify_rate = rate(
+        lambda cert: verify_certificate_signature(
+            cert, issuer_key.public_key()
+        ),
+        certs,
+    )
+    return {
+        "key_algorithm": key_algorithm,
+        "keygen": keygen_rate,
+        "csr": csr_rate,
+        "sign": sign_rate,
+        "verify": verify_rate,
+    }
+
+
+@click.command(name="benchmark-density")
+@click.option(
+    "--tag",
+    required=False,
+    type=str,
+    default="latest",
+    help="peridiod image tag (Optional)",
+)
+@click.option(
+    "--image-archive",
+    required=False,
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Load the peridiod image from a 'docker save' tarball instead of pulling it (Optional)",
+)
+@click.option(
+    "--step",
+    required=False,
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Devices added per step (Optional)",
+)
+@click.option(
+    "--max-devices",
+    required=False,
+    type=click.IntRange(min=1),
+    default=None,
+    help="Stop after this many devices, defaults to the whole fleet (Optional)",
+)
+@click.option(
+    "--warmup",
+    required=False,
+    type=click.FloatRange(min=0),
+    default=20,
+    show_default=True,
+    help="Seconds new devices get to boot before a step is measured (Optional)",
+)
+@click.option(
+    "--window",
+    required=False,
+    type=click.FloatRange(min=1),
+    default=30,
+    show_default=True,
+    help="Seconds of release polling measured per step (Optional)",
+)
+@click.option(
+    "--tolerance",
+    required=False,
+    type=click.FloatRange(min=0),
+    default=0.2,
+    show_default=True,
+    help="Fraction by which the p95 poll interval may exceed release_poll_interval (Optional)",
+)
+@click.option(
+    "--poll-pattern",
+    required=False,
+    type=str,
+    default=DEFAULT_POLL_PATTERN,
+    show_default=True,
+    help="Regular expression matching the peridiod log line of a release poll (Optional)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONTAINER_JOBS,
+    show_default=True,
+    help="Maximum number of concurrent Docker calls (Optional)",
+)
+@click.option(
+    "--keep/--no-keep",
+    default=False,
+    show_default=True,
+    help="Leave the devices the benchmark started running (Optional)",
+)
+@resource_limit_options
+def benchmark_density(
+    tag,
+    image_archive,
+    step,
+    max_devices,
+    warmup,
+    window,
+    tolerance,
+    poll_pattern,
+    jobs,
+    keep,
+    cpu_shares,
+    cpus,
+    memory,
+    cpuset_cpus,
+    pids_limit,
+    max_containers,
+):
+    container_client = get_container_client(jobs)
+    image_tag = f"docker.io/peridio/peridiod:{tag}"
+    image = get_device_image(container_client, image_tag, image_archive)
+    if image is None:
+        return
+
+    limits = get_container_resource_limits(
+        cpu_shares, cpus, memory, cpuset_cpus, pids_limit
+    )
+    devices = read_fleet()[:max_devices]
+    expected = peridio_json_template["release_poll_interval"] / 1000
+    pattern = re.compile(poll_pattern)
+    devices_path = os.path.join(get_config_path(), "evk-data", "devices")
+    started = {}
+    steps = []
+    try:
+        for count in range(step, len(devices) + step, step):
+            count = min(count, len(devices))
+            log_task(f"Density Step: {count} devices")
+            _results, step_started = start_device_containers(
+                container_client,
+                devices[len(started) : count],
+                image_tag,
+                jobs,
+                limits,
+                max_containers,
+            )
+            started.update(step_started)
+            time.sleep(warmup)
+            window_start = time.time()
+            time.sleep(window)
+
+            containers = [container for container, _ in started.values()]
+            intervals, silent = measure_poll_intervals(
+                containers, window_start, pattern, jobs
+            )
+            statuses = run_parallel(
+                lambda identifier: get_device_status(
+                    identifier, started[identifier][0], devices_path
+                ),
+                sorted(started),
+                jobs,
+            )
+            summary = latency_summary(intervals)
+            result = {
+                "devices": len(started),
+                "poll_interval": summary,
+                "silent_devices": silent,
+                "cpu_percent": sum(s["cpu_percent"] or 0 for s in statuses),
+                "memory_bytes": sum(s["memory_bytes"] or 0 for s in statuses),
+                "degraded": bool(silent)
+                or summary["p95"] > expected * (1 + tolerance),
+            }
+            steps.append(result)
+            log_info(
+                f"{result['devices']} devices: poll interval p50 {summary['p50']:.2f}s, p95 {summary['p95']:.2f}s, max {summary['max']:.2f}s, "
+                f"{silent} silent, {result['cpu_percent']:.1f}% CPU, {result['memory_bytes'] / (1024 * 1024):.1f} MiB"
+            )
+            if result["degraded"] or len(started) < count:
+                break
+    finally:
+        if not keep and started:
+            log_task("Stopping Benchmark Devices")
+            run_parallel(
+                lambda entry: entry[0].stop(timeout=0),
+                started.values(),
+                jobs,
+            )
+
+    sustained = [s["devices"] for s in steps if not s["degraded"]]
+    if sustained:
+        log_info(
+            f"Sustained {max(sustained)} devices within {tolerance:.0%} of the {expected:.0f}s release poll interval"
+        )
+    else:
+        log_error("Release polling degraded at the first step")
+    report_path = os.path.join(
+        get_config_path(), "evk-data", "density-report.json"
+    )
+    write_json_file(
+        report_path,
+        {
+            "image": image_tag,
+            "limits": limits,
+            "expected_poll_interval": expected,
+            "tolerance": tolerance,
+            "sustained_devices": max(sustained) if sustained else 0,
+            "steps": steps,
+        },
+    )
+
+
+def measure_poll_intervals(containers, since, pattern, jobs):
+    """
+    Return the seconds between consecutive release polls logged by each
+    container since the given time, and the number of containers that
+    logged fewer than two polls.
+    """
+
+    def intervals(container):
+        logs = container.logs(timestamps=True, since=int(since))
+        times = []
+        for line in iter_log_lines([logs]):
+            timestamp, _, message = line.partition(" ")
+            if pattern.search(message):
+                try:
+                    times.append(parse_log_timestamp(timestamp))
+                except ValueError:
+                    continue
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+
+    results = run_parallel(intervals, containers, jobs)
+    silent = sum(1 for result in results if not result)
+    return [interval for result in results for interval in result], silent
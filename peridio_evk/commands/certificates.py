@@ -0,0 +1,85 @@
+import click
+import json
+import time
+from datetime import datetime, timezone
+from peridio_evk.inventory import (
+    CERTIFICATE_ROLES,
+    query_certificates,
+    update_certificate_inventory,
+)
+from peridio_evk.log import log_info
+
+
+@click.command()
+@click.option(
+    "--role",
+    required=False,
+    type=click.Choice(sorted(CERTIFICATE_ROLES.values())),
+    default=None,
+    help="Only list certificates of this role (Optional)",
+)
+@click.option(
+    "--expiring-within",
+    required=False,
+    type=click.IntRange(min=0),
+    default=None,
+    help="Only list certificates that expire within this many days (Optional)",
+)
+@click.option(
+    "--issuer",
+    required=False,
+    type=str,
+    default=None,
+    help="Only list certificates whose issuer name contains this text (Optional)",
+)
+@click.option(
+    "--subject",
+    required=False,
+    type=str,
+    default=None,
+    help="Only list certificates whose subject name contains this text (Optional)",
+)
+@click.option(
+    "--serial",
+    required=False,
+    type=str,
+    default=None,
+    help="Only list the certificate with this decimal or 0x-prefixed serial (Optional)",
+)
+@click.option(
+    "--refresh/--no-refresh",
+    default=True,
+    show_default=True,
+    help="Re-index certificate files that changed before querying (Optional)",
+)
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="Print the matching records as JSON (Optional)",
+)
+def certificates(
+    role, expiring_within, issuer, subject, serial, refresh, as_json
+):
+    start = time.perf_counter()
+    if refresh:
+        indexed = update_certificate_inventory()
+        if not as_json:
+            log_info(f"Indexed {indexed} changed certificates")
+
+    records = query_certificates(role, expiring_within, issuer, serial, subject)
+    if as_json:
+        click.echo(json.dumps(records, indent=2))
+        return
+
+    for record in records:
+        not_after = datetime.fromtimestamp(
+            record["not_after"], timezone.utc
+        ).strftime("%Y-%m-%d")
+        click.echo(
+            f"{record['role']:<12} {not_after}  {record['key_type']:<8} {record['subject']:<40} {record['path']}"
+        )
+    log_info(
+        f"{len(records)} certificates in {(time.perf_counter() - start) * 1000:.1f}ms"
+    )
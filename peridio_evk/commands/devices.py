@@ -1,25 +1,64 @@
 import click
 import sys
-import select
-import termios
-import tty
 import uuid
 import json
 import hashlib
 import base64
+import time
+import re
+import threading
+from datetime import datetime, timezone
 from peridio_evk.log import *
 from peridio_evk.utils import *
 from peridio_evk.uboot_env import *
 from peridio_evk.crypto import *
+from peridio_evk.attach import attach_exec
+from peridio_evk.device_logs import DEFAULT_QUEUE_LINES, LogMultiplexer, iter_log_lines, open_log_file, write_log_line
+from peridio_evk.issuer import issue_certificates, write_issued_files
+from peridio_evk.inventory import update_certificate_inventory, get_certificate_record, query_certificates
+from peridio_evk.executor import run_parallel, latency_summary, RateLimiter, DEFAULT_JOBS
+from peridio_evk.api import use_backend
+from peridio_evk.state import state_get, state_put
 
-devices = [
-    {'identifier': 'EI-ML-0001', 'target': 'arm64-v8', 'tags': ['canary']},
-    {'identifier': 'EI-ML-0002', 'target': 'arm64-v8', 'tags': ['canary']},
-    {'identifier': 'EI-ML-0003', 'target': 'arm64-v8', 'tags': []},
-    {'identifier': 'EI-ML-0004', 'target': 'arm64-v8', 'tags': []},
-    {'identifier': 'EI-ML-0005', 'target': 'arm64-v8', 'tags': []},
-    {'identifier': 'EI-ML-0006', 'target': 'arm64-v8', 'tags': []}
-]
+DEFAULT_DEVICE_COUNT = 6
+DEFAULT_DEVICE_IDENTIFIER_PATTERN = 'EI-ML-{index:04d}'
+DEFAULT_DEVICE_TAG_RATIOS = {'canary': 1 / 3}
+
+def generate_devices(count=DEFAULT_DEVICE_COUNT, identifier_pattern=DEFAULT_DEVICE_IDENTIFIER_PATTERN, tag_ratios=DEFAULT_DEVICE_TAG_RATIOS, target='arm64-v8'):
+    """
+    Generate a fleet of virtual devices.
+
+    identifier_pattern is formatted with the 1-based device index. Each tag
+    in tag_ratios is given to the first round(count * ratio) devices, so the
+    default fleet is EI-ML-0001 to EI-ML-0006 with the first two tagged as
+    canaries.
+    """
+    tag_counts = {tag: round(count * ratio) for tag, ratio in tag_ratios.items()}
+    return [
+        {'identifier': identifier_pattern.format(index=index), 'target': target, 'tags': [tag for tag, tag_count in tag_counts.items() if index <= tag_count]}
+        for index in range(1, count + 1)
+    ]
+
+devices = generate_devices()
+
+def get_environment_manifest_path():
+    return os.path.join(get_config_path(), 'evk-data', 'device-environments.json')
+
+def get_fleet_path():
+    return os.path.join(get_config_path(), 'evk-data', 'fleet.json')
+
+def write_fleet(devices):
+    fleet_path = get_fleet_path()
+    os.makedirs(os.path.dirname(fleet_path), exist_ok=True)
+    if read_json_file(fleet_path) != {'devices': devices}:
+        write_json_file(fleet_path, {'devices': devices})
+
+def read_fleet():
+    """
+    Return the fleet written by initialize, or the default fleet if the EVK
+    predates the fleet manifest.
+    """
+    return read_json_file(get_fleet_path()).get('devices', devices)
 
 peridio_json_template = {
   "version": 1,
@@ -136,38 +175,109 @@ echo "peridio:peridio" | chpasswd
 exec "$@"
 """
 
-fw_env = "/etc/peridiod/uboot.env 0x0000 0x20000"
+# Devices keep a redundant environment: two copies with flag bytes, so an
+# interrupted update falls back to the previous copy.
+uboot_env_size = 0x20000
+fw_env = format_fw_env_config('/etc/peridiod/uboot.env', uboot_env_layout(uboot_env_size, redundant=True))
 
-@click.command(name='devices-start')
-@click.option(
-    "--tag",
-    required=False,
-    type=str,
-    default="latest",
-    help="peridiod image tag (Optional)",
-)
-def devices_start(tag):
-    container_client = get_container_client()
-    log_task('Starting Virtual Devices')
-    image_tag = f'docker.io/peridio/peridiod:{tag}'
-    log_info(f"Pulling image: {image_tag}")
-    image = container_client.images.pull(image_tag)
+DEFAULT_CONTAINER_JOBS = 16
+DEFAULT_READY_PATTERN = r'(?i)\bconnected\b'
 
-    if not bool(image.id):
-        log_error("Invalid Image Tag")
-        return
+def resource_limit_options(command):
+    """
+    Add the container resource limit options shared by devices-start and
+    benchmark-density.
+    """
+    options = [
+        click.option(
+            "--cpu-shares",
+            required=False,
+            type=click.IntRange(min=2),
+            default=None,
+            help="Relative CPU weight of each device container (Optional)",
+        ),
+        click.option(
+            "--cpus",
+            required=False,
+            type=click.FloatRange(min=0.01),
+            default=None,
+            help="CPU quota of each device container, in CPUs (Optional)",
+        ),
+        click.option(
+            "--memory",
+            required=False,
+            type=str,
+            default=None,
+            help="Memory limit of each device container, for example 128m (Optional)",
+        ),
+        click.option(
+            "--cpuset-cpus",
+            required=False,
+            type=str,
+            default=None,
+            help="CPUs device containers are pinned to, for example 0-3 (Optional)",
+        ),
+        click.option(
+            "--pids-limit",
+            required=False,
+            type=click.IntRange(min=1),
+            default=None,
+            help="Maximum number of processes in each device container (Optional)",
+        ),
+        click.option(
+            "--max-containers",
+            required=False,
+            type=click.IntRange(min=0),
+            default=None,
+            help="Maximum number of device containers on this host (Optional)",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
 
-    config_path = get_config_path()
-    devices_path = os.path.join(config_path, 'evk-data', 'devices')
+def get_container_resource_limits(cpu_shares=None, cpus=None, memory=None, cpuset_cpus=None, pids_limit=None):
+    """
+    Return the containers.run keyword arguments for the given limits,
+    leaving out the ones that are not set.
+    """
+    limits = {
+        'cpu_shares': cpu_shares,
+        'nano_cpus': int(cpus * 1e9) if cpus else None,
+        'mem_limit': memory,
+        'cpuset_cpus': cpuset_cpus,
+        'pids_limit': pids_limit,
+    }
+    return {key: value for key, value in limits.items() if value is not None}
 
-    for device in devices:
+def start_device_containers(container_client, devices, image_tag, jobs=DEFAULT_CONTAINER_JOBS, limits=None, max_containers=None):
+    """
+    Start a container for every device that does not have one yet.
+
+    At most max_containers device containers, counting the ones that
+    already exist, are left on the host; devices beyond that are reported
+    as capped. Returns the (identifier, status, seconds) results and a dict
+    of the started devices' identifier to (container, started_at).
+    """
+    devices_path = os.path.join(get_config_path(), 'evk-data', 'devices')
+    existing = {container.name for container in list_device_containers(container_client, all=True)}
+    slots = None if max_containers is None else max(max_containers - len(existing), 0)
+    slots_lock = threading.Lock()
+    started = {}
+
+    def start(device):
+        nonlocal slots
         container_name = f'peridio-{device["identifier"]}'
-        try:
-            container_client.containers.get(container_name)
+        if container_name in existing:
             log_info(f'Device {device["identifier"]} container already started')
-            continue
-        except Exception as e:
-            log_info(f'Starting Device {device["identifier"]}')
+            return device['identifier'], 'skipped', None
+        with slots_lock:
+            if slots is not None:
+                if slots == 0:
+                    return device['identifier'], 'capped', None
+                slots -= 1
+        start_time = time.monotonic()
+        started_at = time.time()
         try:
             device_path = os.path.join(devices_path, device['identifier'])
             volumes = [
@@ -178,7 +288,7 @@ def devices_start(tag):
             }
             entrypoint = ['/etc/peridiod/entrypoint.sh']
             cmd = ["/opt/peridiod/bin/peridiod", "start_iex"]
-            container_client.containers.run(
+            container = container_client.containers.run(
                 image_tag,
                 stdin_open=True,
                 tty=True,
@@ -190,64 +300,807 @@ def devices_start(tag):
                 entrypoint=entrypoint,
                 cap_add=["NET_ADMIN"],
                 security_opt=["disable"],
-                command=cmd
+                command=cmd,
+                **(limits or {})
             )
         except Exception as e:
-          log_error(f'error {e}')
+            log_error(f'Device {device["identifier"]} error {e}')
+            return device['identifier'], 'failed', time.monotonic() - start_time
+        elapsed = time.monotonic() - start_time
+        log_info(f'Started Device {device["identifier"]} in {elapsed:.2f}s')
+        started[device['identifier']] = (container, started_at)
+        return device['identifier'], 'started', elapsed
+
+    results = run_parallel(start, devices, jobs)
+    capped = sum(1 for _identifier, status, _elapsed in results if status == 'capped')
+    if capped:
+        log_info(f'{capped} devices not started, the host is limited to {max_containers} device containers')
+    return results, started
+
+@click.command(name='devices-start')
+@click.option(
+    "--tag",
+    required=False,
+    type=str,
+    default="latest",
+    help="peridiod image tag (Optional)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONTAINER_JOBS,
+    show_default=True,
+    help="Maximum number of containers started at once (Optional)",
+)
+@click.option(
+    "--image-archive",
+    required=False,
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Load the peridiod image from a 'docker save' tarball instead of pulling it (Optional)",
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    default=False,
+    help="Wait for started devices to become ready and report their startup latency (Optional)",
+)
+@click.option(
+    "--wait-timeout",
+    required=False,
+    type=click.FloatRange(min=0),
+    default=120,
+    show_default=True,
+    help="Seconds a device has to become ready with --wait (Optional)",
+)
+@click.option(
+    "--ready-pattern",
+    required=False,
+    type=str,
+    default=DEFAULT_READY_PATTERN,
+    show_default=True,
+    help="Regular expression matching the peridiod log line that marks a device ready (Optional)",
+)
+@resource_limit_options
+def devices_start(tag, jobs, image_archive, wait, wait_timeout, ready_pattern, cpu_shares, cpus, memory, cpuset_cpus, pids_limit, max_containers):
+    container_client = get_container_client(jobs)
+    log_task('Starting Virtual Devices')
+    image_tag = f'docker.io/peridio/peridiod:{tag}'
+    image = get_device_image(container_client, image_tag, image_archive)
+
+    if image is None or not bool(image.id):
+        log_error("Invalid Image Tag")
+        return
+
+    config_path = get_config_path()
+    limits = get_container_resource_limits(cpu_shares, cpus, memory, cpuset_cpus, pids_limit)
+    start_time = time.monotonic()
+    results, started = start_device_containers(container_client, read_fleet(), image_tag, jobs, limits, max_containers)
+    log_container_summary('Started', results, time.monotonic() - start_time, 'started')
+
+    if wait and started:
+        log_task('Waiting For Virtual Devices')
+        ready_results = wait_for_devices(started, re.compile(ready_pattern), wait_timeout, jobs)
+        log_container_summary('Ready', ready_results, time.monotonic() - start_time, 'ready')
+        write_json_file(os.path.join(config_path, 'evk-data', 'startup-report.json'), {
+            'image': image_tag,
+            'image_id': image.id,
+            'ready_pattern': ready_pattern,
+            'summary': latency_summary([elapsed for _identifier, status, elapsed in ready_results if status == 'ready']),
+            'devices': {identifier: {'status': status, 'seconds': elapsed} for identifier, status, elapsed in ready_results},
+        })
 
 @click.command(name='devices-stop')
-def devices_stop():
-    container_client = get_container_client()
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONTAINER_JOBS,
+    show_default=True,
+    help="Maximum number of containers stopped at once (Optional)",
+)
+@click.option(
+    "--stop-timeout",
+    required=False,
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="Seconds to wait for a device to exit before it is killed (Optional)",
+)
+def devices_stop(jobs, stop_timeout):
+    container_client = get_container_client(jobs)
     log_task('Stopping Virtual Devices')
-    for device in devices:
-        container_name = f'peridio-{device["identifier"]}'
-        try:
-            container = container_client.containers.get(container_name)
-            log_info(f'Stopping {device["identifier"]}')
-            container.stop()
-        except:
+    running = {container.name: container for container in list_device_containers(container_client)}
+
+    def stop(device):
+        container = running.get(f'peridio-{device["identifier"]}')
+        if container is None:
             log_info(f'Device {device["identifier"]} container already stopped')
+            return device['identifier'], 'skipped', None
+        start_time = time.monotonic()
+        try:
+            container.stop(timeout=stop_timeout)
+        except Exception as e:
+            log_error(f'Device {device["identifier"]} error {e}')
+            return device['identifier'], 'failed', time.monotonic() - start_time
+        elapsed = time.monotonic() - start_time
+        log_info(f'Stopped Device {device["identifier"]} in {elapsed:.2f}s')
+        return device['identifier'], 'stopped', elapsed
+
+    start_time = time.monotonic()
+    results = run_parallel(stop, read_fleet(), jobs)
+    log_container_summary('Stopped', results, time.monotonic() - start_time, 'stopped')
+
+def parse_log_timestamp(timestamp):
+    # Docker prefixes log lines with RFC 3339 UTC timestamps that carry
+    # nanoseconds, which datetime cannot parse.
+    seconds, _, fraction = timestamp.rstrip('Z').partition('.')
+    parsed = datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return parsed.timestamp() + (float(f'0.{fraction}') if fraction else 0.0)
+
+def wait_for_device(container, started_at, ready_pattern, timeout):
+    """
+    Follow a device's logs until a line matches ready_pattern, the container
+    exits or timeout seconds have passed since started_at. Returns the
+    status and the seconds from started_at to the matching line, taken from
+    the line's Docker timestamp so the result does not depend on when the
+    logs are read.
+    """
+    deadline = started_at + timeout
+    stream = container.logs(stream=True, follow=True, timestamps=True)
+    # A blocked read only ends when the stream is closed.
+    timer = threading.Timer(max(deadline - time.time(), 0.5), stream.close)
+    timer.start()
+    try:
+        for line in iter_log_lines(stream):
+            timestamp, _, message = line.partition(' ')
+            try:
+                logged_at = parse_log_timestamp(timestamp)
+            except ValueError:
+                continue
+            if logged_at > deadline:
+                return 'timeout', None
+            if ready_pattern.search(message):
+                return 'ready', max(logged_at - started_at, 0.0)
+    except Exception:
+        pass
+    finally:
+        timer.cancel()
+        stream.close()
+    return ('timeout', None) if time.time() >= deadline else ('exited', None)
+
+def wait_for_devices(started, ready_pattern, timeout, jobs=DEFAULT_CONTAINER_JOBS):
+    """
+    Wait for started devices, a dict of identifier to (container,
+    started_at), to become ready. Returns (identifier, status, seconds)
+    tuples.
+    """
+    def wait(identifier):
+        container, started_at = started[identifier]
+        status, elapsed = wait_for_device(container, started_at, ready_pattern, timeout)
+        if status == 'ready':
+            log_info(f'Device {identifier} ready in {elapsed:.2f}s')
+        else:
+            log_error(f'Device {identifier} not ready: {status}')
+        return identifier, status, elapsed
+
+    return run_parallel(wait, sorted(started), jobs)
+
+def get_device_image(container_client, image_tag, image_archive=None):
+    """
+    Return the local peridiod image for image_tag, pulling it only when it
+    is missing or the registry has a different digest for the tag.
+
+    With image_archive the image is loaded from a 'docker save' tarball and
+    the registry is never contacted. When the registry cannot be reached a
+    local image is used as is.
+    """
+    if image_archive is not None:
+        log_info(f'Loading image archive: {image_archive}')
+        with open(image_archive, 'rb') as f:
+            images = container_client.images.load(f)
+        repository_tag = image_tag.removeprefix('docker.io/')
+        for image in images:
+            if image_tag in image.tags or repository_tag in image.tags:
+                return image
+        log_error(f'{image_archive} does not contain {image_tag}, found: {", ".join(tag for image in images for tag in image.tags)}')
+        return None
+
+    try:
+        local_image = container_client.images.get(image_tag)
+    except Exception:
+        local_image = None
+
+    if local_image is not None:
+        try:
+            remote_digest = container_client.images.get_registry_data(image_tag).id
+        except Exception as e:
+            log_info(f'Registry unavailable, using local image {image_tag}: {e}')
+            return local_image
+        local_digests = [digest.split('@', 1)[1] for digest in local_image.attrs.get('RepoDigests', []) if '@' in digest]
+        if remote_digest in local_digests:
+            log_info(f'Image up to date: {image_tag} ({remote_digest[:19]})')
+            return local_image
+
+    log_info(f"Pulling image: {image_tag}")
+    return container_client.images.pull(image_tag)
+
+def list_device_containers(container_client, all=False):
+    """
+    Return the EVK's device containers in one API call instead of looking
+    each device up by name.
+    """
+    return [container for container in container_client.containers.list(all=all, filters={'name': 'peridio-'}) if container.name.startswith('peridio-')]
+
+def log_container_summary(action, results, seconds, success):
+    counts = {}
+    for _identifier, status, _elapsed in results:
+        counts[status] = counts.get(status, 0) + 1
+    summary = latency_summary([elapsed for _identifier, status, elapsed in results if status == success])
+    others = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()) if status != success)
+    log_info(f'{action}: {summary["count"]}/{len(results)} devices in {seconds:.2f}s' + (f' ({others})' if others else ''))
+    if summary['count']:
+        log_info(f'Latency p50 {summary["p50"]:.2f}s, p95 {summary["p95"]:.2f}s, max {summary["max"]:.2f}s')
+
+@click.command(name='devices-status')
+@click.option(
+    "--device",
+    "device_identifiers",
+    required=False,
+    multiple=True,
+    help="Device to report, may be repeated, defaults to the whole fleet (Optional)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONTAINER_JOBS,
+    show_default=True,
+    help="Maximum number of containers sampled at once (Optional)",
+)
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="Print the status as JSON (Optional)",
+)
+def devices_status(device_identifiers, jobs, as_json):
+    container_client = get_container_client(jobs)
+    running = {container.name: container for container in list_device_containers(container_client, all=True)}
+    identifiers = device_identifiers or [device['identifier'] for device in read_fleet()]
+    devices_path = os.path.join(get_config_path(), 'evk-data', 'devices')
+    start_time = time.monotonic()
+    statuses = run_parallel(lambda identifier: get_device_status(identifier, running.get(f'peridio-{identifier}'), devices_path), identifiers, jobs)
+
+    if as_json:
+        click.echo(json.dumps(statuses, indent=2))
+        return
+
+    width = max([len('DEVICE')] + [len(identifier) for identifier in identifiers])
+    click.echo(f"{'DEVICE':<{width}} {'STATE':<10} {'UPTIME':>9} {'CPU%':>6} {'MEMORY':>9} {'NET RX':>9} {'NET TX':>9}  {'VERSION':<10} RELEASE")
+    for status in statuses:
+        click.echo(
+            f"{status['identifier']:<{width}} {status['state']:<10} {format_duration(status['uptime']):>9} "
+            f"{format_percent(status['cpu_percent']):>6} {format_size(status['memory_bytes']):>9} "
+            f"{format_size(status['rx_bytes']):>9} {format_size(status['tx_bytes']):>9}  "
+            f"{status['peridio_vsn_current'] or '-':<10} {status['peridio_rel_current'] or '-'}"
+        )
+    states = {}
+    for status in statuses:
+        states[status['state']] = states.get(status['state'], 0) + 1
+    memory = sum(status['memory_bytes'] or 0 for status in statuses)
+    cpu = sum(status['cpu_percent'] or 0 for status in statuses)
+    log_info(f"{len(statuses)} devices ({', '.join(f'{count} {state}' for state, count in sorted(states.items()))}), {cpu:.1f}% CPU, {format_size(memory)} memory, sampled in {time.monotonic() - start_time:.2f}s")
+
+def get_device_status(identifier, container, devices_path):
+    """
+    Return the container state, uptime and resource usage of a device
+    together with the release recorded in its U-Boot environment. Stats
+    come from one non-streaming Docker stats call, which includes the
+    previous CPU sample needed for a CPU percentage.
+    """
+    status = {
+        'identifier': identifier,
+        'state': 'stopped',
+        'uptime': None,
+        'cpu_percent': None,
+        'memory_bytes': None,
+        'memory_limit': None,
+        'rx_bytes': None,
+        'tx_bytes': None,
+        'peridio_rel_current': None,
+        'peridio_vsn_current': None,
+    }
+    try:
+        env_vars = read_uboot_env(os.path.join(devices_path, identifier, 'uboot.env'))
+        status['peridio_rel_current'] = env_vars.get('peridio_rel_current')
+        status['peridio_vsn_current'] = env_vars.get('peridio_vsn_current')
+    except (OSError, ValueError):
+        pass
+
+    if container is None:
+        return status
+    state = container.attrs.get('State', {})
+    status['state'] = state.get('Status', container.status)
+    if status['state'] != 'running':
+        return status
+    try:
+        status['uptime'] = max(time.time() - parse_log_timestamp(state['StartedAt']), 0.0)
+    except (KeyError, ValueError):
+        pass
+    try:
+        status.update(summarize_container_stats(container.stats(stream=False)))
+    except Exception as e:
+        log_error(f'Device {identifier} stats unavailable: {e}')
+    return status
+
+def summarize_container_stats(stats):
+    cpu_stats = stats.get('cpu_stats', {})
+    precpu_stats = stats.get('precpu_stats', {})
+    cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    cpu_percent = cpu_delta / system_delta * online_cpus * 100 if cpu_delta > 0 and system_delta > 0 else 0.0
+
+    # Like 'docker stats', page cache that can be reclaimed is not counted.
+    memory_stats = stats.get('memory_stats', {})
+    memory_detail = memory_stats.get('stats', {})
+    cache = memory_detail.get('inactive_file', memory_detail.get('total_inactive_file', memory_detail.get('cache', 0)))
+    networks = (stats.get('networks') or {}).values()
+    return {
+        'cpu_percent': cpu_percent,
+        'memory_bytes': max(memory_stats.get('usage', 0) - cache, 0),
+        'memory_limit': memory_stats.get('limit'),
+        'rx_bytes': sum(network.get('rx_bytes', 0) for network in networks),
+        'tx_bytes': sum(network.get('tx_bytes', 0) for network in networks),
+    }
+
+def format_size(byte_count):
+    if byte_count is None:
+        return '-'
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if byte_count < 1024 or unit == 'GiB':
+            return f'{byte_count:.0f}{unit}' if unit == 'B' else f'{byte_count:.1f}{unit}'
+        byte_count /= 1024
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    if seconds < 3600:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    if seconds < 86400:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    return f'{seconds // 86400}d{seconds % 86400 // 3600:02d}h'
+
+def format_percent(percent):
+    return '-' if percent is None else f'{percent:.1f}'
+
+DEVICE_LOG_COLORS = ['cyan', 'magenta', 'yellow', 'blue', 'green', 'bright_cyan', 'bright_magenta', 'bright_yellow', 'bright_blue', 'bright_green']
+
+@click.command(name='devices-logs')
+@click.option(
+    "--device",
+    "device_identifiers",
+    required=False,
+    multiple=True,
+    help="Device to follow, may be repeated, defaults to every running device (Optional)",
+)
+@click.option(
+    "--tail",
+    required=False,
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="Number of past lines to show per device (Optional)",
+)
+@click.option(
+    "--follow/--no-follow",
+    default=True,
+    show_default=True,
+    help="Keep streaming new lines until interrupted (Optional)",
+)
+@click.option(
+    "--timestamps",
+    is_flag=True,
+    default=False,
+    help="Prefix lines with their Docker timestamp (Optional)",
+)
+@click.option(
+    "--output",
+    required=False,
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Also write lines to this file, rotating it by size (Optional)",
+)
+@click.option(
+    "--max-bytes",
+    required=False,
+    type=click.IntRange(min=0),
+    default=10 * 1024 * 1024,
+    show_default=True,
+    help="Size at which --output is rotated, 0 disables rotation (Optional)",
+)
+@click.option(
+    "--backup-count",
+    required=False,
+    type=click.IntRange(min=0),
+    default=5,
+    show_default=True,
+    help="Number of rotated --output files to keep (Optional)",
+)
+@click.option(
+    "--terminal/--no-terminal",
+    default=True,
+    show_default=True,
+    help="Print lines to the terminal (Optional)",
+)
+@click.option(
+    "--queue-lines",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_QUEUE_LINES,
+    show_default=True,
+    help="Lines buffered per device before its stream is paused (Optional)",
+)
+def devices_logs(device_identifiers, tail, follow, timestamps, output, max_bytes, backup_count, terminal, queue_lines):
+    if not terminal and output is None:
+        raise click.UsageError('--no-terminal requires --output')
+    container_client = get_container_client()
+    running = {container.name: container for container in list_device_containers(container_client)}
+    identifiers = device_identifiers or [device['identifier'] for device in read_fleet() if f'peridio-{device["identifier"]}' in running]
+    containers = {}
+    for identifier in identifiers:
+        if f'peridio-{identifier}' in running:
+            containers[identifier] = running[f'peridio-{identifier}']
+        else:
+            log_info(f'Device {identifier} not running')
+    if not containers:
+        log_error('No running devices to follow')
+        sys.exit(1)
+
+    log_task(f'Following {len(containers)} Device Logs')
+    multiplexer = LogMultiplexer(queue_lines)
+    streams = {}
+    width = max(len(identifier) for identifier in containers)
+    colors = {identifier: DEVICE_LOG_COLORS[index % len(DEVICE_LOG_COLORS)] for index, identifier in enumerate(containers)}
+    handler = open_log_file(output, max_bytes, backup_count) if output else None
+
+    def read(identifier):
+        try:
+            for line in iter_log_lines(streams[identifier]):
+                if not multiplexer.put(identifier, line):
+                    break
+        except Exception:
+            pass
+        finally:
+            multiplexer.close_source(identifier)
+
+    readers = []
+    for identifier, container in containers.items():
+        streams[identifier] = container.logs(stream=True, follow=follow, tail=tail, timestamps=timestamps)
+        multiplexer.add_source(identifier)
+        reader = threading.Thread(target=read, args=(identifier,), daemon=True)
+        reader.start()
+        readers.append(reader)
+
+    try:
+        while True:
+            batch = multiplexer.get_batch()
+            if batch is None:
+                break
+            for identifier, line in batch:
+                if terminal:
+                    click.echo(f"{click.style(identifier.ljust(width), fg=colors[identifier])} | {line}")
+                if handler:
+                    write_log_line(handler, f'{identifier.ljust(width)} | {line}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        multiplexer.close()
+        for stream in streams.values():
+            stream.close()
+        if handler:
+            handler.close()
 
 @click.argument('device_identifier')
+@click.option(
+    "--record",
+    required=False,
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Record the session to an asciicast file playable with 'asciinema play' (Optional)",
+)
 @click.command(name='device-attach')
-def device_attach(device_identifier):
+def device_attach(device_identifier, record):
     container_client = get_container_client()
     try:
         container = container_client.containers.get(f'peridio-{device_identifier}')
-        log_task(f'Attaching To Container {device_identifier}')
-        exec_instance = container.exec_run('/bin/bash', tty=True, stream=True, socket=True, detach=False, stdin=True)
-        old_tty_settings = termios.tcgetattr(sys.stdin)
-        sock = exec_instance.output
+    except Exception:
+        log_info(f'Device {device_identifier} not running')
+        return
+
+    log_task(f'Attaching To Container {device_identifier}')
+    # The low-level API exposes the exec id, which resizing the TTY needs.
+    api = container_client.api
+    exec_id = api.exec_create(container.id, '/bin/bash', stdin=True, tty=True, environment={'TERM': os.environ.get('TERM', 'xterm')})['Id']
+    sock = api.exec_start(exec_id, tty=True, socket=True)
+    log_info("Attached to the container")
+    try:
+        attach_exec(api, exec_id, sock._sock, record)
+    finally:
+        sock.close()
+    if record:
+        log_modify_file(record)
+
+
+
+@click.command(name='device-env')
+@click.argument('device_identifier')
+@click.argument('name', required=False)
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="Print the variables as JSON (Optional)",
+)
+def device_env(device_identifier, name, as_json):
+    env_file_path = os.path.join(get_config_path(), 'evk-data', 'devices', device_identifier, 'uboot.env')
+    try:
+        env_vars = read_uboot_env(env_file_path)
+    except FileNotFoundError:
+        log_error(f'Device {device_identifier} has no environment')
+        sys.exit(1)
+    except UBootEnvError as e:
+        log_error(f'{env_file_path}: {e}')
+        sys.exit(1)
+
+    if name is not None:
+        if name not in env_vars:
+            log_error(f'{name} is not set')
+            sys.exit(1)
+        env_vars = {name: env_vars[name]}
+    if as_json:
+        click.echo(json.dumps(env_vars, indent=2))
+    elif name is not None:
+        click.echo(env_vars[name])
+    else:
+        for key, value in env_vars.items():
+            click.echo(f'{key}={value}')
+
+@click.command(name='devices-env-set')
+@click.argument('assignments', nargs=-1)
+@click.option(
+    "--device",
+    "device_identifiers",
+    required=False,
+    multiple=True,
+    help="Device to update, may be repeated, defaults to the whole fleet (Optional)",
+)
+@click.option(
+    "--unset",
+    required=False,
+    multiple=True,
+    help="Variable to remove, may be repeated (Optional)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Maximum number of environment files patched at once (Optional)",
+)
+def devices_env_set(assignments, device_identifiers, unset, jobs):
+    updates = {}
+    for assignment in assignments:
+        name, sep, value = assignment.partition('=')
+        if not sep or not name:
+            raise click.BadParameter(f"'{assignment}' is not NAME=VALUE")
+        updates[name] = value
+    for name in unset:
+        updates[name] = None
+    if not updates:
+        raise click.UsageError('Nothing to set or unset')
+
+    devices_path = os.path.join(get_config_path(), 'evk-data', 'devices')
+    identifiers = device_identifiers or [device['identifier'] for device in read_fleet()]
+    log_task('Updating Device Environments')
+    results = patch_uboot_env_files([os.path.join(devices_path, identifier, 'uboot.env') for identifier in identifiers], updates, jobs)
+    failed = [(path, error) for path, error in results if error]
+    for path, error in failed:
+        log_error(f'{path}: {error}')
+    log_info(f'Updated {len(results) - len(failed)}/{len(results)} device environments')
+    if failed:
+        sys.exit(1)
+
+@click.command(name='devices-rotate-certs')
+@click.option(
+    "--within-days",
+    required=False,
+    type=click.IntRange(min=0),
+    default=30,
+    show_default=True,
+    help="Rotate device certificates that expire within this many days (Optional)",
+)
+@click.option(
+    "--product-name",
+    required=False,
+    type=str,
+    default="edge-inference",
+    help="Product Name (Optional)",
+)
+@click.option(
+    "--cohort",
+    required=False,
+    type=str,
+    default="release",
+    show_default=True,
+    help="Cohort whose intermediate CA issues the new certificates (Optional)",
+)
+@click.option(
+    "--rekey",
+    is_flag=True,
+    default=False,
+    help="Generate new device keys instead of re-certifying the existing ones (Optional)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Maximum number of concurrent Peridio Cloud calls (Optional)",
+)
+@click.option(
+    "--rate",
+    required=False,
+    type=click.FloatRange(min=0),
+    default=0,
+    help="Maximum certificate registrations per second, 0 for unlimited (Optional)",
+)
+@click.option(
+    "--backend",
+    required=False,
+    type=click.Choice(["cli", "api"]),
+    default="cli",
+    show_default=True,
+    help="Call Peridio Cloud through the peridio CLI or the built-in API client (Optional)",
+)
+@click.option(
+    "--provisioning",
+    required=False,
+    type=click.Choice(["register", "jitp"]),
+    default="register",
+    show_default=True,
+    help="Register the new certificates, or rely on just-in-time provisioning and make no Peridio Cloud calls (Optional)",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only list the devices that would be rotated (Optional)",
+)
+def devices_rotate_certs(within_days, product_name, cohort, rekey, jobs, rate, backend, provisioning, dry_run):
+    update_certificate_inventory()
+    expiring = query_certificates(role='device', expiring_within=within_days)
+    log_task('Rotating Device Certificates')
+    log_info(f'{len(expiring)} device certificates expire within {within_days} days')
+    if dry_run or not expiring:
+        for record in expiring:
+            log_info(f'{os.path.basename(os.path.dirname(record["path"]))}: {record["path"]}')
+        return
+
+    if provisioning == 'register':
+        use_backend(backend, jobs)
+    report = do_rotate_device_certificates([os.path.dirname(record['path']) for record in expiring], product_name, cohort, rekey, jobs, rate, provisioning == 'jitp')
+    failed = [entry for entry in report if entry['status'] != 'rotated']
+    if failed:
+        sys.exit(1)
+
+ROTATION_CHUNK_SIZE = 100
+
+def do_rotate_device_certificates(device_paths, product_name, cohort, rekey=False, jobs=DEFAULT_JOBS, rate=None, jitp=False):
+    """
+    Reissue the certificates of the given device directories from a cohort's
+    intermediate CA and register them with Peridio Cloud.
+
+    New certificates (and keys with rekey) are issued in batch and staged
+    next to the current files. A device's staged files only replace the
+    current ones, each with an atomic rename, once Peridio Cloud accepted the
+    new certificate, so a failed device keeps working credentials.
+    Registrations are spread over jobs threads, limited to rate per second,
+    and a per-device report is written to evk-data/rotation-report.json.
+    With jitp the staged files are swapped in without any cloud call, as the
+    intermediate CA provisions the new certificates on first connection.
+    """
+    config_path = get_config_path()
+    evk_config = read_evk_config()
+    signer_path = os.path.join(config_path, 'evk-data', 'ca', product_name, cohort)
+    with open(os.path.join(signer_path, 'intermediate-private-key.pem'), 'rb') as f:
+        signer_key_pem = f.read()
+    with open(os.path.join(signer_path, 'intermediate-certificate.pem'), 'rb') as f:
+        signer_cert_pem = f.read()
+
+    paths = {os.path.basename(device_path): device_path for device_path in device_paths}
+    requests = []
+    for device_path in device_paths:
+        key_pem = None
+        if not rekey:
+            with open(os.path.join(device_path, 'device-private-key.pem'), 'rb') as f:
+                key_pem = f.read()
+        requests.append((os.path.basename(device_path), key_pem))
+
+    start = time.perf_counter()
+    staged = {}
+    files = []
+    for identifier, key_pem, cert_pem in issue_certificates(requests, signer_key_pem, signer_cert_pem, key_algorithm=read_key_algorithm('device')):
+        device_path = paths[identifier]
+        staged[identifier] = []
+        for name, content, mode in [('device-private-key.pem', key_pem, 0o600), ('device-certificate.pem', cert_pem, 0o644)]:
+            if content is not None:
+                path = os.path.join(device_path, name)
+                files.append((f'{path}.new', content, mode))
+                staged[identifier].append(path)
+    write_issued_files(files)
+    log_info(f'Issued {len(requests)} certificates in {time.perf_counter() - start:.2f}s')
+
+    limiter = RateLimiter(rate)
+
+    def rotate(device_path):
+        identifier = os.path.basename(device_path)
+        certificate_path = os.path.join(device_path, 'device-certificate.pem')
+        entry = {'identifier': identifier, 'old_serial': get_certificate_record(certificate_path)['serial']}
+        if not jitp:
+            limiter.wait()
         try:
-            # Set terminal to raw mode
-            tty.setraw(sys.stdin.fileno())
-            log_info("Attached to the container")
-            while True:
-                # Wait for either input from the user or output from the container
-                readable, _, _ = select.select([sys.stdin, sock], [], [])
-
-                for r in readable:
-                    if r == sys.stdin:
-                        # Read user input and send it to the container's stdin
-                        user_input = os.read(sys.stdin.fileno(), 1024)
-                        sock._sock.send(user_input)
-                    else:
-                        # Read logs from the container and print them
-                        output = sock._sock.recv(1024)
-                        if not output:
-                            return
-                        output_decoded = output.decode('utf-8')
-                        sys.stdout.write(output_decoded)
-                        sys.stdout.flush()
-        finally:
-            # Restore the terminal settings
-            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_tty_settings)
-            sock.close()
+            return register_rotated_certificate(identifier, certificate_path, entry)
+        except Exception as e:
+            for path in staged[identifier]:
+                if os.path.exists(f'{path}.new'):
+                    os.remove(f'{path}.new')
+            entry.update(status='failed', error=str(e))
+            return entry
 
-    except:
-        log_info(f'Device {device_identifier} not running')
+    def register_rotated_certificate(identifier, certificate_path, entry):
+        if jitp:
+            for path in staged[identifier]:
+                os.replace(f'{path}.new', path)
+            record = get_certificate_record(certificate_path)
+            entry.update(status='rotated', new_serial=record['serial'], not_after=record['not_after'])
+            return entry
+
+        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'device-certificates', 'create', '--device-identifier', identifier, '--product-name', product_name, '--certificate-path', f'{certificate_path}.new'])
+        if result.returncode != 0:
+            raise RuntimeError((result.stderr or result.stdout).strip())
 
+        # Swap the key first so that the certificate on disk never names a
+        # key that is not there yet.
+        for path in staged[identifier]:
+            os.replace(f'{path}.new', path)
+        record = get_certificate_record(certificate_path)
+        device_certificate_prn = json.loads(result.stdout).get('device_certificate', {}).get('prn', '')
+        state_put(evk_config['organization_prn'], 'device-certificate', f'{product_name}:{identifier}:{record["fingerprint"]}', device_certificate_prn)
+        entry.update(status='rotated', new_serial=record['serial'], not_after=record['not_after'], prn=device_certificate_prn)
+        return entry
 
+    report = []
+    for offset in range(0, len(device_paths), ROTATION_CHUNK_SIZE):
+        report.extend(run_parallel(rotate, device_paths[offset:offset + ROTATION_CHUNK_SIZE], jobs))
+        log_info(f'Progress: {len(report)}/{len(device_paths)} devices')
+
+    for entry in report:
+        if entry['status'] == 'rotated':
+            log_info(f'{entry["identifier"]}: rotated, serial {entry["new_serial"]}')
+        else:
+            log_error(f'{entry["identifier"]}: {entry["error"]}')
+    rotated = sum(1 for entry in report if entry['status'] == 'rotated')
+    log_info(f'Rotated {rotated}/{len(report)} device certificates in {time.perf_counter() - start:.2f}s')
+    write_json_file(os.path.join(config_path, 'evk-data', 'rotation-report.json'), report)
+    return report
 
 def do_create_device_environments(devices, release, artifacts, cohorts):
     config_path = get_config_path()
@@ -281,83 +1134,170 @@ def do_create_device_environments(devices, release, artifacts, cohorts):
 
     if not os.path.exists(devices_path):
         log_task(f'Creating Device Environments')
-        os.makedirs(devices_path)
+        os.makedirs(devices_path, exist_ok=True)
 
-    for device in devices:
-        device_path = os.path.join(devices_path, device['identifier'])
-        if not os.path.exists(device_path):
-            os.makedirs(device_path)
+    # Files that are the same for every device are written once to a shared
+    # directory and hardlinked into each device directory.
+    shared_path = os.path.join(config_path, 'evk-data', 'device-shared')
+    peridio_json = dict(peridio_json_template, trusted_signing_keys=[public_key_raw_encoded])
+    shared_files = [
+        ('fw_env.config', fw_env, False),
+        ('entrypoint.sh', custom_entrypoint, True),
+        ('peridio.json', json.dumps(peridio_json, indent=2), False),
+        (os.path.join('hooks', 'pre-up.sh'), peridio_rat_pre_up, True),
+        (os.path.join('hooks', 'pre-down.sh'), peridio_rat_pre_down, True),
+    ]
+    # Outputs are rendered in memory and only written when their content
+    # hash differs from the one recorded when they were last written.
+    manifest_path = get_environment_manifest_path()
+    manifest = read_json_file(manifest_path)
+    written = 0
 
-        device_env = {
-            'peridio_rel_current': release['prn'],
-            'peridio_vsn_current': release['version'],
-            'peridio_bin_current': peridio_bin_installed
-        }
+    def is_current(path, content_hash):
+        return manifest.get(path) == content_hash and os.path.exists(path)
 
-        device_env_path = os.path.join(device_path, 'uboot.env')
-        env_size_hex = int('0x20000', 16)
-        create_uboot_env(device_env, device_env_path, env_size_hex)
+    os.makedirs(os.path.join(shared_path, 'hooks'), exist_ok=True)
+    for name, content, executable in shared_files:
+        shared_file = os.path.join(shared_path, name)
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        if not is_current(shared_file, content_hash):
+            # The rename gives the shared file a new inode, so the links
+            # below are refreshed for every device.
+            write_file_atomic(shared_file, content, executable)
+            manifest[shared_file] = content_hash
+            written += 1
+            log_modify_file(shared_file)
 
-        device_fw_env_config = os.path.join(device_path, 'fw_env.config')
-        with open(device_fw_env_config, "w") as fw_env_config:
-            fw_env_config.write(
-                fw_env
-            )
-
-        entrypoint_file = os.path.join(device_path, 'entrypoint.sh')
-        write_file_x(entrypoint_file, custom_entrypoint)
+    # uboot.env is rewritten by peridiod on each device, so it cannot be
+    # shared; the blob is built once and written sparsely per device.
+    device_env = {
+        'peridio_rel_current': release['prn'],
+        'peridio_vsn_current': release['version'],
+        'peridio_bin_current': peridio_bin_installed
+    }
+    env_data = create_uboot_env_data(device_env, uboot_env_size, redundant=True)
+    env_hash = hashlib.sha256(env_data).hexdigest()
 
-        peridio_json = peridio_json_template
-        peridio_json['trusted_signing_keys'] = [public_key_raw_encoded]
-        peridio_json_path = os.path.join(device_path, 'peridio.json')
-        with open(peridio_json_path, 'w') as file:
-            file.write(json.dumps(peridio_json, indent=2))
+    linked = 0
+    for device in devices:
+        device_path = os.path.join(devices_path, device['identifier'])
+        if not os.path.isdir(os.path.join(device_path, 'hooks')):
+            os.makedirs(os.path.join(device_path, 'hooks'))
 
-        rat_hooks_path = os.path.join(device_path, 'hooks')
-        if not os.path.exists(rat_hooks_path):
-            os.makedirs(rat_hooks_path)
+        # A device keeps the environment peridiod wrote until the rendered
+        # one changes, for example with a new release.
+        device_env_path = os.path.join(device_path, 'uboot.env')
+        if not is_current(device_env_path, env_hash):
+            write_uboot_env_data(env_data, device_env_path, uboot_env_size)
+            manifest[device_env_path] = env_hash
+            written += 1
 
-        pre_up_path = os.path.join(rat_hooks_path, 'pre-up.sh')
-        write_file_x(pre_up_path, peridio_rat_pre_up)
+        for name, _content, _executable in shared_files:
+            if link_file(os.path.join(shared_path, name), os.path.join(device_path, name)):
+                linked += 1
 
-        pre_down_path = os.path.join(rat_hooks_path, 'pre-down.sh')
-        write_file_x(pre_down_path, peridio_rat_pre_down)
+    if written:
+        write_json_file(manifest_path, manifest)
+    log_info(f'Device environments: {len(devices)} devices, {written} files written, {linked} shared files linked')
 
-def do_create_device_certificates(devices, signer_ca):
+def do_create_device_certificates(devices, signer_ca, processes=None):
     config_path = get_config_path()
     devices_path = os.path.join(config_path, 'evk-data', 'devices')
     if not os.path.exists(devices_path):
         log_task(f'Creating Device Environments')
-        os.makedirs(devices_path)
+        os.makedirs(devices_path, exist_ok=True)
 
+    requests = []
     for device in devices:
         device_path = os.path.join(devices_path, device['identifier'])
-        device_key = os.path.join(device_path, 'device-private-key.pem')
+        device['certificate'] = os.path.join(device_path, 'device-certificate.pem')
+        device['private_key'] = os.path.join(device_path, 'device-private-key.pem')
+        if os.path.exists(device['certificate']):
+            continue
+        # Devices left with a signing request by an earlier EVK keep their
+        # key; everything else gets a key generated alongside its certificate.
         device_csr = os.path.join(device_path, 'device-signing-request.pem')
-        device_cert = os.path.join(device_path, 'device-certificate.pem')
-        if not os.path.exists(device_cert):
-            create_end_entity_csr(device['identifier'], device_key, device_csr)
-            log_modify_file(device_key)
-            log_modify_file(device_csr)
-            sign_end_entity_csr(signer_ca['private_key'], signer_ca['certificate'], device_csr, device_cert)
-            log_modify_file(device_cert)
-        device['certificate'] = device_cert
-        device['private_key'] = device_key
+        if os.path.exists(device_csr) and os.path.exists(device['private_key']):
+            with open(device_csr, 'rb') as f:
+                requests.append((device['identifier'], f.read()))
+        else:
+            requests.append((device['identifier'], None))
+
+    if not requests:
+        log_skip_task('Device certificates already exist')
+        return devices
+
+    log_task(f'Issuing Device Certificates')
+    with open(signer_ca['private_key'], 'rb') as f:
+        signer_key_pem = f.read()
+    with open(signer_ca['certificate'], 'rb') as f:
+        signer_cert_pem = f.read()
+
+    start = time.perf_counter()
+    files = []
+    for identifier, key_pem, cert_pem in issue_certificates(requests, signer_key_pem, signer_cert_pem, processes, read_key_algorithm('device')):
+        device_path = os.path.join(devices_path, identifier)
+        if key_pem is not None:
+            files.append((os.path.join(device_path, 'device-private-key.pem'), key_pem, 0o600))
+        files.append((os.path.join(device_path, 'device-certificate.pem'), cert_pem, 0o644))
+    write_issued_files(files)
+    update_certificate_inventory([path for path, _content, _mode in files if path.endswith('certificate.pem')])
+    seconds = time.perf_counter() - start
+    for path, _content, _mode in files:
+        log_modify_file(path)
+    log_info(f'Issued {len(requests)} certificates in {seconds:.2f}s ({len(requests) / seconds:.0f} certs/s)')
 
     return devices
 
-def do_register_devices(devices, product_name, cohort_prn):
+def is_already_taken(result):
+    """
+    Return whether a failed create was rejected because the entity already
+    exists, as opposed to an API, network or authentication error that is
+    worth retrying.
+    """
+    output = f'{result.stderr or ""}{result.stdout or ""}'
+    return 'has already been taken' in output or 'already exists' in output
+
+def do_register_devices(devices, product_name, cohort_prn, jobs=DEFAULT_JOBS):
     evk_config = read_evk_config()
-    for device in devices:
+
+    def register_device(device):
         log_task(f'Registering Device')
         log_info(f'Device Identifier: {device["identifier"]}')
         log_info(f'Device Certificate: {device["certificate"]}')
         log_info(f'Device Private Key: {device["private_key"]}')
 
-        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'devices', 'create', '--identifier', device['identifier'], '--product-name', product_name, '--cohort-prn', cohort_prn, '--tags', f'{" ".join(device["tags"])}', '--target', device["target"]])
-        if result.returncode != 0:
+        device_key = f'{product_name}:{device["identifier"]}'
+        if state_get(evk_config['organization_prn'], 'device', device_key):
             log_skip_task('Device already exists')
+        else:
+            result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'devices', 'create', '--identifier', device['identifier'], '--product-name', product_name, '--cohort-prn', cohort_prn, '--tags', f'{" ".join(device["tags"])}', '--target', device["target"]])
+            if result.returncode == 0:
+                device_prn = json.loads(result.stdout).get('device', {}).get('prn', '')
+            elif is_already_taken(result):
+                log_skip_task('Device already exists')
+                device_prn = ''
+            else:
+                log_error(f'Device {device["identifier"]} was not registered')
+                raise RuntimeError((result.stderr or result.stdout).strip())
+            state_put(evk_config['organization_prn'], 'device', device_key, device_prn, {'cohort_prn': cohort_prn})
+
+        with open(device['certificate'], 'rb') as f:
+            certificate_hash = hashlib.sha256(f.read()).hexdigest()
+        certificate_key = f'{device_key}:{certificate_hash}'
+        if state_get(evk_config['organization_prn'], 'device-certificate', certificate_key):
+            log_skip_task('Device certificate already exists')
+            return
 
         result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'device-certificates', 'create', '--device-identifier', device['identifier'], '--product-name', product_name, '--certificate-path', device['certificate']])
-        if result.returncode != 0:
+        if result.returncode == 0:
+            device_certificate_prn = json.loads(result.stdout).get('device_certificate', {}).get('prn', '')
+        elif is_already_taken(result):
             log_skip_task('Device certificate already exists')
+            device_certificate_prn = ''
+        else:
+            log_error(f'Device {device["identifier"]} certificate was not registered')
+            raise RuntimeError((result.stderr or result.stdout).strip())
+        state_put(evk_config['organization_prn'], 'device-certificate', certificate_key, device_certificate_prn)
+
+    run_parallel(register_device, devices, jobs)
@@ -1,18 +1,49 @@
 import click
+import hashlib
+import json
 import os
 from peridio_evk.utils import *
-from peridio_evk.crypto import create_root_ca
+from peridio_evk.crypto import (
+    DEFAULT_KEY_ALGORITHM,
+    KEY_ALGORITHMS,
+    create_root_ca,
+)
 from peridio_evk.log import log_task, log_modify_file, log_info, log_skip_task
 from peridio_evk.product import do_create_product
 from peridio_evk.releases import do_create_artifacts
+from peridio_evk.executor import DEFAULT_JOBS
+from peridio_evk.api import use_backend
+from peridio_evk.state import state_clear
+from peridio_evk.pipeline import Task, run_pipeline
 from peridio_evk.commands.devices import (
     do_create_device_environments,
     do_create_device_certificates,
     do_register_devices,
-    devices,
+    generate_devices,
+    write_fleet,
+    DEFAULT_DEVICE_COUNT,
+    DEFAULT_DEVICE_IDENTIFIER_PATTERN,
+    DEFAULT_DEVICE_TAG_RATIOS,
 )
 
 
+def parse_tag_ratios(ctx, param, value):
+    if not value:
+        return DEFAULT_DEVICE_TAG_RATIOS
+    tag_ratios = {}
+    for item in value:
+        tag, _, ratio = item.partition("=")
+        try:
+            tag_ratios[tag] = float(ratio)
+        except ValueError:
+            raise click.BadParameter(f"'{item}' is not TAG=RATIO")
+        if not tag or not 0.0 <= tag_ratios[tag] <= 1.0:
+            raise click.BadParameter(
+                f"'{item}' needs a tag and a ratio between 0 and 1"
+            )
+    return tag_ratios
+
+
 @click.command()
 @click.option(
     "--organization-name",
@@ -36,31 +67,312 @@ from peridio_evk.commands.devices import (
     default="edge-inference",
     help="Product Name (Optional)",
 )
-def initialize(organization_name, organization_prn, api_key, product_name):
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Maximum number of concurrent Peridio Cloud calls (Optional)",
+)
+@click.option(
+    "--backend",
+    required=False,
+    type=click.Choice(["cli", "api"]),
+    default="cli",
+    show_default=True,
+    help="Call Peridio Cloud through the peridio CLI or the built-in API client (Optional)",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Discard the local state store and re-sync entities from Peridio Cloud (Optional)",
+)
+@click.option(
+    "--artifact-seed",
+    required=False,
+    type=str,
+    default=None,
+    help="Seed for reproducible synthetic artifact binaries (Optional)",
+)
+@click.option(
+    "--artifact-compressibility",
+    required=False,
+    type=click.FloatRange(0.0, 1.0),
+    default=0.0,
+    show_default=True,
+    help="Fraction of synthetic artifact content that is low-entropy (Optional)",
+)
+@click.option(
+    "--artifact-change-fraction",
+    required=False,
+    type=click.FloatRange(0.0, 1.0),
+    default=DEFAULT_ARTIFACT_CHANGE_FRACTION,
+    show_default=True,
+    help="Fraction of a synthetic artifact binary rewritten by its next version (Optional)",
+)
+@click.option(
+    "--deltas",
+    required=False,
+    type=click.Choice(["off", "report", "register"]),
+    default="off",
+    show_default=True,
+    help="Compute binary deltas between artifact versions, optionally registering them as binaries (Optional)",
+)
+@click.option(
+    "--root-key-algorithm",
+    required=False,
+    type=click.Choice(KEY_ALGORITHMS),
+    default=DEFAULT_KEY_ALGORITHM,
+    show_default=True,
+    help="Key algorithm of the root CA (Optional)",
+)
+@click.option(
+    "--intermediate-key-algorithm",
+    required=False,
+    type=click.Choice(KEY_ALGORITHMS),
+    default=DEFAULT_KEY_ALGORITHM,
+    show_default=True,
+    help="Key algorithm of the cohort intermediate CAs (Optional)",
+)
+@click.option(
+    "--device-key-algorithm",
+    required=False,
+    type=click.Choice(KEY_ALGORITHMS),
+    default=DEFAULT_KEY_ALGORITHM,
+    show_default=True,
+    help="Key algorithm of device and verification certificates, ed25519 only where Peridio Cloud accepts it (Optional)",
+)
+@click.option(
+    "--provisioning",
+    required=False,
+    type=click.Choice(["register", "jitp"]),
+    default="register",
+    show_default=True,
+    help="Register devices individually, or leave them to just-in-time provisioning with no per-device Peridio Cloud calls. JITP devices only get the CA's JITP tags, so none are canary devices (Optional)",
+)
+@click.option(
+    "--device-count",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_DEVICE_COUNT,
+    show_default=True,
+    help="Number of virtual devices to create (Optional)",
+)
+@click.option(
+    "--device-identifier-pattern",
+    required=False,
+    type=str,
+    default=DEFAULT_DEVICE_IDENTIFIER_PATTERN,
+    show_default=True,
+    help="Device identifier format, given the 1-based device index (Optional)",
+)
+@click.option(
+    "--device-tag-ratio",
+    "device_tag_ratios",
+    required=False,
+    multiple=True,
+    callback=parse_tag_ratios,
+    help="TAG=RATIO giving that fraction of devices a tag, may be repeated, defaults to canary=0.333 (Optional)",
+)
+def initialize(
+    organization_name,
+    organization_prn,
+    api_key,
+    product_name,
+    jobs,
+    backend,
+    refresh,
+    artifact_seed,
+    artifact_compressibility,
+    artifact_change_fraction,
+    deltas,
+    root_key_algorithm,
+    intermediate_key_algorithm,
+    device_key_algorithm,
+    provisioning,
+    device_count,
+    device_identifier_pattern,
+    device_tag_ratios,
+):
     log_task("Initializing EVK")
     log_info(f"Organization Name: {organization_name}")
     log_info(f"Organization PRN: {organization_prn}")
     log_info(f"Product Name: {product_name}")
     log_info(f"API key: {api_key}")
+    log_info(f"Jobs: {jobs}")
+    log_info(f"Backend: {backend}")
+    log_info(f"Provisioning: {provisioning}")
+    if provisioning == "jitp":
+        # JITP creates every device with the tags of the intermediate CA it
+        # connects through, which carry no device tags from the fleet.
+        log_info(
+            "JITP devices are created with the CA's JITP tags only, so no device is tagged canary and the canary release reaches none of them"
+        )
+    log_info(f"Devices: {device_count}")
 
     if click.confirm(
         "Running this task may take several minutes to complete.\nYou may run this task over again in the case of errors as it will not duplicate data\n\nProceed?",
         default=False,
     ):
-        do_initialize(organization_name, organization_prn, api_key)
-        cohort_prns = do_create_product(product_name)
-        release_cohort = find_dict_by_name(cohort_prns, "release")
-        release_cohort_prn = release_cohort["prn"]
-        release, artifacts = do_create_artifacts(organization_prn, release_cohort_prn)
-        do_create_device_environments(devices, release, artifacts, cohort_prns)
-        updated_devices = do_create_device_certificates(
-            devices, release_cohort["ca"]
+        do_initialize_pipeline(
+            organization_name,
+            organization_prn,
+            api_key,
+            product_name,
+            jobs,
+            backend,
+            refresh,
+            artifact_seed,
+            artifact_compressibility,
+            deltas,
+            {
+                "root": root_key_algorithm,
+                "intermediate": intermediate_key_algorithm,
+                "device": device_key_algorithm,
+            },
+            provisioning,
+            generate_devices(
+                device_count, device_identifier_pattern, device_tag_ratios
+            ),
+            artifact_change_fraction,
         )
-        filtered_devices = filter_dicts(updated_devices, "tags", ["canary"])
-        do_register_devices(filtered_devices, product_name, release_cohort_prn)
 
 
-def do_initialize(organization_name, organization_prn, api_key):
+def do_initialize_pipeline(
+    organization_name,
+    organization_prn,
+    api_key,
+    product_name,
+    jobs=DEFAULT_JOBS,
+    backend="cli",
+    refresh=False,
+    artifact_seed=None,
+    artifact_compressibility=0.0,
+    deltas="off",
+    key_algorithms=None,
+    provisioning="register",
+    devices=None,
+    artifact_change_fraction=DEFAULT_ARTIFACT_CHANGE_FRACTION,
+):
+    devices = devices or generate_devices()
+    journal_path = os.path.join(
+        get_config_path(), "evk-data", "initialize-journal.json"
+    )
+    # Every option that changes what a step produces is part of the
+    # fingerprint, so changing one starts over instead of resuming with
+    # results made under the old options.
+    fingerprint = hashlib.sha256(
+        json.dumps(
+            [
+                organization_name,
+                organization_prn,
+                product_name,
+                devices,
+                artifact_seed,
+                artifact_compressibility,
+                artifact_change_fraction,
+                deltas,
+                key_algorithms,
+                provisioning,
+            ]
+        ).encode()
+    ).hexdigest()
+    if refresh and os.path.exists(journal_path):
+        os.remove(journal_path)
+
+    def configure(results):
+        do_initialize(
+            organization_name,
+            organization_prn,
+            api_key,
+            backend,
+            jobs,
+            key_algorithms,
+        )
+        write_fleet(devices)
+        if refresh:
+            log_task("Refreshing local state from Peridio Cloud")
+            state_clear(organization_prn)
+
+    def product(results):
+        return do_create_product(product_name, jobs)
+
+    def artifacts(results):
+        release_cohort = find_dict_by_name(results["product"], "release")
+        return do_create_artifacts(
+            organization_prn,
+            release_cohort["prn"],
+            jobs,
+            artifact_seed,
+            artifact_compressibility,
+            deltas,
+            artifact_change_fraction,
+        )
+
+    def device_certificates(results):
+        release_cohort = find_dict_by_name(results["product"], "release")
+        return do_create_device_certificates(devices, release_cohort["ca"])
+
+    def device_environments(results):
+        release, artifacts = results["artifacts"]
+        do_create_device_environments(
+            devices, release, artifacts, results["product"]
+        )
+
+    def register_devices(results):
+        if provisioning == "jitp":
+            log_skip_task("Devices are provisioned just in time")
+            log_info(
+                "Intermediate CAs are registered for JITP, so devices are created in their cohort with the CA's JITP tags and target on first connection"
+            )
+            return
+        release_cohort = find_dict_by_name(results["product"], "release")
+        # Devices can carry several tags, so any device tagged canary is
+        # registered, not only those whose sole tag is canary.
+        filtered_devices = [
+            device
+            for device in results["device-certificates"]
+            if "canary" in device["tags"]
+        ]
+        do_register_devices(
+            filtered_devices, product_name, release_cohort["prn"], jobs
+        )
+
+    # Tasks that call Peridio Cloud require "configure" directly, as it is
+    # never journaled and selects the backend even when resuming.
+    tasks = [
+        Task("configure", configure, checkpoint=False),
+        Task("product", product, requires=["configure"]),
+        Task("artifacts", artifacts, requires=["configure", "product"]),
+        Task(
+            "device-certificates",
+            device_certificates,
+            requires=["product"],
+        ),
+        Task(
+            "device-environments",
+            device_environments,
+            requires=["product", "artifacts"],
+        ),
+        Task(
+            "register-devices",
+            register_devices,
+            requires=["configure", "product", "device-certificates"],
+        ),
+    ]
+    return run_pipeline(tasks, journal_path, fingerprint, jobs)
+
+
+def do_initialize(
+    organization_name,
+    organization_prn,
+    api_key,
+    backend="cli",
+    jobs=DEFAULT_JOBS,
+    key_algorithms=None,
+):
     log_task("Updating CLI and EVK configuration")
     config_path = get_config_path()
     check_default_cli_config(config_path)
@@ -76,7 +388,9 @@ def do_initialize(organization_name, organization_prn, api_key):
 
     evk_config = read_evk_config()
     evk_config_file = get_evk_config_path()
-    update_evk_config(evk_config, organization_name, organization_prn)
+    update_evk_config(
+        evk_config, organization_name, organization_prn, key_algorithms
+    )
     write_json_file(evk_config_file, evk_config)
 
     root_ca_path = os.path.join(config_path, "evk-data", "ca")
@@ -87,7 +401,10 @@ def do_initialize(organization_name, organization_prn, api_key):
         log_task(f"Creating Root CA")
         os.makedirs(root_ca_path)
         create_root_ca(
-            f"Root CA {organization_name}", root_ca_key, root_ca_cert
+            f"Root CA {organization_name}",
+            root_ca_key,
+            root_ca_cert,
+            read_key_algorithm("root"),
         )
         log_modify_file(root_ca_key)
         log_modify_file(root_ca_cert)
@@ -96,9 +413,11 @@ def do_initialize(organization_name, organization_prn, api_key):
         log_info(f"Root CA Certificate: {root_ca_cert}")
         log_info(f"Root CA Private-Key: {root_ca_key}")
 
+    profile_name = organization_name
+    use_backend(backend, jobs)
+
     # Test that the 'peridio' executable is configured by calling the system
     log_task(f"Verifying CLI configuration")
-    profile_name = organization_name
     peridio_cli(["peridio", "--profile", profile_name, "users", "me"])
 
 
@@ -114,10 +433,16 @@ def update_credentials(credentials, organization_name, api_key):
     credentials[organization_name] = {"api_key": api_key}
 
 
-def update_evk_config(evk_config, organization_name, organization_prn):
+def update_evk_config(
+    evk_config, organization_name, organization_prn, key_algorithms=None
+):
     evk_config["profile"] = organization_name
     evk_config["organization_name"] = organization_name
     evk_config["organization_prn"] = organization_prn
+    # Key algorithms apply to keys generated from now on; existing CAs and
+    # device keys are kept.
+    if key_algorithms:
+        evk_config["key_algorithms"] = key_algorithms
 
 
 def check_default_cli_config(config_path):
@@ -0,0 +1,266 @@
+import click
+import os
+import sys
+import time
+from peridio_evk.utils import *
+from peridio_evk.log import log_task, log_info, log_skip_task, log_error
+from peridio_evk.executor import DEFAULT_JOBS
+from peridio_evk.api import use_backend
+from peridio_evk.state import state_get
+from peridio_evk.pipeline import Task, run_pipeline
+from peridio_evk.plan import (
+    default_release_plan,
+    load_release_plan,
+    plan_fingerprint,
+    plan_operations,
+    write_release_plan,
+)
+from peridio_evk.product import create_product, create_product_cohort
+from peridio_evk.releases import (
+    create_artifact,
+    create_artifact_binary,
+    create_artifact_version,
+    create_bundle,
+    do_create_release,
+)
+from peridio_evk.upload import log_upload_summary
+
+
+@click.command()
+@click.option(
+    "--file",
+    "plan_path",
+    required=True,
+    type=click.Path(),
+    help="Path to the release plan (JSON, or YAML when PyYAML is installed)",
+)
+@click.option(
+    "--init",
+    is_flag=True,
+    default=False,
+    help="Write the EVK's default release plan to --file instead of diffing it (Optional)",
+)
+@click.option(
+    "--product-name",
+    required=False,
+    type=str,
+    default="edge-inference",
+    help="Product Name used by --init (Optional)",
+)
+def plan(plan_path, init, product_name):
+    if init:
+        if os.path.exists(plan_path):
+            log_error(f"{plan_path} already exists")
+            sys.exit(1)
+        try:
+            write_release_plan(plan_path, default_release_plan(product_name))
+        except ValueError as e:
+            log_error(f"Cannot write release plan {plan_path}: {e}")
+            sys.exit(1)
+        log_modify_file(plan_path)
+        return
+
+    operations = read_plan_operations(plan_path)
+    log_task("Release Plan")
+    for operation in operations:
+        if operation["action"] == "create":
+            log_info(f"+ {operation['kind']} {operation['key']}")
+        elif operation["action"] == "conflict":
+            log_error(
+                f"! {operation['kind']} {operation['key']}: {operation['reason']}"
+            )
+    log_plan_summary(operations)
+
+
+@click.command()
+@click.option(
+    "--file",
+    "plan_path",
+    required=True,
+    type=click.Path(exists=True),
+    help="Path to the release plan (JSON, or YAML when PyYAML is installed)",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Maximum number of concurrent Peridio Cloud calls (Optional)",
+)
+@click.option(
+    "--backend",
+    required=False,
+    type=click.Choice(["cli", "api"]),
+    default="cli",
+    show_default=True,
+    help="Call Peridio Cloud through the peridio CLI or the built-in API client (Optional)",
+)
+@click.option(
+    "--artifact-seed",
+    required=False,
+    type=str,
+    default=None,
+    help="Seed for reproducible synthetic artifact binaries (Optional)",
+)
+@click.option(
+    "--artifact-compressibility",
+    required=False,
+    type=click.FloatRange(0.0, 1.0),
+    default=0.0,
+    show_default=True,
+    help="Fraction of synthetic artifact content that is low-entropy (Optional)",
+)
+@click.option(
+    "--artifact-change-fraction",
+    required=False,
+    type=click.FloatRange(0.0, 1.0),
+    default=DEFAULT_ARTIFACT_CHANGE_FRACTION,
+    show_default=True,
+    help="Fraction of a synthetic artifact binary rewritten by its next version (Optional)",
+)
+def apply(
+    plan_path,
+    jobs,
+    backend,
+    artifact_seed,
+    artifact_compressibility,
+    artifact_change_fraction,
+):
+    operations = read_plan_operations(plan_path)
+    log_plan_summary(operations)
+    if any(operation["action"] == "conflict" for operation in operations):
+        log_error("Resolve the conflicts reported by 'plan' before applying")
+        sys.exit(1)
+    do_apply_operations(
+        operations,
+        jobs,
+        backend,
+        artifact_seed,
+        artifact_compressibility,
+        artifact_change_fraction,
+    )
+
+
+def read_plan_operations(plan_path):
+    evk_config = read_evk_config()
+    if "organization_prn" not in evk_config:
+        log_error("The EVK is not configured, run 'initialize' first")
+        sys.exit(1)
+    try:
+        release_plan = load_release_plan(plan_path)
+    except (ValueError, KeyError) as e:
+        log_error(f"Invalid release plan {plan_path}: {e}")
+        sys.exit(1)
+    return plan_operations(release_plan, evk_config["organization_prn"])
+
+
+def log_plan_summary(operations):
+    counts = {"create": 0, "unchanged": 0, "conflict": 0}
+    for operation in operations:
+        counts[operation["action"]] += 1
+    log_info(
+        f"Plan: {counts['create']} to create, {counts['unchanged']} unchanged, {counts['conflict']} conflicting"
+    )
+
+
+def do_apply_operations(
+    operations,
+    jobs=DEFAULT_JOBS,
+    backend="cli",
+    artifact_seed=None,
+    artifact_compressibility=0.0,
+    artifact_change_fraction=DEFAULT_ARTIFACT_CHANGE_FRACTION,
+):
+    """
+    Create the entities of a diffed release plan.
+
+    Every 'create' operation becomes a pipeline task that requires the
+    operations it depends on, so independent entities are created
+    concurrently. Entities that already exist are resolved from the state
+    store, which every create_* function records its result in.
+    """
+    evk_config = read_evk_config()
+    organization_prn = evk_config["organization_prn"]
+    journal_path = os.path.join(
+        get_config_path(), "evk-data", "apply-journal.json"
+    )
+    creates = [o for o in operations if o["action"] == "create"]
+    if not creates:
+        log_skip_task("Nothing to apply")
+        return {}
+
+    def prn(kind, key):
+        return state_get(organization_prn, kind, key)["prn"]
+
+    def configure(results):
+        use_backend(backend, jobs)
+
+    def create(operation):
+        spec = operation["spec"]
+        kind = operation["kind"]
+        if kind == "product":
+            return create_product(spec["name"])
+        if kind == "cohort":
+            product_name = spec["product_name"]
+            return create_product_cohort(
+                prn("product", product_name),
+                product_name,
+                spec["name"],
+                spec["description"],
+            )["prn"]
+        if kind == "artifact":
+            return create_artifact(spec)
+        if kind == "artifact-version":
+            return create_artifact_version(
+                spec["name"], prn("artifact", spec["name"]), spec["version"]
+            )
+        if kind == "binary":
+            artifact_version_prn = prn(
+                "artifact-version", f"{spec['name']}:{spec['version']}"
+            )
+            return create_artifact_binary(
+                spec,
+                artifact_version_prn,
+                spec["target"],
+                artifact_seed,
+                artifact_compressibility,
+                artifact_change_fraction,
+            )
+        if kind == "bundle":
+            return create_bundle(
+                spec["name"],
+                [
+                    prn("artifact-version", key)
+                    for key in spec["artifact_versions"]
+                ],
+                organization_prn,
+            )
+        if kind == "release":
+            return do_create_release(
+                spec["name"],
+                organization_prn,
+                prn("cohort", f"{spec['product_name']}:{spec['cohort']}"),
+                prn("bundle", spec["bundle"]),
+                spec["version"],
+                spec.get("version_requirement", ""),
+                spec.get("disabled", False),
+                spec.get("phase_tags", []),
+            )["prn"]
+        raise ValueError(f"Unknown operation kind '{kind}'")
+
+    tasks = [Task("configure", configure, checkpoint=False)]
+    for operation in creates:
+        tasks.append(
+            Task(
+                operation["id"],
+                lambda results, operation=operation: create(operation),
+                requires=["configure", *operation["requires"]],
+            )
+        )
+
+    log_task("Applying Release Plan")
+    upload_start = time.monotonic()
+    results = run_pipeline(tasks, journal_path, plan_fingerprint(creates), jobs)
+    log_upload_summary(upload_start)
+    return results
@@ -4,20 +4,63 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec, ed25519
 from datetime import datetime, timedelta
 
+KEY_ALGORITHMS = ["p256", "p384", "ed25519"]
+DEFAULT_KEY_ALGORITHM = "p256"
+
+
+def generate_private_key(key_algorithm=DEFAULT_KEY_ALGORITHM):
+    if key_algorithm == "p256":
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_algorithm == "p384":
+        return ec.generate_private_key(ec.SECP384R1())
+    if key_algorithm == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported key algorithm '{key_algorithm}'")
+
+
+def signature_hash(private_key):
+    # Ed25519 signs the message itself, and each curve is paired with the
+    # hash of matching strength.
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return None
+    if isinstance(private_key.curve, ec.SECP384R1):
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def private_key_to_pem(private_key):
+    # Ed25519 keys have no traditional OpenSSL encoding.
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        key_format = serialization.PrivateFormat.PKCS8
+    else:
+        key_format = serialization.PrivateFormat.TraditionalOpenSSL
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=key_format,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
 
-def create_root_ca(common_name, key_path, cert_path):
+
+def verify_certificate_signature(cert, issuer_public_key):
+    if isinstance(issuer_public_key, ed25519.Ed25519PublicKey):
+        issuer_public_key.verify(cert.signature, cert.tbs_certificate_bytes)
+    else:
+        issuer_public_key.verify(
+            cert.signature,
+            cert.tbs_certificate_bytes,
+            ec.ECDSA(cert.signature_hash_algorithm),
+        )
+
+
+def create_root_ca(
+    common_name, key_path, cert_path, key_algorithm=DEFAULT_KEY_ALGORITHM
+):
     # Generate private key
-    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_key = generate_private_key(key_algorithm)
 
     # Write private key to file
     with open(key_path, "wb") as key_file:
-        key_file.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
+        key_file.write(private_key_to_pem(private_key))
 
     # Generate public certificate
     subject = issuer = x509.Name(
@@ -45,7 +88,7 @@ def create_root_ca(common_name, key_path, cert_path):
             ),
             critical=False,
         )
-        .sign(private_key, hashes.SHA256())
+        .sign(private_key, signature_hash(private_key))
     )
 
     # Write public certificate to file
@@ -53,19 +96,15 @@ def create_root_ca(common_name, key_path, cert_path):
         cert_file.write(certificate.public_bytes(serialization.Encoding.PEM))
 
 
-def create_intermediate_ca_csr(common_name, key_path, csr_path):
+def create_intermediate_ca_csr(
+    common_name, key_path, csr_path, key_algorithm=DEFAULT_KEY_ALGORITHM
+):
     # Generate private key for Intermediate CA
-    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_key = generate_private_key(key_algorithm)
 
     # Write private key to file
     with open(key_path, "wb") as key_file:
-        key_file.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
+        key_file.write(private_key_to_pem(private_key))
 
     # Generate CSR
     csr = (
@@ -73,7 +112,7 @@ def create_intermediate_ca_csr(common_name, key_path, csr_path):
         .subject_name(
             x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
         )
-        .sign(private_key, hashes.SHA256())
+        .sign(private_key, signature_hash(private_key))
     )
 
     # Write CSR to file
@@ -128,7 +167,7 @@ def sign_intermediate_ca_csr(
             ),
             critical=False,
         )
-        .sign(root_private_key, hashes.SHA256())
+        .sign(root_private_key, signature_hash(root_private_key))
     )
 
     # Write Intermediate CA's certificate to file
@@ -138,19 +177,15 @@ def sign_intermediate_ca_csr(
         )
 
 
-def create_end_entity_csr(common_name, key_path, csr_path):
+def create_end_entity_csr(
+    common_name, key_path, csr_path, key_algorithm=DEFAULT_KEY_ALGORITHM
+):
     # Generate private key for End-Entity
-    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_key = generate_private_key(key_algorithm)
 
     # Write private key to file
     with open(key_path, "wb") as key_file:
-        key_file.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
+        key_file.write(private_key_to_pem(private_key))
 
     # Generate CSR
     csr = (
@@ -162,7 +197,7 @@ def create_end_entity_csr(common_name, key_path, csr_path):
                 ]
             )
         )
-        .sign(private_key, hashes.SHA256())
+        .sign(private_key, signature_hash(private_key))
     )
 
     # Write CSR to file
@@ -192,11 +227,28 @@ def sign_end_entity_csr(
         end_entity_csr = x509.load_pem_x509_csr(csr_file.read())
 
     # Generate End-Entity certificate
-    end_entity_cert = (
+    end_entity_cert = build_end_entity_certificate(
+        end_entity_csr.subject,
+        end_entity_csr.public_key(),
+        intermediate_private_key,
+        intermediate_cert,
+    )
+
+    # Write End-Entity certificate to file
+    with open(end_entity_cert_path, "wb") as cert_file:
+        cert_file.write(
+            end_entity_cert.public_bytes(serialization.Encoding.PEM)
+        )
+
+
+def build_end_entity_certificate(
+    subject, public_key, issuer_private_key, issuer_cert
+):
+    return (
         x509.CertificateBuilder()
-        .subject_name(end_entity_csr.subject)
-        .issuer_name(intermediate_cert.subject)
-        .public_key(end_entity_csr.public_key())
+        .subject_name(subject)
+        .issuer_name(issuer_cert.subject)
+        .public_key(public_key)
         .serial_number(x509.random_serial_number())
         .not_valid_before(datetime.utcnow() - timedelta(days=1))
         .not_valid_after(
@@ -210,25 +262,17 @@ def sign_end_entity_csr(
         )
         .add_extension(
             x509.AuthorityKeyIdentifier.from_issuer_public_key(
-                intermediate_private_key.public_key()
+                issuer_private_key.public_key()
             ),
             critical=False,
         )
         .add_extension(
-            x509.SubjectKeyIdentifier.from_public_key(
-                end_entity_csr.public_key()
-            ),
+            x509.SubjectKeyIdentifier.from_public_key(public_key),
             critical=False,
         )
-        .sign(intermediate_private_key, hashes.SHA256())
+        .sign(issuer_private_key, signature_hash(issuer_private_key))
     )
 
-    # Write End-Entity certificate to file
-    with open(end_entity_cert_path, "wb") as cert_file:
-        cert_file.write(
-            end_entity_cert.public_bytes(serialization.Encoding.PEM)
-        )
-
 
 def read_ca_serial_number(cert_path):
     with open(cert_path, "rb") as cert_file:
@@ -0,0 +1,203 @@
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+DELTA_MAGIC = b"PEVKDLT1"
+DELTA_BLOCK_SIZE = 4096
+DELTA_READ_SIZE = 1024 * 1024
+
+_HEADER = struct.Struct(">QQ32s")
+_COPY = struct.Struct(">QQ")
+_LITERAL = struct.Struct(">Q")
+
+
+def _map(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def create_delta(old_path, new_path, delta_path, block_size=DELTA_BLOCK_SIZE):
+    """
+    Write a binary patch that rebuilds new_path from old_path.
+
+    The old file is indexed by block digest; every block-aligned block of the
+    new file that exists anywhere in the old file becomes a copy instruction
+    and everything else is stored literally. Adjacent instructions are
+    coalesced and the instruction stream is zlib compressed. Both inputs are
+    memory mapped, so images are never read into memory whole.
+
+    Returns a dict with the full (new) size, the delta size and their ratio.
+    """
+    with open(old_path, "rb") as old_file, open(new_path, "rb") as new_file:
+        old = _map(old_file)
+        new = _map(new_file)
+        try:
+            old_sha256 = hashlib.sha256(old).digest()
+            index = {}
+            for offset in range(0, len(old) - block_size + 1, block_size):
+                digest = hashlib.blake2b(
+                    old[offset : offset + block_size], digest_size=16
+                ).digest()
+                index.setdefault(digest, offset)
+
+            tmp_path = f"{delta_path}.part"
+            with open(tmp_path, "wb") as out:
+                out.write(DELTA_MAGIC)
+                out.write(_HEADER.pack(len(old), len(new), old_sha256))
+                compressor = zlib.compressobj(6)
+
+                def emit(data):
+                    out.write(compressor.compress(data))
+
+                copy_offset = None
+                copy_length = 0
+                literal_start = None
+
+                def flush_copy():
+                    if copy_length:
+                        emit(b"C" + _COPY.pack(copy_offset, copy_length))
+
+                def flush_literal(end):
+                    if literal_start is not None:
+                        length = end - literal_start
+                        emit(b"L" + _LITERAL.pack(length))
+                        emit(new[literal_start:end])
+
+                for offset in range(0, len(new), block_size):
+                    block = new[offset : offset + block_size]
+                    match = None
+                    if len(block) == block_size:
+                        match = index.get(
+                            hashlib.blake2b(block, digest_size=16).digest()
+                        )
+                        if (
+                            match is not None
+                            and old[match : match + block_size] != block
+                        ):
+                            match = None
+
+                    if match is None:
+                        flush_copy()
+                        copy_length = 0
+                        if literal_start is None:
+                            literal_start = offset
+                        continue
+
+                    flush_literal(offset)
+                    literal_start = None
+                    if copy_length and copy_offset + copy_length == match:
+                        copy_length += block_size
+                    else:
+                        flush_copy()
+                        copy_offset = match
+                        copy_length = block_size
+
+                flush_copy()
+                flush_literal(len(new))
+                out.write(compressor.flush())
+            os.replace(tmp_path, delta_path)
+            new_size = len(new)
+        finally:
+            if isinstance(old, mmap.mmap):
+                old.close()
+            if isinstance(new, mmap.mmap):
+                new.close()
+
+    delta_size = os.path.getsize(delta_path)
+    return {
+        "full_size": new_size,
+        "delta_size": delta_size,
+        "ratio": delta_size / new_size if new_size else 0.0,
+    }
+
+
+class _StreamReader:
+    """
+    Read exact byte counts from a compressed instruction stream, inflating
+    it DELTA_READ_SIZE bytes at a time.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj()
+        self.buffer = bytearray()
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            data = self.decompressor.unconsumed_tail
+            if not data:
+                data = self.f.read(DELTA_READ_SIZE)
+                if not data:
+                    self.buffer += self.decompressor.flush()
+                    break
+            self.buffer += self.decompressor.decompress(data, DELTA_READ_SIZE)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def apply_delta(old_path, delta_path, out_path):
+    """
+    Rebuild a file from old_path and a patch written by create_delta.
+
+    The instruction stream is inflated in chunks, so neither the delta nor
+    its literal runs are held in memory whole.
+    """
+    with open(delta_path, "rb") as f, open(old_path, "rb") as old_file:
+        if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f"{delta_path} is not a delta file")
+        old_size, new_size, old_sha256 = _HEADER.unpack(f.read(_HEADER.size))
+        stream = _StreamReader(f)
+
+        def read_exactly(size):
+            data = stream.read(size)
+            if len(data) != size:
+                raise ValueError(f"Corrupt delta file {delta_path}")
+            return data
+
+        old = _map(old_file)
+        try:
+            if (
+                len(old) != old_size
+                or hashlib.sha256(old).digest() != old_sha256
+            ):
+                raise ValueError(f"{old_path} does not match the delta source")
+            tmp_path = f"{out_path}.part"
+            try:
+                with open(tmp_path, "wb") as out:
+                    while True:
+                        op = stream.read(1)
+                        if not op:
+                            break
+                        if op == b"C":
+                            offset, length = _COPY.unpack(
+                                read_exactly(_COPY.size)
+                            )
+                            out.write(old[offset : offset + length])
+                        elif op == b"L":
+                            (length,) = _LITERAL.unpack(
+                                read_exactly(_LITERAL.size)
+                            )
+                            while length:
+                                data = read_exactly(
+                                    min(length, DELTA_READ_SIZE)
+                                )
+                                out.write(data)
+                                length -= len(data)
+                        else:
+                            raise ValueError(f"Corrupt delta file {delta_path}")
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        finally:
+            if isinstance(old, mmap.mmap):
+                old.close()
+
+    if os.path.getsize(tmp_path) != new_size:
+        os.remove(tmp_path)
+        raise ValueError(f"Delta {delta_path} produced the wrong size")
+    os.replace(tmp_path, out_path)
@@ -0,0 +1,107 @@
+import logging
+import logging.handlers
+import threading
+from collections import deque
+
+# Lines buffered per device before its reader blocks, and lines taken from
+# each device per write batch so that no device can monopolize the sink.
+DEFAULT_QUEUE_LINES = 1000
+BATCH_LINES_PER_DEVICE = 64
+
+
+def iter_log_lines(stream):
+    """
+    Split a Docker log stream of arbitrary byte chunks into decoded lines.
+    Containers run with a TTY, so carriage returns are dropped.
+    """
+    pending = b""
+    for chunk in stream:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+    if pending:
+        yield pending.rstrip(b"\r").decode("utf-8", errors="replace")
+
+
+class LogMultiplexer:
+    """
+    Merge lines from many devices into one consumer.
+
+    Every device has its own bounded queue. A reader that fills its queue
+    blocks until the consumer catches up, which leaves the backlog in
+    Docker's log store instead of in memory, while the other devices keep
+    flowing. The consumer drains the queues round robin.
+    """
+
+    def __init__(self, max_lines=DEFAULT_QUEUE_LINES):
+        self.max_lines = max_lines
+        self.queues = {}
+        self.open_sources = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def add_source(self, source):
+        with self.condition:
+            self.queues[source] = deque()
+            self.open_sources += 1
+
+    def close_source(self, source):
+        with self.condition:
+            self.open_sources -= 1
+            self.condition.notify_all()
+
+    def put(self, source, line):
+        """
+        Queue a line, blocking while the source's queue is full. Returns
+        False once the multiplexer is closed.
+        """
+        with self.condition:
+            queue = self.queues[source]
+            while len(queue) >= self.max_lines and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return False
+            queue.append(line)
+            self.condition.notify_all()
+            return True
+
+    def get_batch(self, timeout=0.5):
+        """
+        Return up to BATCH_LINES_PER_DEVICE (source, line) pairs per source,
+        waiting up to timeout seconds for any. Returns None when every
+        source is closed and drained.
+        """
+        with self.condition:
+            if not any(self.queues.values()):
+                if self.open_sources <= 0 or self.closed:
+                    return None
+                self.condition.wait(timeout)
+            batch = []
+            for source, queue in self.queues.items():
+                for _ in range(min(len(queue), BATCH_LINES_PER_DEVICE)):
+                    batch.append((source, queue.popleft()))
+            if batch:
+                self.condition.notify_all()
+            return batch
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def open_log_file(path, max_bytes, backup_count):
+    """
+    Return a handler that writes plain lines to path, rotating it when it
+    reaches max_bytes and keeping backup_count old files.
+    """
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def write_log_line(handler, line):
+    handler.handle(logging.makeLogRecord({"msg": line, "args": None}))
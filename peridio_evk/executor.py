@@ -0,0 +1,94 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from peridio_evk.log import buffered_output, flush_output
+
+DEFAULT_JOBS = 4
+
+
+class RateLimiter:
+    """
+    Space calls out to at most rate per second across threads. A rate of
+    None or 0 disables limiting.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def latency_summary(latencies):
+    """
+    Return the count, median, 95th percentile and maximum of a list of
+    durations in seconds, using the nearest-rank percentile.
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    def percentile(p):
+        return latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)]
+
+    return {
+        "count": len(latencies),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "max": latencies[-1],
+    }
+
+
+def run_parallel(func, items, jobs=DEFAULT_JOBS):
+    """
+    Call func for each item on a bounded thread pool.
+
+    Results are returned in the same order as items. Log output produced by
+    each call is buffered and flushed as one block, also in item order, so
+    concurrent peridio CLI calls stay readable. The first exception raised by
+    a call is re-raised after the pool has drained.
+
+    Parameters:
+    func (callable): Function called with a single item.
+    items (iterable): Work items.
+    jobs (int): Maximum number of calls in flight at once.
+    """
+    items = list(items)
+    if jobs is None or jobs < 1:
+        jobs = 1
+
+    if jobs == 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def run(item):
+        buffer = []
+        with buffered_output(buffer):
+            try:
+                return func(item), None, buffer
+            except BaseException as e:
+                return None, e, buffer
+
+    results = []
+    error = None
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as pool:
+        futures = [pool.submit(run, item) for item in items]
+        for future in futures:
+            result, exception, buffer = future.result()
+            flush_output(buffer)
+            if exception is not None and error is None:
+                error = exception
+            results.append(result)
+
+    if error is not None:
+        raise error
+    return results
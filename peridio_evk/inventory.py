@@ -0,0 +1,200 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from peridio_evk.state import get_state_connection
+from peridio_evk.utils import get_config_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    path TEXT PRIMARY KEY,
+    role TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    not_before INTEGER NOT NULL,
+    not_after INTEGER NOT NULL,
+    key_type TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS certificates_not_after ON certificates (not_after);
+CREATE INDEX IF NOT EXISTS certificates_serial ON certificates (serial);
+"""
+
+COLUMNS = [
+    "path",
+    "role",
+    "serial",
+    "subject",
+    "issuer",
+    "not_before",
+    "not_after",
+    "key_type",
+    "fingerprint",
+    "size",
+    "mtime_ns",
+]
+
+CERTIFICATE_ROLES = {
+    "root-certificate.pem": "root",
+    "intermediate-certificate.pem": "intermediate",
+    "verification-certificate.pem": "verification",
+    "device-certificate.pem": "device",
+}
+
+
+def get_inventory_connection():
+    conn = get_state_connection()
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def find_certificate_files():
+    """
+    Yield the path of every certificate the EVK manages under evk-data.
+    """
+    data_path = os.path.join(get_config_path(), "evk-data")
+    for directory in ["ca", "devices"]:
+        for root, _dirs, files in os.walk(os.path.join(data_path, directory)):
+            for name in files:
+                if name in CERTIFICATE_ROLES:
+                    yield os.path.join(root, name)
+
+
+def _key_type(public_key):
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return {"secp256r1": "p256", "secp384r1": "p384"}.get(
+            public_key.curve.name, public_key.curve.name
+        )
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "ed25519"
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f"rsa{public_key.key_size}"
+    return type(public_key).__name__
+
+
+def _timestamp(cert, attribute):
+    # cryptography 42 added timezone-aware variants of the validity dates.
+    value = getattr(cert, f"{attribute}_utc", None)
+    if value is None:
+        value = getattr(cert, attribute).replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def read_certificate_record(path, st=None):
+    st = st or os.stat(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    cert = x509.load_pem_x509_certificate(content)
+    return {
+        "path": path,
+        "role": CERTIFICATE_ROLES.get(os.path.basename(path), "other"),
+        "serial": str(cert.serial_number),
+        "subject": cert.subject.rfc4514_string(),
+        "issuer": cert.issuer.rfc4514_string(),
+        "not_before": _timestamp(cert, "not_valid_before"),
+        "not_after": _timestamp(cert, "not_valid_after"),
+        "key_type": _key_type(cert.public_key()),
+        "fingerprint": hashlib.sha256(content).hexdigest(),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def update_certificate_inventory(paths=None):
+    """
+    Bring the inventory up to date and return the number of certificates
+    that were (re)indexed.
+
+    Only files whose size or mtime differ from the index are parsed. When
+    paths is None every certificate under evk-data is considered and rows
+    for files that no longer exist are dropped; otherwise only the given
+    paths are refreshed.
+    """
+    conn = get_inventory_connection()
+    known = {
+        row[0]: (row[1], row[2])
+        for row in conn.execute("SELECT path, size, mtime_ns FROM certificates")
+    }
+    full_scan = paths is None
+    if full_scan:
+        paths = find_certificate_files()
+
+    seen = set()
+    records = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        seen.add(path)
+        if known.get(path) != (st.st_size, st.st_mtime_ns):
+            records.append(read_certificate_record(path, st))
+
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO certificates ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+            [[record[column] for column in COLUMNS] for record in records],
+        )
+        if full_scan:
+            conn.executemany(
+                "DELETE FROM certificates WHERE path = ?",
+                [(path,) for path in known if path not in seen],
+            )
+    return len(records)
+
+
+def get_certificate_record(path):
+    """
+    Return the inventory record of a certificate, indexing it first if the
+    file changed since it was last read.
+    """
+    update_certificate_inventory([path])
+    row = (
+        get_inventory_connection()
+        .execute(
+            f"SELECT {', '.join(COLUMNS)} FROM certificates WHERE path = ?",
+            (path,),
+        )
+        .fetchone()
+    )
+    return dict(zip(COLUMNS, row)) if row else None
+
+
+def query_certificates(
+    role=None, expiring_within=None, issuer=None, serial=None, subject=None
+):
+    """
+    Return indexed certificates ordered by expiry. expiring_within is a
+    number of days from now; issuer and subject match a substring of the
+    RFC 4514 name; serial is a decimal or 0x-prefixed hexadecimal string.
+    """
+    query = f"SELECT {', '.join(COLUMNS)} FROM certificates WHERE 1 = 1"
+    params = []
+    if role is not None:
+        query += " AND role = ?"
+        params.append(role)
+    if expiring_within is not None:
+        now = datetime.now(timezone.utc).timestamp()
+        query += " AND not_after <= ?"
+        params.append(int(now + expiring_within * 86400))
+    if issuer is not None:
+        query += " AND issuer LIKE ?"
+        params.append(f"%{issuer}%")
+    if subject is not None:
+        query += " AND subject LIKE ?"
+        params.append(f"%{subject}%")
+    if serial is not None:
+        query += " AND serial = ?"
+        if serial.lower().startswith("0x"):
+            serial = str(int(serial, 16))
+        params.append(serial)
+    query += " ORDER BY not_after, path"
+    return [
+        dict(zip(COLUMNS, row))
+        for row in get_inventory_connection().execute(query, params)
+    ]
@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import serialization
+from peridio_evk.crypto import (
+    DEFAULT_KEY_ALGORITHM,
+    build_end_entity_certificate,
+    generate_private_key,
+    private_key_to_pem,
+)
+
+# Batches smaller than this are issued in-process, where starting a process
+# pool would cost more than it saves.
+ISSUE_INLINE_THRESHOLD = 64
+ISSUE_CHUNK_SIZE = 256
+
+_signer = None
+
+
+def _load_signer(key_pem, cert_pem, key_algorithm=DEFAULT_KEY_ALGORITHM):
+    global _signer
+    _signer = (
+        serialization.load_pem_private_key(key_pem, password=None),
+        x509.load_pem_x509_certificate(cert_pem),
+        key_algorithm,
+    )
+
+
+def _issue(request):
+    """
+    Issue one certificate with the signer loaded in this process.
+
+    request is (common_name, pem). pem is a CSR, an existing private key
+    whose public key is certified as is, or None to generate a key of the
+    signer's configured device key algorithm and certify it directly, so no
+    signing request is serialized. Returns (common_name, key_pem or None, cert_pem).
+    """
+    common_name, pem = request
+    signer_key, signer_cert, key_algorithm = _signer
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    key_pem = None
+    if pem is None:
+        private_key = generate_private_key(key_algorithm)
+        public_key = private_key.public_key()
+        key_pem = private_key_to_pem(private_key)
+    elif b"CERTIFICATE REQUEST" in pem:
+        csr = x509.load_pem_x509_csr(pem)
+        public_key = csr.public_key()
+        subject = csr.subject
+    else:
+        public_key = serialization.load_pem_private_key(pem, None).public_key()
+
+    cert = build_end_entity_certificate(
+        subject, public_key, signer_key, signer_cert
+    )
+    return common_name, key_pem, cert.public_bytes(serialization.Encoding.PEM)
+
+
+def _issue_chunk(requests):
+    return [_issue(request) for request in requests]
+
+
+def issue_certificates(
+    requests,
+    signer_key_pem,
+    signer_cert_pem,
+    processes=None,
+    key_algorithm=DEFAULT_KEY_ALGORITHM,
+):
+    """
+    Issue end-entity certificates for a batch of requests in memory.
+
+    requests is a list of (common_name, pem) tuples as accepted by _issue.
+    The signer is parsed once per worker process and the batch is spread
+    over processes (os.cpu_count() by default) in chunks. Workers are
+    spawned rather than forked, as forking a process that runs the upload
+    and pipeline threads can copy locks held by those threads. Yields
+    (common_name, key_pem, cert_pem) in request order.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(requests) < ISSUE_INLINE_THRESHOLD:
+        _load_signer(signer_key_pem, signer_cert_pem, key_algorithm)
+        for request in requests:
+            yield _issue(request)
+        return
+
+    chunk_size = max(
+        1, min(ISSUE_CHUNK_SIZE, len(requests) // (processes * 4) or 1)
+    )
+    chunks = [
+        requests[i : i + chunk_size]
+        for i in range(0, len(requests), chunk_size)
+    ]
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_load_signer,
+        initargs=(signer_key_pem, signer_cert_pem, key_algorithm),
+    ) as pool:
+        for results in pool.map(_issue_chunk, chunks):
+            yield from results
+
+
+def write_issued_files(files):
+    """
+    Write (path, content, mode) tuples, creating parent directories once
+    per directory.
+    """
+    created = set()
+    for path, content, mode in files:
+        directory = os.path.dirname(path)
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+
+
+def benchmark_issuance(
+    count,
+    signer_key_pem,
+    signer_cert_pem,
+    processes=None,
+    key_algorithm=DEFAULT_KEY_ALGORITHM,
+):
+    """
+    Issue count certificates with generated keys and return the elapsed
+    seconds and certificates per second.
+    """
+    requests = [(f"BENCH-{index:06d}", None) for index in range(count)]
+    start = time.perf_counter()
+    issued = sum(
+        1
+        for _ in issue_certificates(
+            requests, signer_key_pem, signer_cert_pem, processes, key_algorithm
+        )
+    )
+    seconds = time.perf_counter() - start
+    return {
+        "count": issued,
+        "seconds": seconds,
+        "rate": issued / seconds if seconds > 0 else 0.0,
+    }
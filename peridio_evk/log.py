@@ -1,34 +1,104 @@
 import click
+import threading
+from contextlib import contextmanager
+
+_output_lock = threading.Lock()
+_output_local = threading.local()
+
+
+def _secho(message, **styles):
+    buffer = getattr(_output_local, "buffer", None)
+    if buffer is not None:
+        buffer.append((message, styles))
+        return
+    with _output_lock:
+        click.secho(message, **styles)
+
+
+@contextmanager
+def buffered_output(buffer):
+    """
+    Collect log output emitted by the current thread into buffer instead of
+    writing it to the terminal, so that concurrent tasks can be flushed as
+    whole, uninterleaved blocks.
+    """
+    previous = getattr(_output_local, "buffer", None)
+    _output_local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _output_local.buffer = previous
+
+
+class _PrefixedWriter:
+    def __init__(self, prefix):
+        self.prefix = click.style(f"[{prefix}]", dim=True)
+
+    def append(self, entry):
+        message, styles = entry
+        with _output_lock:
+            for line in str(message).splitlines() or [""]:
+                click.echo(f"{self.prefix} {click.style(line, **styles)}")
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+
+@contextmanager
+def prefixed_output(prefix):
+    """
+    Print log output emitted by the current thread right away, each line
+    tagged with prefix, so long-running concurrent tasks show progress and
+    nothing is lost if the process is interrupted. Blocks flushed by nested
+    buffered_output users are tagged the same way.
+    """
+    with buffered_output(_PrefixedWriter(prefix)) as writer:
+        yield writer
+
+
+def flush_output(buffer):
+    outer = getattr(_output_local, "buffer", None)
+    if outer is not None:
+        outer.extend(buffer)
+        return
+    with _output_lock:
+        for message, styles in buffer:
+            click.secho(message, **styles)
 
 
 def log_modify_file(file_path):
-    click.secho(f"  📁 Modifying File: {file_path}", fg="yellow")
+    _secho(f"  📁 Modifying File: {file_path}", fg="yellow")
 
 
 def log_cli_command(command):
-    click.secho(f'  ⬆️  CLI command: {" ".join(command)}', fg="bright_cyan")
+    _secho(f'  ⬆️  CLI command: {" ".join(command)}', fg="bright_cyan")
 
 
 def log_cli_response(result):
-    click.secho(f"  ⬇️  CLI result:", fg="bright_cyan")
-    click.secho(f"{result.strip()}", fg="bright_black")
+    _secho(f"  ⬇️  CLI result:", fg="bright_cyan")
+    _secho(f"{result.strip()}", fg="bright_black")
+
+
+def log_cli_stderr(line):
+    _secho(f"     CLI: {line.strip()}", fg="bright_black")
 
 
 def log_task(step):
-    click.secho(f"📋 {step}", fg="green", bold=True)
+    _secho(f"📋 {step}", fg="green", bold=True)
 
 
 def log_skip_task(step):
-    click.secho(f"📋 {step}", fg="green", bold=True)
+    _secho(f"📋 {step}", fg="green", bold=True)
 
 
 def log_success(step):
-    click.secho(f"✅ {step}", fg="green", bold=True)
+    _secho(f"✅ {step}", fg="green", bold=True)
 
 
 def log_info(message):
-    click.secho(f"  ℹ {message}", fg="bright_black")
+    _secho(f"  ℹ {message}", fg="bright_black")
 
 
 def log_error(message):
-    click.secho(f"❌ {message}", fg="red", bold=True)
+    _secho(f"❌ {message}", fg="red", bold=True)
@@ -0,0 +1,126 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from peridio_evk.executor import DEFAULT_JOBS
+from peridio_evk.log import (
+    log_info,
+    log_skip_task,
+    log_task,
+    prefixed_output,
+)
+
+
+class Task:
+    """
+    A node in a pipeline.
+
+    func is called with a dict mapping each required task name to its result.
+    Results of checkpointed tasks are written to the journal and must be JSON
+    serializable; tasks with checkpoint=False (for example ones with process
+    wide side effects) always run.
+    """
+
+    def __init__(self, name, func, requires=(), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.checkpoint = checkpoint
+
+
+def read_journal(journal_path, fingerprint):
+    if not os.path.exists(journal_path):
+        return {}
+    with open(journal_path, "r") as f:
+        try:
+            journal = json.load(f)
+        except ValueError:
+            return {}
+    if journal.get("fingerprint") != fingerprint:
+        return {}
+    return journal.get("completed", {})
+
+
+def write_journal(journal_path, fingerprint, completed):
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    tmp_path = f"{journal_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "completed": completed}, f)
+    os.replace(tmp_path, journal_path)
+
+
+def run_pipeline(tasks, journal_path, fingerprint, jobs=DEFAULT_JOBS):
+    """
+    Run a DAG of tasks, starting every task as soon as the tasks it requires
+    have finished.
+
+    Completed checkpointed tasks are recorded in a journal at journal_path.
+    If a run fails or is interrupted, the next run with the same fingerprint
+    reuses the journaled results and resumes at the tasks that did not
+    complete. The journal is removed once the whole pipeline succeeds.
+
+    Returns a dict mapping task names to results.
+    """
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        for requirement in task.requires:
+            if requirement not in by_name:
+                raise ValueError(
+                    f"Task '{task.name}' requires unknown task '{requirement}'"
+                )
+
+    journal = read_journal(journal_path, fingerprint)
+    results = {}
+    for task in tasks:
+        if task.checkpoint and task.name in journal:
+            log_skip_task(f"Resuming: {task.name} already completed")
+            results[task.name] = journal[task.name]
+
+    def run(task):
+        with prefixed_output(task.name):
+            try:
+                inputs = {name: results[name] for name in task.requires}
+                return task.func(inputs), None
+            except BaseException as e:
+                return None, e
+
+    pending = [task for task in tasks if task.name not in results]
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        while pending or running:
+            if error is None:
+                for task in list(pending):
+                    if all(name in results for name in task.requires):
+                        pending.remove(task)
+                        log_task(f"Starting: {task.name}")
+                        running[pool.submit(run, task)] = task
+
+            if not running:
+                if error is None:
+                    names = ", ".join(task.name for task in pending)
+                    raise ValueError(
+                        f"Pipeline has unsatisfiable tasks: {names}"
+                    )
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                result, exception = future.result()
+                if exception is not None:
+                    if error is None:
+                        error = exception
+                    continue
+                results[task.name] = result
+                if task.checkpoint:
+                    journal[task.name] = result
+                    write_journal(journal_path, fingerprint, journal)
+                log_info(f"Completed: {task.name}")
+
+    if error is not None:
+        log_info(f"Progress saved to {journal_path}")
+        raise error
+
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    return results
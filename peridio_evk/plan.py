@@ -0,0 +1,292 @@
+import copy
+import hashlib
+import json
+from peridio_evk.product import product_cohorts
+from peridio_evk.releases import evk_releases, r1001_artifacts, r1002_artifacts
+from peridio_evk.state import state_get
+
+
+def default_release_plan(product_name="edge-inference"):
+    """
+    Return the plan that initialize provisions: the EVK product and cohorts,
+    both artifact releases, their bundles and the two releases.
+    """
+    artifacts = []
+    bundles = []
+    for bundle_name, bundle_artifacts in [
+        ("r1001", r1001_artifacts),
+        ("r1002", r1002_artifacts),
+    ]:
+        for artifact in bundle_artifacts:
+            entry = next(
+                (a for a in artifacts if a["name"] == artifact["name"]), None
+            )
+            if entry is None:
+                entry = {
+                    "name": artifact["name"],
+                    "description": artifact["description"],
+                    "custom_metadata": artifact["custom_metadata"],
+                    "versions": [],
+                }
+                artifacts.append(entry)
+            if all(
+                v["version"] != artifact["version"] for v in entry["versions"]
+            ):
+                entry["versions"].append(
+                    {
+                        "version": artifact["version"],
+                        "targets": artifact["targets"],
+                    }
+                )
+        bundles.append(
+            {
+                "name": bundle_name,
+                "artifacts": [
+                    {"name": a["name"], "version": a["version"]}
+                    for a in bundle_artifacts
+                ],
+            }
+        )
+
+    return copy.deepcopy(
+        {
+            "product": {"name": product_name},
+            "cohorts": [
+                {"name": name, "description": description}
+                for name, description in product_cohorts
+            ],
+            "artifacts": artifacts,
+            "bundles": bundles,
+            "releases": evk_releases,
+        }
+    )
+
+
+def load_release_plan(plan_path):
+    """
+    Read and validate a plan file. Files ending in .yaml or .yml are parsed
+    with PyYAML when it is installed; anything else is read as JSON.
+    """
+    with open(plan_path, "r") as f:
+        if plan_path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(
+                    "PyYAML is required to read YAML plans, install it with 'pip install pyyaml' or use JSON"
+                )
+            plan = yaml.safe_load(f)
+        else:
+            plan = json.load(f)
+    validate_release_plan(plan)
+    return plan
+
+
+def write_release_plan(plan_path, plan):
+    # PyYAML is checked before the file is opened, so a missing dependency
+    # does not leave an empty plan behind.
+    if plan_path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(
+                "PyYAML is required to write YAML plans, install it with 'pip install pyyaml' or use JSON"
+            )
+        with open(plan_path, "w") as f:
+            yaml.safe_dump(plan, f, sort_keys=False)
+    else:
+        with open(plan_path, "w") as f:
+            json.dump(plan, f, indent=4)
+
+
+def validate_release_plan(plan):
+    if not isinstance(plan, dict) or "name" not in plan.get("product", {}):
+        raise ValueError("Plan must define product.name")
+
+    cohorts = [cohort["name"] for cohort in plan.get("cohorts", [])]
+    versions = set()
+    for artifact in plan.get("artifacts", []):
+        for version in artifact.get("versions", []):
+            versions.add((artifact["name"], version["version"]))
+
+    bundles = []
+    for bundle in plan.get("bundles", []):
+        bundles.append(bundle["name"])
+        for artifact in bundle["artifacts"]:
+            if (artifact["name"], artifact["version"]) not in versions:
+                raise ValueError(
+                    f"Bundle '{bundle['name']}' references unknown artifact version {artifact['name']} {artifact['version']}"
+                )
+
+    for release in plan.get("releases", []):
+        if release["bundle"] not in bundles:
+            raise ValueError(
+                f"Release '{release['name']}' references unknown bundle '{release['bundle']}'"
+            )
+        if release["cohort"] not in cohorts:
+            raise ValueError(
+                f"Release '{release['name']}' references unknown cohort '{release['cohort']}'"
+            )
+
+
+def _operation(kind, key, action, requires=(), spec=None, reason=None):
+    return {
+        "id": f"{kind}:{key}",
+        "kind": kind,
+        "key": key,
+        "action": action,
+        "requires": list(requires),
+        "spec": spec or {},
+        "reason": reason,
+    }
+
+
+def plan_operations(plan, organization_prn):
+    """
+    Diff a plan against the local state store.
+
+    Returns one operation per entity in the plan, in dependency order. The
+    action is 'create' for entities that are not known yet, 'unchanged' for
+    ones that are, and 'conflict' for bundles and releases that exist with
+    different contents; bundles and releases are immutable, so a changed one
+    must be given a new name. An operation's requires lists the ids of the
+    'create' operations it depends on.
+    """
+    operations = []
+    creates = set()
+
+    def add(kind, key, requires=(), spec=None, conflict=None):
+        known = state_get(organization_prn, kind, key)
+        if known is None:
+            action = "create"
+        elif conflict and conflict(known):
+            action = "conflict"
+        else:
+            action = "unchanged"
+        requires = [r for r in requires if r in creates]
+        operation = _operation(
+            kind,
+            key,
+            action,
+            requires,
+            spec,
+            conflict(known) if action == "conflict" else None,
+        )
+        if action == "create":
+            creates.add(operation["id"])
+        operations.append(operation)
+        return known
+
+    product_name = plan["product"]["name"]
+    add("product", product_name, spec={"name": product_name})
+
+    cohort_ids = []
+    for cohort in plan.get("cohorts", []):
+        add(
+            "cohort",
+            f"{product_name}:{cohort['name']}",
+            [f"product:{product_name}"],
+            {
+                "name": cohort["name"],
+                "description": cohort.get("description", ""),
+                "product_name": product_name,
+            },
+        )
+        cohort_ids.append(f"cohort:{product_name}:{cohort['name']}")
+
+    version_prns = {}
+    for artifact in plan.get("artifacts", []):
+        add(
+            "artifact",
+            artifact["name"],
+            spec={
+                "name": artifact["name"],
+                "description": artifact.get("description", ""),
+                "custom_metadata": artifact.get("custom_metadata", {}),
+            },
+        )
+        base_versions = {}
+        for version in artifact.get("versions", []):
+            version_key = f"{artifact['name']}:{version['version']}"
+            known = add(
+                "artifact-version",
+                version_key,
+                [f"artifact:{artifact['name']}"],
+                {"name": artifact["name"], "version": version["version"]},
+            )
+            version_prns[version_key] = known["prn"] if known else None
+            # Binaries are signed with a cohort signing key, so they wait for
+            # any cohort the plan is still creating. A binary is derived from
+            # the same target of the version listed before it, so it waits
+            # for that binary too.
+            for target in version["targets"]:
+                requires = [f"artifact-version:{version_key}", *cohort_ids]
+                spec = {
+                    "name": artifact["name"],
+                    "version": version["version"],
+                    "target": target,
+                }
+                base_version = base_versions.get(target["target"])
+                if base_version not in (None, version["version"]):
+                    requires.append(
+                        f"binary:{artifact['name']}:{base_version}:{target['target']}"
+                    )
+                    spec["base_version"] = base_version
+                add(
+                    "binary",
+                    f"{version_key}:{target['target']}",
+                    requires,
+                    spec,
+                )
+                base_versions[target["target"]] = version["version"]
+
+    bundle_prns = {}
+    for bundle in plan.get("bundles", []):
+        version_keys = [
+            f"{a['name']}:{a['version']}" for a in bundle["artifacts"]
+        ]
+
+        def bundle_conflict(known, version_keys=version_keys):
+            prns = [version_prns[key] for key in version_keys]
+            if None in prns or sorted(prns) != sorted(
+                known["metadata"].get("artifact_version_prns", prns)
+            ):
+                return "exists with different artifact versions"
+
+        known = add(
+            "bundle",
+            bundle["name"],
+            [f"artifact-version:{key}" for key in version_keys],
+            {"name": bundle["name"], "artifact_versions": version_keys},
+            bundle_conflict,
+        )
+        bundle_prns[bundle["name"]] = known["prn"] if known else None
+
+    for release in plan.get("releases", []):
+
+        def release_conflict(known, release=release):
+            bundle_prn = bundle_prns[release["bundle"]]
+            known_bundle_prn = known["metadata"].get("bundle_prn", bundle_prn)
+            if bundle_prn is None or bundle_prn != known_bundle_prn:
+                return (
+                    f"exists with a different bundle than '{release['bundle']}'"
+                )
+
+        add(
+            "release",
+            release["name"],
+            [
+                f"cohort:{product_name}:{release['cohort']}",
+                f"bundle:{release['bundle']}",
+            ],
+            dict(release, product_name=product_name),
+            release_conflict,
+        )
+
+    return operations
+
+
+def plan_fingerprint(operations):
+    return hashlib.sha256(
+        json.dumps(operations, sort_keys=True).encode()
+    ).hexdigest()
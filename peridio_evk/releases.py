@@ -1,93 +1,198 @@
+import copy
+import time
 from peridio_evk.utils import *
 from peridio_evk.log import *
+from peridio_evk.executor import run_parallel, DEFAULT_JOBS
+from peridio_evk.state import state_get, state_put
+from peridio_evk.upload import log_upload_summary
+from peridio_evk.binary_store import store_binary, get_stored_binary_prn, put_stored_binary_prn
+from peridio_evk.delta import DELTA_MAGIC, create_delta
 
-def do_create_artifacts(organization_prn, cohort_prn):
+r1001_artifacts = [
+    {'name': 'edge-inference-os', 'description': 'Edge Inference Product OS', 'version': 'v1.12.1', 'targets': [{'target': 'arm64-v8', 'bytes': 67108864}, {'target': 'x86_64', 'bytes': 69206016}], 
+        "custom_metadata": {"peridiod": {"installer": "fwup", "installer_opts": {"cache_enabled": False}, "reboot_required": True}}},
+    {'name': 'edge-inference-service', 'description': 'Edge Inference Service', 'version': 'v1.5.3', 'targets': [{'target': 'arm64-v8', 'bytes': 10485760}, {'target': 'x86_64', 'bytes': 14680064}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-service.img", "reboot_required": False}}}},
+    {'name': 'edge-inference-peripheral', 'description': 'Edge Inference Peripheral Firmware', 'version': 'v1.9.10', 'targets': [{'target': 'arm-cortex-m33', 'bytes': 2097152}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-peripheral.bin", "reboot_required": False}}}},
+    {'name': 'edge-inference-model', 'description': 'Edge Inference ML Model', 'version': 'v1.4.0', 'targets': [{'target': 'arm-ethos-u65', 'bytes': 33554432}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-model.onnx", "reboot_required": False}}}}
+]
+
+r1002_artifacts = [
+    {'name': 'edge-inference-os', 'description': 'Edge Inference Product OS', 'version': 'v1.12.1', 'targets': [{'target': 'arm64-v8', 'bytes': 67108864}, {'target': 'x86_64', 'bytes': 69206016}], 
+        "custom_metadata": {"peridiod": {"installer": "fwup", "installer_opts": {"cache_enabled": False}, "reboot_required": True}}},
+    {'name': 'edge-inference-service', 'description': 'Edge Inference Service', 'version': 'v2.0.0', 'targets': [{'target': 'arm64-v8', 'bytes': 10486260}, {'target': 'x86_64', 'bytes': 14685064}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-service.img", "reboot_required": False}}}},
+    {'name': 'edge-inference-peripheral', 'description': 'Edge Inference Peripheral Firmware', 'version': 'v1.9.10', 'targets': [{'target': 'arm-cortex-m33', 'bytes': 2097152}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-peripheral.bin", "reboot_required": False}}}},
+    {'name': 'edge-inference-model', 'description': 'Edge Inference ML Model', 'version': 'v2.1.0', 'targets': [{'target': 'arm-ethos-u65', 'bytes': 43554432}],
+        "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-model.onnx", "reboot_required": False}}}}
+]
+
+evk_releases = [
+    {'name': 'release-r1001', 'bundle': 'r1001', 'cohort': 'release', 'version': '1.1.0', 'version_requirement': '', 'disabled': False, 'phase_tags': []},
+    {'name': 'release-r1002', 'bundle': 'r1002', 'cohort': 'release', 'version': '2.0.0', 'version_requirement': '~> 1.1', 'disabled': True, 'phase_tags': ['canary']}
+]
+
+def do_create_artifacts(organization_prn, cohort_prn, jobs=DEFAULT_JOBS, artifact_seed=None, artifact_compressibility=0.0, deltas='off', artifact_change_fraction=DEFAULT_ARTIFACT_CHANGE_FRACTION):
     log_task('Creating Artifacts')
-    artifacts_start = [
-        {'name': 'edge-inference-os', 'description': 'Edge Inference Product OS', 'version': 'v1.12.1', 'targets': [{'target': 'arm64-v8', 'bytes': 67108864}, {'target': 'x86_64', 'bytes': 69206016}], 
-            "custom_metadata": {"peridiod": {"installer": "fwup", "installer_opts": {"cache_enabled": False}, "reboot_required": True}}},
-        {'name': 'edge-inference-service', 'description': 'Edge Inference Service', 'version': 'v1.5.3', 'targets': [{'target': 'arm64-v8', 'bytes': 10485760}, {'target': 'x86_64', 'bytes': 14680064}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-service.img", "reboot_required": False}}}},
-        {'name': 'edge-inference-peripheral', 'description': 'Edge Inference Peripheral Firmware', 'version': 'v1.9.10', 'targets': [{'target': 'arm-cortex-m33', 'bytes': 2097152}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-peripheral.bin", "reboot_required": False}}}},
-        {'name': 'edge-inference-model', 'description': 'Edge Inference ML Model', 'version': 'v1.4.0', 'targets': [{'target': 'arm-ethos-u65', 'bytes': 33554432}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-model.onnx", "reboot_required": False}}}}
-    ]
-
-    artifacts_end = [
-        {'name': 'edge-inference-os', 'description': 'Edge Inference Product OS', 'version': 'v1.12.1', 'targets': [{'target': 'arm64-v8', 'bytes': 67108864}, {'target': 'x86_64', 'bytes': 69206016}], 
-            "custom_metadata": {"peridiod": {"installer": "fwup", "installer_opts": {"cache_enabled": False}, "reboot_required": True}}},
-        {'name': 'edge-inference-service', 'description': 'Edge Inference Service', 'version': 'v2.0.0', 'targets': [{'target': 'arm64-v8', 'bytes': 10486260}, {'target': 'x86_64', 'bytes': 14685064}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-service.img", "reboot_required": False}}}},
-        {'name': 'edge-inference-peripheral', 'description': 'Edge Inference Peripheral Firmware', 'version': 'v1.9.10', 'targets': [{'target': 'arm-cortex-m33', 'bytes': 2097152}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-peripheral.bin", "reboot_required": False}}}},
-        {'name': 'edge-inference-model', 'description': 'Edge Inference ML Model', 'version': 'v2.1.0', 'targets': [{'target': 'arm-ethos-u65', 'bytes': 43554432}],
-            "custom_metadata": {"peridiod": {"installer": "file", "installer_opts": {"path": "/opt/edge-inference", "name": "edge-inference-model.onnx", "reboot_required": False}}}}
-    ]
-
-    bundle_start, artifacts = do_create_artifacts_bundle(artifacts_start, 'r1001', organization_prn)
-    bundle_end, _artifacts = do_create_artifacts_bundle(artifacts_end, 'r1002', organization_prn)
+    artifacts_start = copy.deepcopy(r1001_artifacts)
+    artifacts_end = copy.deepcopy(r1002_artifacts)
+    # New versions are derived from the version they replace, so the two
+    # releases share content the way real firmware updates do.
+    for artifact in artifacts_end:
+        artifact_from = find_dict_by_name(artifacts_start, artifact['name'])
+        if artifact_from is not None and artifact_from['version'] != artifact['version']:
+            artifact['base_version'] = artifact_from['version']
+
+    bundle_start, artifacts = do_create_artifacts_bundle(artifacts_start, 'r1001', organization_prn, jobs, artifact_seed, artifact_compressibility, artifact_change_fraction)
+    bundle_end, _artifacts = do_create_artifacts_bundle(artifacts_end, 'r1002', organization_prn, jobs, artifact_seed, artifact_compressibility, artifact_change_fraction)
+    if deltas != 'off':
+        do_create_artifact_deltas(artifacts_start, artifacts_end, deltas == 'register', jobs)
     
-    release_from = do_create_release('release-r1001', organization_prn, cohort_prn, bundle_start, '1.1.0', '', False, [])
-    do_create_release('release-r1002', organization_prn, cohort_prn, bundle_end, '2.0.0', '~> 1.1', True, ['canary'])
+    release_start, release_end = evk_releases
+    release_from = do_create_release(release_start['name'], organization_prn, cohort_prn, bundle_start, release_start['version'], release_start['version_requirement'], release_start['disabled'], release_start['phase_tags'])
+    do_create_release(release_end['name'], organization_prn, cohort_prn, bundle_end, release_end['version'], release_end['version_requirement'], release_end['disabled'], release_end['phase_tags'])
     return release_from, artifacts
 
-def do_create_artifacts_bundle(artifacts, bundle_name, organization_prn):
+def do_create_artifacts_bundle(artifacts, bundle_name, organization_prn, jobs=DEFAULT_JOBS, artifact_seed=None, artifact_compressibility=0.0, artifact_change_fraction=DEFAULT_ARTIFACT_CHANGE_FRACTION):
     for artifact in artifacts:
         log_info(f'{artifact["name"]}: {artifact["version"]}')
-    artifact_version_prns = []
-    for artifact in artifacts:
-        evk_config = read_evk_config()
-        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifacts', 'create', '--organization-prn', evk_config['organization_prn'], '--name', artifact['name'], '--description', artifact['description'], '--custom-metadata', json.dumps(artifact['custom_metadata'])])
-        if result.returncode != 0:
-            log_skip_task('Artifact Exists')
-            result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifacts', 'list', '--search', f'organization_prn:\'{evk_config["organization_prn"]}\' and name:\'{artifact["name"]}\''])
-            response = json.loads(result.stdout)
-            artifact_prn = response['artifacts'][0]['prn']
-        else:
-            log_task('Creating Artifact')
-            response = json.loads(result.stdout)
-            artifact_prn = response['artifact']['prn']
-            log_info(f'Artifact PRN: {artifact_prn}')
 
-        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifact-versions', 'create', '--artifact-prn', artifact_prn, '--version', artifact['version'], '--description', artifact['version']])
-        if result.returncode != 0:
+    def create_artifact_and_version(artifact):
+        artifact_version_key = f'{artifact["name"]}:{artifact["version"]}'
+        evk_config = read_evk_config()
+        known = state_get(evk_config['organization_prn'], 'artifact-version', artifact_version_key)
+        if known:
             log_skip_task('Artifact Version Exists')
-            result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifact-versions', 'list', '--search', f'organization_prn:\'{evk_config["organization_prn"]}\' and artifact_prn:\'{artifact_prn}\' and description:\'{artifact["version"]}\''])
-            response = json.loads(result.stdout)
-            artifact_version_prn = response['artifact_versions'][0]['prn']
-        else:
-            log_task('Creating Artifact Version')
-            response = json.loads(result.stdout)
-            artifact_version_prn = response['artifact_version']['prn']
-            log_info(f'Artifact Version PRN: {artifact_version_prn}')
-        
-        artifact_version_prns.append(artifact_version_prn)
-
-        config_path = get_config_path()
-        artifacts_path = os.path.join(config_path, 'evk-data', 'artifacts')
-        if not os.path.exists(artifacts_path):
-            os.makedirs(artifacts_path)
-
-        for target in artifact['targets']:
-            artifact_binary_path = os.path.join(artifacts_path, f'{artifact["name"]}-{artifact["version"]}-{target["target"]}')
-            if not os.path.exists(artifact_binary_path):
-                log_task('Creating Artifact Binary')
-                generate_random_bytes_file(artifact_binary_path, target['bytes'])
-                log_modify_file(artifact_binary_path)
-            else:
-                log_skip_task('Artifact Binary Exists')
+            return known['prn']
+        artifact_prn = create_artifact(artifact)
+        return create_artifact_version(artifact['name'], artifact_prn, artifact['version'])
 
-            result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'binaries', 'create', '--artifact-version-prn', artifact_version_prn, '--target', target['target'], '--content-path', artifact_binary_path, '--signing-key-pair', 'release-signing-key'])
-            if result.returncode != 0:
-                response = json.loads(result.stdout)
-                binary_prn = response['binaries'][0]['prn']
-                log_info(f'Binary PRN: {binary_prn}')
-            else:
-                response = json.loads(result.stdout)
-                binary_prn = response['binary']['prn']
-                log_info(f'Binary PRN: {binary_prn}')
-            target['binary_prn'] = binary_prn
+    artifact_version_prns = run_parallel(create_artifact_and_version, artifacts, jobs)
+    for artifact, artifact_version_prn in zip(artifacts, artifact_version_prns):
+        artifact['artifact_version_prn'] = artifact_version_prn
+
+    def create_binary(artifact_target):
+        artifact, target = artifact_target
+        target['binary_prn'] = create_artifact_binary(artifact, artifact['artifact_version_prn'], target, artifact_seed, artifact_compressibility, artifact_change_fraction)
+
+    # Every target binary is independent once its artifact version exists, so
+    # binaries across all artifacts of the bundle are created in one pool.
+    artifact_targets = [(artifact, target) for artifact in artifacts for target in artifact['targets']]
+    upload_start = time.monotonic()
+    run_parallel(create_binary, artifact_targets, jobs)
+    log_upload_summary(upload_start)
+
+    bundle_prn = create_bundle(bundle_name, artifact_version_prns, organization_prn)
+    return bundle_prn, artifacts
+
+def create_artifact(artifact):
+    evk_config = read_evk_config()
+    known = state_get(evk_config['organization_prn'], 'artifact', artifact['name'])
+    if known:
+        log_skip_task('Artifact Exists')
+        return known['prn']
+
+    result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifacts', 'create', '--organization-prn', evk_config['organization_prn'], '--name', artifact['name'], '--description', artifact['description'], '--custom-metadata', json.dumps(artifact['custom_metadata'])])
+    if result.returncode != 0:
+        log_skip_task('Artifact Exists')
+        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifacts', 'list', '--search', f'organization_prn:\'{evk_config["organization_prn"]}\' and name:\'{artifact["name"]}\''])
+        response = json.loads(result.stdout)
+        artifact_prn = response['artifacts'][0]['prn']
+    else:
+        log_task('Creating Artifact')
+        response = json.loads(result.stdout)
+        artifact_prn = response['artifact']['prn']
+        log_info(f'Artifact PRN: {artifact_prn}')
+    state_put(evk_config['organization_prn'], 'artifact', artifact['name'], artifact_prn)
+    return artifact_prn
+
+def create_artifact_version(artifact_name, artifact_prn, version):
+    evk_config = read_evk_config()
+    artifact_version_key = f'{artifact_name}:{version}'
+    known = state_get(evk_config['organization_prn'], 'artifact-version', artifact_version_key)
+    if known:
+        log_skip_task('Artifact Version Exists')
+        return known['prn']
+
+    result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifact-versions', 'create', '--artifact-prn', artifact_prn, '--version', version, '--description', version])
+    if result.returncode != 0:
+        log_skip_task('Artifact Version Exists')
+        result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'artifact-versions', 'list', '--search', f'organization_prn:\'{evk_config["organization_prn"]}\' and artifact_prn:\'{artifact_prn}\' and description:\'{version}\''])
+        response = json.loads(result.stdout)
+        artifact_version_prn = response['artifact_versions'][0]['prn']
+    else:
+        log_task('Creating Artifact Version')
+        response = json.loads(result.stdout)
+        artifact_version_prn = response['artifact_version']['prn']
+        log_info(f'Artifact Version PRN: {artifact_version_prn}')
+    state_put(evk_config['organization_prn'], 'artifact-version', artifact_version_key, artifact_version_prn, {'artifact_prn': artifact_prn})
+    return artifact_version_prn
+
+def get_artifact_binary_path(artifact_name, version, target_name):
+    artifacts_path = os.path.join(get_config_path(), 'evk-data', 'artifacts')
+    return os.path.join(artifacts_path, f'{artifact_name}-{version}-{target_name}')
+
+def create_artifact_binary(artifact, artifact_version_prn, target, artifact_seed=None, artifact_compressibility=0.0, artifact_change_fraction=DEFAULT_ARTIFACT_CHANGE_FRACTION):
+    evk_config = read_evk_config()
+    artifact_binary_path = get_artifact_binary_path(artifact['name'], artifact['version'], target['target'])
+    os.makedirs(os.path.dirname(artifact_binary_path), exist_ok=True)
+    if not os.path.exists(artifact_binary_path):
+        log_task('Creating Artifact Binary')
+        # Seeded binaries are keyed by their identity so that identical
+        # inputs reproduce identical content on any machine.
+        seed = None if artifact_seed is None else f'{artifact_seed}:{artifact["name"]}:{artifact["version"]}:{target["target"]}'
+        # A version with a base_version rewrites only part of that version's
+        # binary, when it was generated first.
+        base_path = None
+        if artifact.get('base_version'):
+            base_path = get_artifact_binary_path(artifact['name'], artifact['base_version'], target['target'])
+            if not os.path.exists(base_path):
+                base_path = None
+        generate_random_bytes_file(artifact_binary_path, target['bytes'], seed, artifact_compressibility, base_path=base_path, change_fraction=artifact_change_fraction)
+        log_modify_file(artifact_binary_path)
+    else:
+        log_skip_task('Artifact Binary Exists')
+
+    binary_key = f'{artifact["name"]}:{artifact["version"]}:{target["target"]}'
+    known = state_get(evk_config['organization_prn'], 'binary', binary_key)
+    if known:
+        log_skip_task('Binary Exists')
+        log_info(f'Binary PRN: {known["prn"]}')
+        return known['prn']
+
+    # Binaries belong to one artifact version and target, so the content hash
+    # only finds uploads for this same version and target.
+    binary_hash = store_binary(artifact_binary_path)
+    log_info(f'Binary SHA-256: {binary_hash}')
+    binary_prn = get_stored_binary_prn(binary_hash, artifact_version_prn, target['target'])
+    if binary_prn:
+        log_skip_task('Binary Already Uploaded')
+        log_info(f'Binary PRN: {binary_prn}')
+        state_put(evk_config['organization_prn'], 'binary', binary_key, binary_prn, {'artifact_version_prn': artifact_version_prn, 'sha256': binary_hash})
+        return binary_prn
+
+    result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'binaries', 'create', '--artifact-version-prn', artifact_version_prn, '--target', target['target'], '--content-path', artifact_binary_path, '--signing-key-pair', 'release-signing-key'])
+    if result.returncode != 0:
+        response = json.loads(result.stdout)
+        binary_prn = response['binaries'][0]['prn']
+        log_info(f'Binary PRN: {binary_prn}')
+    else:
+        response = json.loads(result.stdout)
+        binary_prn = response['binary']['prn']
+        log_info(f'Binary PRN: {binary_prn}')
+    put_stored_binary_prn(binary_hash, artifact_version_prn, target['target'], binary_prn)
+    state_put(evk_config['organization_prn'], 'binary', binary_key, binary_prn, {'artifact_version_prn': artifact_version_prn, 'sha256': binary_hash})
+    return binary_prn
+
+def create_bundle(bundle_name, artifact_version_prns, organization_prn):
+    evk_config = read_evk_config()
+    known = state_get(evk_config['organization_prn'], 'bundle', bundle_name)
+    if known:
+        log_skip_task('Bundle already Exists')
+        return known['prn']
 
     result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'bundles', 'create', '--artifact-version-prns', f'{" ".join(artifact_version_prns)}', '--name', bundle_name, '--organization-prn', organization_prn])
     if result.returncode == 0:
@@ -100,7 +205,70 @@ def do_create_artifacts_bundle(artifacts, bundle_name, organization_prn):
         result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'bundles', 'list', '--search', f'organization_prn:\'{evk_config["organization_prn"]}\' and name:\'{bundle_name}\''])
         response = json.loads(result.stdout)
         bundle_prn = response['bundles'][0]['prn']
-    return bundle_prn, artifacts
+    state_put(evk_config['organization_prn'], 'bundle', bundle_name, bundle_prn, {'artifact_version_prns': artifact_version_prns})
+    return bundle_prn
+
+def do_create_artifact_deltas(artifacts_from, artifacts_to, register=False, jobs=DEFAULT_JOBS):
+    log_task('Creating Artifact Deltas')
+    evk_config = read_evk_config()
+    artifacts_path = os.path.join(get_config_path(), 'evk-data', 'artifacts')
+    deltas_path = os.path.join(artifacts_path, 'deltas')
+    os.makedirs(deltas_path, exist_ok=True)
+
+    pairs = []
+    for artifact_to in artifacts_to:
+        artifact_from = find_dict_by_name(artifacts_from, artifact_to['name'])
+        if artifact_from is None or artifact_from['version'] == artifact_to['version']:
+            continue
+        from_targets = [target['target'] for target in artifact_from['targets']]
+        for target in artifact_to['targets']:
+            if target['target'] in from_targets:
+                pairs.append((artifact_from, artifact_to, target))
+
+    def create_artifact_delta(pair):
+        artifact_from, artifact_to, target = pair
+        name = artifact_to['name']
+        from_path = get_artifact_binary_path(name, artifact_from['version'], target['target'])
+        to_path = get_artifact_binary_path(name, artifact_to['version'], target['target'])
+        delta_path = os.path.join(deltas_path, f'{name}-{artifact_from["version"]}-{artifact_to["version"]}-{target["target"]}.delta')
+        result = create_delta(from_path, to_path, delta_path)
+        log_info(f'{name} {target["target"]} {artifact_from["version"]} -> {artifact_to["version"]}: {result["delta_size"]} / {result["full_size"]} bytes ({result["ratio"]:.1%})')
+        log_modify_file(delta_path)
+        entry = {'name': name, 'target': target['target'], 'from_version': artifact_from['version'], 'to_version': artifact_to['version'], 'path': delta_path, **result}
+
+        if register and result['ratio'] >= 1:
+            log_skip_task('Delta Binary Not Registered')
+            log_info(f'{name} {target["target"]} delta is no smaller than the full binary')
+        elif register:
+            # A version has one binary per target, which the full binary
+            # takes, so deltas use a '<target>-delta-<from version>' target
+            # that devices do not match on. The custom metadata records the
+            # real target and the binaries the delta links, see README.md.
+            delta_target = f'{target["target"]}-delta-{artifact_from["version"]}'
+            from_target = next(t for t in artifact_from['targets'] if t['target'] == target['target'])
+            delta_metadata = {'peridio_evk': {'delta': {'format': DELTA_MAGIC.decode(), 'target': target['target'], 'from_version': artifact_from['version'], 'from_binary_prn': from_target.get('binary_prn'), 'to_binary_prn': target.get('binary_prn')}}}
+            binary_key = f'{name}:{artifact_to["version"]}:{delta_target}'
+            known = state_get(evk_config['organization_prn'], 'binary', binary_key)
+            if known:
+                log_skip_task('Delta Binary Exists')
+                entry['binary_prn'] = known['prn']
+            else:
+                result = peridio_cli(['peridio', '--profile', evk_config['profile'], 'binaries', 'create', '--artifact-version-prn', artifact_to['artifact_version_prn'], '--target', delta_target, '--content-path', delta_path, '--custom-metadata', json.dumps(delta_metadata), '--signing-key-pair', 'release-signing-key'])
+                if result.returncode == 0:
+                    entry['binary_prn'] = json.loads(result.stdout)['binary']['prn']
+                    log_info(f'Delta Binary PRN: {entry["binary_prn"]}')
+                    state_put(evk_config['organization_prn'], 'binary', binary_key, entry['binary_prn'], {'artifact_version_prn': artifact_to['artifact_version_prn']})
+                else:
+                    log_error(result.stderr)
+        return entry
+
+    report = run_parallel(create_artifact_delta, pairs, jobs)
+    full_size = sum(entry['full_size'] for entry in report)
+    delta_size = sum(entry['delta_size'] for entry in report)
+    if full_size:
+        log_info(f'Delta transfer: {delta_size} / {full_size} bytes ({delta_size / full_size:.1%})')
+    write_json_file(os.path.join(deltas_path, 'report.json'), report)
+    return report
 
 def do_create_release(release_name, organization_prn, cohort_prn, bundle_prn, version, version_requirement, disabled, phase_tags):
     log_task('Create Release')
@@ -109,6 +277,11 @@ def do_create_release(release_name, organization_prn, cohort_prn, bundle_prn, ve
     log_info(f'Bundle PRN: {bundle_prn}')
 
     evk_config = read_evk_config()
+    known = state_get(evk_config['organization_prn'], 'release', release_name)
+    if known:
+        log_skip_task('Release already Exists')
+        return known['metadata']
+
     current_time = get_current_time_iso8601()
 
     command = ['peridio', '--profile', evk_config['profile'], 'releases', 'create', '--organization-prn', organization_prn, '--bundle-prn', bundle_prn, '--cohort-prn', cohort_prn, '--name', release_name, '--schedule-date', current_time, '--disabled', boolean_to_string_lower(disabled), '--version', version, '--version-requirement', version_requirement]
@@ -129,4 +302,5 @@ def do_create_release(release_name, organization_prn, cohort_prn, bundle_prn, ve
         if result.returncode == 0:
             response = json.loads(result.stdout)
             release = response['releases'][0]
+    state_put(evk_config['organization_prn'], 'release', release_name, release['prn'], release)
     return release
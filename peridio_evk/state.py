@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import threading
+from peridio_evk.utils import get_config_path, get_current_time_iso8601
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    organization_prn TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    prn TEXT NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (organization_prn, kind, key)
+);
+CREATE INDEX IF NOT EXISTS entities_prn ON entities (prn);
+"""
+
+_local = threading.local()
+
+
+def get_state_path():
+    return os.path.join(get_config_path(), "evk-data", "state.db")
+
+
+def get_state_connection():
+    """
+    Return this thread's connection to the state store, creating the
+    database and schema on first use.
+    """
+    state_path = get_state_path()
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(state_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        conn = sqlite3.connect(state_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        connections[state_path] = conn
+    return conn
+
+
+def state_get(organization_prn, kind, key):
+    """
+    Look up an entity by its natural key.
+
+    Returns a dict with 'prn' and 'metadata', or None if the entity is not
+    known locally.
+    """
+    row = (
+        get_state_connection()
+        .execute(
+            "SELECT prn, metadata FROM entities "
+            "WHERE organization_prn = ? AND kind = ? AND key = ?",
+            (organization_prn, kind, key),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    return {"prn": row[0], "metadata": json.loads(row[1])}
+
+
+def state_put(organization_prn, kind, key, prn, metadata=None):
+    conn = get_state_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO entities "
+            "(organization_prn, kind, key, prn, metadata, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (organization_prn, kind, key) DO UPDATE SET "
+            "prn = excluded.prn, metadata = excluded.metadata, "
+            "updated_at = excluded.updated_at",
+            (
+                organization_prn,
+                kind,
+                key,
+                prn,
+                json.dumps(metadata or {}),
+                get_current_time_iso8601(),
+            ),
+        )
+
+
+def state_list(organization_prn, kind=None):
+    query = "SELECT kind, key, prn, metadata FROM entities WHERE organization_prn = ?"
+    params = [organization_prn]
+    if kind is not None:
+        query += " AND kind = ?"
+        params.append(kind)
+    query += " ORDER BY kind, key"
+    return [
+        {
+            "kind": row[0],
+            "key": row[1],
+            "prn": row[2],
+            "metadata": json.loads(row[3]),
+        }
+        for row in get_state_connection().execute(query, params)
+    ]
+
+
+def state_clear(organization_prn):
+    """
+    Forget every entity recorded for an organization so that the next run
+    re-resolves them from Peridio Cloud.
+    """
+    conn = get_state_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM entities WHERE organization_prn = ?",
+            (organization_prn,),
+        )
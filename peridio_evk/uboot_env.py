@@ -1,7 +1,13 @@
+import fcntl
+import mmap
+import os
+import struct
+import zlib
 import uboot
+from peridio_evk.executor import DEFAULT_JOBS, run_parallel
 
 
-def create_uboot_env(env_vars, env_file_path, env_size):
+def create_uboot_env(env_vars, env_file_path, env_size, redundant=False):
     """
     Create a U-Boot environment file with a valid CRC using the uboot Python module and specify the environment size.
 
@@ -9,9 +15,22 @@ def create_uboot_env(env_vars, env_file_path, env_size):
     env_vars (dict): A dictionary of environment variables.
     env_file_path (str): The path where the environment file will be saved.
     env_size (int): The desired size of the environment file in bytes.
+    redundant (bool): Write two copies with flag bytes, see uboot_env_layout.
+    """
+    env_data = create_uboot_env_data(env_vars, env_size, redundant)
+    write_uboot_env_data(env_data, env_file_path, env_size)
+
+
+def create_uboot_env_data(env_vars, env_size, redundant=False):
+    """
+    Return a U-Boot environment blob of env_size bytes with a valid CRC.
+
+    With redundant set the blob holds two env_size copies back to back, each
+    with a flag byte after the CRC. Both copies are valid and the first one
+    is active, so the first update goes to the second copy.
     """
     # Create an instance of the U-Boot environment
-    env = uboot.EnvBlob(size=env_size)
+    env = uboot.EnvBlob(size=env_size, redundant=redundant)
 
     # Set the environment variables
     for key, value in env_vars.items():
@@ -25,8 +44,274 @@ def create_uboot_env(env_vars, env_file_path, env_size):
         raise ValueError("Environment data exceeds the specified size.")
 
     # Pad the environment data to the desired size
-    padded_env_data = env_data.ljust(env_size, b"\x00")
+    env_data = env_data.ljust(env_size, b"\x00")
+    if not redundant:
+        return env_data
+    flag = UBOOT_ENV_CRC_SIZE
+    standby = (
+        env_data[:flag] + bytes([env_data[flag] - 1]) + env_data[flag + 1 :]
+    )
+    return env_data + standby
+
+
+def write_uboot_env_data(env_data, env_file_path, env_size):
+    """
+    Atomically write an environment blob made of env_size copies, leaving
+    the zero padding of each copy as a hole so that each copy only occupies
+    the blocks holding variables.
+
+    The blob goes to a temporary file that is renamed into place, so a crash
+    never leaves both copies torn. Device containers bind mount the device
+    directory rather than the file, so they see the renamed file.
+    """
+    tmp_path = f"{env_file_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for offset in range(0, len(env_data), env_size):
+            copy = env_data[offset : offset + env_size]
+            f.seek(offset)
+            f.write(copy[: len(copy.rstrip(b"\x00"))])
+        f.truncate(len(env_data))
+    os.replace(tmp_path, env_file_path)
+
+
+UBOOT_ENV_CRC_SIZE = 4
+UBOOT_ENV_FLAG_SIZE = 1
+FW_ENV_CONFIG = "fw_env.config"
+
+
+class UBootEnvError(ValueError):
+    pass
+
+
+def uboot_env_layout(env_size, redundant=False):
+    """
+    Return the (offset, size) of each environment copy in a file. The
+    redundant layout keeps the second copy right after the first one.
+    """
+    if redundant:
+        return [(0, env_size), (env_size, env_size)]
+    return [(0, env_size)]
+
+
+def format_fw_env_config(device, layout):
+    return "".join(
+        f"{device} 0x{offset:04x} 0x{size:x}\n" for offset, size in layout
+    )
+
+
+def parse_fw_env_config(content):
+    """
+    Return the (offset, size) of each copy listed in an fw_env.config.
+    """
+    layout = []
+    for line in content.splitlines():
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) < 3:
+            raise UBootEnvError(f"Malformed fw_env.config line '{line}'")
+        layout.append((int(fields[1], 0), int(fields[2], 0)))
+    if len(layout) not in (1, 2):
+        raise UBootEnvError("fw_env.config must list one or two copies")
+    return layout
+
+
+def _resolve_layout(env_file_path, layout, file_size):
+    # Like fw_printenv, the layout comes from the fw_env.config that is
+    # deployed next to the environment, and otherwise the file is a single
+    # copy.
+    if layout is not None:
+        return layout
+    config_path = os.path.join(os.path.dirname(env_file_path), FW_ENV_CONFIG)
+    try:
+        with open(config_path, "r") as f:
+            return parse_fw_env_config(f.read())
+    except FileNotFoundError:
+        return [(0, file_size)]
+
+
+def _env_region(layout, index):
+    offset, size = layout[index]
+    header = UBOOT_ENV_CRC_SIZE
+    if len(layout) > 1:
+        header += UBOOT_ENV_FLAG_SIZE
+    return offset + header, offset + size
+
+
+def _newer_flag(flag, other):
+    # Redundant copies use incrementing flags that wrap from 255 to 0.
+    if flag == 0 and other == 0xFF:
+        return True
+    if flag == 0xFF and other == 0:
+        return False
+    return flag > other
+
+
+def _parse_vars(blob, start, end):
+    terminator = blob.find(b"\x00\x00", start, end)
+    if terminator < 0:
+        raise UBootEnvError("Environment is not terminated")
+    env_vars = {}
+    for entry in blob[start : terminator + 1].split(b"\x00"):
+        if not entry:
+            continue
+        name, sep, value = entry.partition(b"=")
+        if not sep:
+            raise UBootEnvError(f"Malformed environment entry {entry!r}")
+        env_vars[name.decode("utf-8")] = value.decode("utf-8")
+    return env_vars
+
+
+def _serialize_vars(env_vars):
+    return (
+        b"".join(
+            f"{name}={value}".encode("utf-8") + b"\x00"
+            for name, value in env_vars.items()
+        )
+        + b"\x00"
+    )
+
+
+def _crc32(data, size):
+    # The region past the variables is zero; checksum it without building a
+    # zero-filled copy of the whole environment.
+    crc = zlib.crc32(data)
+    remaining = size - len(data)
+    zeros = bytes(min(remaining, 64 * 1024))
+    while remaining > 0:
+        crc = zlib.crc32(zeros[:remaining], crc)
+        remaining -= len(zeros)
+    return crc
+
+
+def _validate_copy(blob, layout, index):
+    start, end = _env_region(layout, index)
+    offset = layout[index][0]
+    if end > len(blob):
+        return False
+    (stored_crc,) = struct.unpack_from("<I", blob, offset)
+    view = memoryview(blob)
+    try:
+        return zlib.crc32(view[start:end]) == stored_crc
+    finally:
+        view.release()
+
+
+def _active_copy(blob, layout):
+    """
+    Return the index of the copy U-Boot would load: the only valid one, or
+    the valid one with the newer flag. Raises UBootEnvError if none is valid.
+    """
+    valid = [
+        index
+        for index in range(len(layout))
+        if _validate_copy(blob, layout, index)
+    ]
+    if not valid:
+        raise UBootEnvError("Environment CRC mismatch")
+    if len(valid) == 1:
+        return valid[0]
+    flags = [blob[offset + UBOOT_ENV_CRC_SIZE] for offset, _size in layout]
+    return 1 if _newer_flag(flags[1], flags[0]) else 0
+
+
+def parse_uboot_env(blob, layout=None):
+    """
+    Parse a U-Boot environment blob (bytes or mmap) and return the variables
+    of its active copy in order. layout lists the (offset, size) of each
+    copy and defaults to a single copy spanning the blob. Raises
+    UBootEnvError if no copy has a matching CRC.
+    """
+    layout = layout or [(0, len(blob))]
+    start, end = _env_region(layout, _active_copy(blob, layout))
+    return _parse_vars(blob, start, end)
+
+
+def read_uboot_env(env_file_path, layout=None):
+    """
+    Read and validate a U-Boot environment file through a read-only mmap.
+    """
+    with open(env_file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            layout = _resolve_layout(env_file_path, layout, len(mapped))
+            return parse_uboot_env(mapped, layout)
+
+
+def get_uboot_env_var(env_file_path, name, default=None, layout=None):
+    return read_uboot_env(env_file_path, layout).get(name, default)
+
+
+def patch_uboot_env(env_file_path, updates, layout=None):
+    """
+    Set variables of an existing U-Boot environment file in place.
+
+    updates maps names to values; a value of None removes the variable.
+    The file is locked and validated, and the variable area and CRC are
+    rewritten through a shared mmap. Bytes past the old and new variable
+    areas are left untouched, so a sparse file stays sparse.
+
+    With a redundant layout the new variables go to the inactive copy, which
+    only becomes active when its flag is written last, so an interrupted
+    update leaves the previous environment in place. Returns the resulting
+    variables.
+    """
+    with open(env_file_path, "r+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        with mmap.mmap(f.fileno(), 0) as mapped:
+            layout = _resolve_layout(env_file_path, layout, len(mapped))
+            active = _active_copy(mapped, layout)
+            start, end = _env_region(layout, active)
+            env_vars = _parse_vars(mapped, start, end)
+
+            for name, value in updates.items():
+                if value is None:
+                    env_vars.pop(name, None)
+                else:
+                    env_vars[name] = value
+            data = _serialize_vars(env_vars)
+            if len(data) > end - start:
+                raise UBootEnvError(
+                    f"Environment data exceeds the {end - start} byte environment"
+                )
+
+            target = (active + 1) % len(layout)
+            offset = layout[target][0]
+            start, end = _env_region(layout, target)
+            # Clear what the target copy held before, or all of it when it
+            # has no terminator, so that the CRC only covers the new data.
+            old_end = mapped.find(b"\x00\x00", start, end)
+            old_end = end if old_end < 0 else old_end + 2
+            mapped[start : start + len(data)] = data
+            if old_end > start + len(data):
+                mapped[start + len(data) : old_end] = bytes(
+                    old_end - start - len(data)
+                )
+            struct.pack_into("<I", mapped, offset, _crc32(data, end - start))
+            if len(layout) > 1:
+                mapped.flush()
+                flag = (
+                    mapped[layout[active][0] + UBOOT_ENV_CRC_SIZE] + 1
+                ) & 0xFF
+                mapped[offset + UBOOT_ENV_CRC_SIZE] = flag
+            mapped.flush()
+    return env_vars
+
+
+def patch_uboot_env_files(
+    env_file_paths, updates, jobs=DEFAULT_JOBS, layout=None
+):
+    """
+    Apply the same updates to many environment files concurrently.
+
+    Returns a list of (path, error) pairs in input order, with error None for
+    files that were patched.
+    """
+
+    def patch(env_file_path):
+        try:
+            patch_uboot_env(env_file_path, updates, layout)
+            return env_file_path, None
+        except (OSError, ValueError) as e:
+            return env_file_path, str(e)
 
-    # Write the padded environment data to a file
-    with open(env_file_path, "wb") as f:
-        f.write(padded_env_data)
+    return run_parallel(patch, env_file_paths, jobs)
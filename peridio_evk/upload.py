@@ -0,0 +1,190 @@
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from peridio_evk.executor import DEFAULT_JOBS, run_parallel
+from peridio_evk.log import log_info
+from peridio_evk.utils import get_config_path, read_json_file
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+PART_ATTEMPTS = 3
+
+_totals_lock = threading.Lock()
+_totals = {"bytes": 0, "binaries": 0}
+
+
+class UploadError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+
+
+def get_uploads_path():
+    return os.path.join(get_config_path(), "evk-data", "uploads")
+
+
+def get_checkpoint_path(artifact_version_prn, target, sha256):
+    key = hashlib.sha256(
+        f"{artifact_version_prn}:{target}:{sha256}".encode("utf-8")
+    ).hexdigest()
+    return os.path.join(get_uploads_path(), f"{key}.json")
+
+
+def read_checkpoint(checkpoint_path):
+    return read_json_file(checkpoint_path)
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    tmp_path = f"{checkpoint_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def format_throughput(byte_count, seconds):
+    rate = byte_count / (1024 * 1024) / seconds if seconds > 0 else 0.0
+    return f"{byte_count / (1024 * 1024):.1f} MiB in {seconds:.2f}s ({rate:.1f} MiB/s)"
+
+
+def find_part_upload_url(api, binary_prn, index):
+    """
+    Return the presigned upload URL of a part that is already registered
+    with the binary, or None when the binary has no such part.
+    """
+    status, text = api.api("GET", f"/binaries/{binary_prn}/parts")
+    if status >= 300:
+        return None
+    for part in json.loads(text).get("binary_parts", []):
+        if part.get("index") == index:
+            return part.get("presigned_upload_url")
+    return None
+
+
+def register_part(api, binary_prn, index, data, size):
+    """
+    Register a part with its binary and return the presigned URL it is PUT
+    to.
+
+    A retry or a resumed upload registers a part again after an earlier
+    registration succeeded but its PUT did not. The server rejects the
+    duplicate, and the URL is then taken from the binary's existing part.
+    """
+    status, text = api.api(
+        "POST",
+        f"/binaries/{binary_prn}/parts",
+        {
+            "index": index,
+            "hash": hashlib.sha256(data).hexdigest(),
+            "size": len(data),
+            "expected_binary_size": size,
+        },
+    )
+    if 400 <= status < 500:
+        upload_url = find_part_upload_url(api, binary_prn, index)
+        if upload_url:
+            return upload_url
+    if status >= 300:
+        raise UploadError(status, text)
+    return json.loads(text)["binary_part"]["presigned_upload_url"]
+
+
+def upload_binary_parts(
+    api,
+    binary_prn,
+    content_path,
+    checkpoint_path,
+    checkpoint,
+    jobs=DEFAULT_JOBS,
+    slots=None,
+):
+    """
+    Upload a binary's content as concurrent parts.
+
+    Each part is registered with the binary, which returns a presigned URL the
+    part is PUT to. Completed part indexes are recorded in the checkpoint file
+    as they finish, so an interrupted upload resumes with only the missing
+    parts. Throughput is logged for the binary and added to the totals
+    reported by log_upload_summary.
+
+    Binaries are themselves uploaded concurrently, so slots is a semaphore
+    shared by all of them that bounds the parts in flight across binaries.
+    It defaults to one that bounds this binary's parts to jobs.
+    """
+    slots = slots or threading.BoundedSemaphore(jobs)
+    size = os.path.getsize(content_path)
+    part_size = checkpoint["part_size"]
+    part_count = max((size + part_size - 1) // part_size, 1)
+    completed = set(checkpoint.get("completed", []))
+    pending = [
+        index for index in range(1, part_count + 1) if index not in completed
+    ]
+    if completed:
+        log_info(
+            f"Resuming upload: {len(completed)}/{part_count} parts already uploaded"
+        )
+    checkpoint_lock = threading.Lock()
+
+    def upload_part(index):
+        offset = (index - 1) * part_size
+        with open(content_path, "rb") as f:
+            f.seek(offset)
+            data = f.read(part_size)
+
+        for attempt in range(1, PART_ATTEMPTS + 1):
+            try:
+                with slots:
+                    upload_url = register_part(
+                        api, binary_prn, index, data, size
+                    )
+                    status, body = api.request(
+                        "PUT",
+                        upload_url,
+                        data,
+                        {"Content-Length": str(len(data))},
+                    )
+                if status >= 300:
+                    raise UploadError(status, body.decode("utf-8"))
+                break
+            except (UploadError, OSError, http.client.HTTPException) as e:
+                if attempt == PART_ATTEMPTS or (
+                    isinstance(e, UploadError) and 400 <= e.status < 500
+                ):
+                    raise
+                time.sleep(2 ** (attempt - 1))
+
+        with checkpoint_lock:
+            completed.add(index)
+            checkpoint["completed"] = sorted(completed)
+            write_checkpoint(checkpoint_path, checkpoint)
+        return len(data)
+
+    start = time.monotonic()
+    uploaded = sum(run_parallel(upload_part, pending, jobs))
+    seconds = time.monotonic() - start
+
+    log_info(f"Uploaded {binary_prn}: {format_throughput(uploaded, seconds)}")
+    with _totals_lock:
+        _totals["bytes"] += uploaded
+        _totals["binaries"] += 1
+    return uploaded, seconds
+
+
+def log_upload_summary(start_time):
+    """
+    Log aggregate upload throughput since the last summary. start_time is a
+    time.monotonic() value taken before the uploads began, so concurrent
+    uploads are measured by wall-clock time.
+    """
+    with _totals_lock:
+        totals = dict(_totals)
+        _totals.update({"bytes": 0, "binaries": 0})
+    if totals["binaries"] == 0:
+        return
+    log_info(
+        f'Uploaded {totals["binaries"]} binaries: '
+        f'{format_throughput(totals["bytes"], time.monotonic() - start_time)}'
+    )
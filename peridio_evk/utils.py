@@ -1,4 +1,6 @@
 import click
+import contextlib
+import hashlib
 import os
 import json
 import platform
@@ -12,11 +14,20 @@ from datetime import datetime
 from peridio_evk.log import (
     log_cli_command,
     log_cli_response,
+    log_cli_stderr,
     log_modify_file,
     log_error,
     log_info,
 )
 
+# Serializes read-modify-write cycles on the shared CLI config.json when
+# cohorts are provisioned concurrently.
+config_file_lock = threading.Lock()
+
+# When set, peridio_cli calls are served in-process by this client (see
+# peridio_evk.api.PeridioAPI) instead of spawning the peridio executable.
+_api_backend = None
+
 
 class SubprocessResult:
     def __init__(self, stdout, stderr, returncode):
@@ -37,9 +48,13 @@ def read_json_file(file_path):
 
 
 def write_json_file(file_path, content):
-    with open(file_path, "w") as f:
+    # Write to a sibling file and rename it into place so that a concurrently
+    # running peridio CLI never observes a partially written config.
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
         json.dump(content, f, indent=4)
-        log_modify_file(file_path)
+    os.replace(tmp_path, file_path)
+    log_modify_file(file_path)
 
 
 def get_config_path():
@@ -84,7 +99,24 @@ def read_evk_config():
     return read_json_file(evk_config_path)
 
 
+def read_key_algorithm(level):
+    """
+    Return the configured key algorithm for a level of the certificate
+    hierarchy: 'root', 'intermediate' or 'device'.
+    """
+    key_algorithms = read_evk_config().get("key_algorithms", {})
+    return key_algorithms.get(level, "p256")
+
+
+def set_api_backend(client):
+    global _api_backend
+    _api_backend = client
+
+
 def peridio_cli(command):
+    if _api_backend is not None:
+        return _api_backend.cli(command)
+
     if shutil.which("peridio") is None:
         log_error('"peridio" CLI executable not found in the system PATH.')
         raise click.ClickException(
@@ -115,6 +147,18 @@ def peridio_cli(command):
         stdout_thread.start()
         stderr_thread.start()
 
+        # Log stderr lines as they arrive while the process runs. They are
+        # logged from this thread, so inside run_parallel they are still
+        # buffered with the rest of the item's output.
+        stderr_output = ""
+        while stderr_thread.is_alive() or not stderr_queue.empty():
+            try:
+                line = stderr_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            log_cli_stderr(line)
+            stderr_output += line
+
         # Wait for the process to finish
         process.wait()
 
@@ -127,11 +171,6 @@ def peridio_cli(command):
         while not stdout_queue.empty():
             stdout_output += stdout_queue.get()
 
-        # Collect stderr output from the queue
-        stderr_output = ""
-        while not stderr_queue.empty():
-            stderr_output += stderr_queue.get()
-
         return_code = process.returncode
         pretty_print_result = str(stdout_output)
 
@@ -149,13 +188,112 @@ def peridio_cli(command):
         return SubprocessResult(None, None, None)
 
 
-def generate_random_bytes_file(file_path, length):
-    # Generate random bytes
-    random_bytes = os.urandom(length)
+GENERATE_BLOCK_SIZE = 4096
+GENERATE_CHUNK_SIZE = 1024 * 1024
+# Fraction of blocks a new synthetic artifact version rewrites in the
+# version it replaces.
+DEFAULT_ARTIFACT_CHANGE_FRACTION = 0.1
+
+
+def generate_random_bytes_file(
+    file_path,
+    length,
+    seed=None,
+    compressibility=0.0,
+    chunk_size=GENERATE_CHUNK_SIZE,
+    base_path=None,
+    change_fraction=1.0,
+):
+    """
+    Stream synthetic binary content to a file in fixed-size chunks.
+
+    Content is produced in GENERATE_BLOCK_SIZE blocks. Without a seed the
+    blocks come from os.urandom. With a seed, block i is derived from
+    SHAKE-256(seed, i), so the same seed and length give byte-identical files
+    on any machine regardless of chunk_size.
+
+    compressibility is the fraction (0.0 - 1.0) of blocks that are filled with
+    a short repeating pattern instead of random bytes, approximating the mix
+    of code and padding found in real firmware images.
+
+    With base_path the file is a new version of that file: each of its
+    blocks is kept as is, except for about change_fraction of them (chosen
+    from the seed when there is one) and any blocks past its end, which are
+    generated. Consecutive versions then share most of their content, the
+    way firmware updates do.
+
+    The file is written under a temporary name and renamed into place once
+    complete, so an interrupted run never leaves a truncated binary behind.
+    """
+    if seed is not None:
+        seed_bytes = str(seed).encode("utf-8")
+
+        def block(index):
+            return hashlib.shake_256(
+                seed_bytes + index.to_bytes(8, "big")
+            ).digest(GENERATE_BLOCK_SIZE + 2)
+
+    else:
+
+        def block(index):
+            return os.urandom(GENERATE_BLOCK_SIZE + 2)
+
+    if seed is not None:
+
+        def changed(index):
+            return hashlib.shake_256(
+                seed_bytes + b"change" + index.to_bytes(8, "big")
+            ).digest(2)
+
+    else:
 
-    # Write the bytes to a file
-    with open(file_path, "wb") as file:
-        file.write(random_bytes)
+        def changed(index):
+            return os.urandom(2)
+
+    threshold = int(compressibility * 65536)
+    change_threshold = int(change_fraction * 65536)
+    blocks_per_chunk = max(chunk_size // GENERATE_BLOCK_SIZE, 1)
+    block_count = (length + GENERATE_BLOCK_SIZE - 1) // GENERATE_BLOCK_SIZE
+
+    tmp_path = f"{file_path}.part"
+    try:
+        with contextlib.ExitStack() as stack:
+            base = (
+                stack.enter_context(open(base_path, "rb"))
+                if base_path is not None
+                else None
+            )
+            file = stack.enter_context(open(tmp_path, "wb"))
+            remaining = length
+            for first in range(0, block_count, blocks_per_chunk):
+                chunk = bytearray()
+                last = min(first + blocks_per_chunk, block_count)
+                for index in range(first, last):
+                    if base is not None:
+                        change = int.from_bytes(changed(index), "big")
+                        if change >= change_threshold:
+                            base.seek(index * GENERATE_BLOCK_SIZE)
+                            kept = base.read(GENERATE_BLOCK_SIZE)
+                            if len(kept) == GENERATE_BLOCK_SIZE:
+                                chunk += kept
+                                continue
+                    data = block(index)
+                    # The first two bytes select the block type, the rest is
+                    # the block content.
+                    if int.from_bytes(data[:2], "big") < threshold:
+                        pattern = data[2:18]
+                        repeat = GENERATE_BLOCK_SIZE // len(pattern)
+                        chunk += pattern * repeat
+                    else:
+                        chunk += data[2:]
+                file.write(chunk[:remaining])
+                remaining -= min(len(chunk), remaining)
+    except BaseException:
+        # Leave no partial file behind, whatever interrupted generation.
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, file_path)
 
 
 def stream_stdout(pipe, output_queue):
@@ -168,7 +306,6 @@ def stream_stdout(pipe, output_queue):
 def stream_stderr(pipe, output_queue):
     for line in iter(pipe.readline, ""):
         if line:
-            click.secho(f"     CLI: {line.strip()}", fg="bright_black")
             output_queue.put(line)
     pipe.close()
 
@@ -194,6 +331,42 @@ def boolean_to_string_lower(value):
         raise ValueError("Input is not a boolean value.")
 
 
+def link_file(source_path, target_path):
+    """
+    Make target_path a hardlink of source_path, replacing whatever was there
+    atomically. Falls back to a copy on filesystems without hardlinks.
+
+    Returns False if target_path already was a link to source_path.
+    """
+    if os.path.exists(target_path) and os.path.samefile(
+        source_path, target_path
+    ):
+        return False
+    tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copy2(source_path, tmp_path)
+    os.replace(tmp_path, target_path)
+    return True
+
+
+def write_file_atomic(file_path, content, executable=False):
+    """
+    Replace a file with content (str or bytes) in one rename, so readers
+    and hardlinks of the previous file never see a partial write.
+    """
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb" if isinstance(content, bytes) else "w") as f:
+        f.write(content)
+    if executable:
+        st = os.stat(tmp_path)
+        os.chmod(
+            tmp_path, st.st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        )
+    os.replace(tmp_path, file_path)
+
+
 def write_file_x(file_path, content):
     with open(file_path, "w") as file:
         file.write(content)
@@ -207,11 +380,15 @@ def filter_dicts(dict_list, key, value):
     ]
 
 
-def get_docker_client():
+def get_docker_client(max_pool_size=None):
     try:
         import docker
 
-        client = docker.from_env()
+        # Each concurrent Docker API call needs its own pooled connection.
+        if max_pool_size:
+            client = docker.from_env(max_pool_size=max_pool_size)
+        else:
+            client = docker.from_env()
         # Test the connection to Docker service
         client.ping()
         log_info("Using Docker client")
@@ -220,7 +397,7 @@ def get_docker_client():
         return None
 
 
-def get_container_client():
+def get_container_client(max_pool_size=None):
     # Check if Docker is installed
     try:
         subprocess.run(
@@ -229,7 +406,7 @@ def get_container_client():
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
-        client = get_docker_client()
+        client = get_docker_client(max_pool_size)
         if client:
             return client
     except (subprocess.CalledProcessError, FileNotFoundError):
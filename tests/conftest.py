@@ -0,0 +1,143 @@
+import collections
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from peridio_evk.api import PeridioAPI
+
+Request = collections.namedtuple(
+    "Request", ["method", "path", "query", "body", "client"]
+)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        parsed = urllib.parse.urlsplit(self.path)
+        request = Request(
+            self.command,
+            urllib.parse.unquote(parsed.path),
+            dict(urllib.parse.parse_qsl(parsed.query)),
+            body,
+            self.client_address,
+        )
+        response = self.server.dispatch(request)
+        if response is None:
+            # Drop the connection without answering.
+            self.close_connection = True
+            return
+        status, payload, *keep_alive = response
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if keep_alive and not keep_alive[0]:
+            # Close after answering without announcing it, the way a server
+            # times out an idle keep-alive connection.
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+class StandIn(ThreadingHTTPServer):
+    """
+    A Peridio Cloud stand-in on 127.0.0.1 that records every request.
+
+    Tests register handlers with route(); a handler is called with the
+    Request and returns (status, payload), (status, payload, keep_alive) or
+    None to drop the connection. Unrouted requests are answered with 200 and
+    an empty object.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.requests = []
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def route(self, method, path, handler):
+        """
+        Answer method requests for path with handler. A path ending in '/'
+        matches every path below it.
+        """
+        self.routes[(method, path)] = handler
+
+    def dispatch(self, request):
+        with self.lock:
+            self.requests.append(request)
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            prefixes = [
+                path
+                for method, path in self.routes
+                if method == request.method
+                and path.endswith("/")
+                and request.path.startswith(path)
+            ]
+            if prefixes:
+                handler = self.routes[(request.method, max(prefixes, key=len))]
+        if handler is None:
+            return 200, {}
+        return handler(request)
+
+    def requests_for(self, method, path=None):
+        return [
+            r
+            for r in self.requests
+            if r.method == method and (path is None or r.path == path)
+        ]
+
+
+@pytest.fixture
+def standin():
+    server = StandIn()
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PERIDIO_CONFIG_DIRECTORY", str(tmp_path / "config"))
+    return tmp_path / "config"
+
+
+@pytest.fixture
+def api(standin, config_dir, monkeypatch):
+    """
+    A client for a profile written the way do_initialize writes it, with
+    PERIDIO_BASE_URL pointing it at the stand-in.
+    """
+    config_dir.mkdir(parents=True, exist_ok=True)
+    (config_dir / "config.json").write_text(
+        json.dumps({"profiles": {"test": {"organization_name": "test"}}})
+    )
+    (config_dir / "credentials.json").write_text(
+        json.dumps({"test": {"api_key": "test-key"}})
+    )
+    monkeypatch.setenv("PERIDIO_BASE_URL", standin.url)
+    client = PeridioAPI.from_profile("test")
+    yield client
+    client.close()
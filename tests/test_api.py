@@ -0,0 +1,453 @@
+import base64
+import http.client
+import json
+
+import pytest
+
+from peridio_evk.api import ROUTES
+
+# (argv after 'peridio --profile test', method, path, query, payload). A
+# payload of None means the request has no body.
+ROUTE_CASES = [
+    (["users", "me"], "GET", "/users/me", {}, None),
+    (
+        ["products-v2", "create", "--organization-prn", "o", "--name", "p"],
+        "POST",
+        "/products",
+        {},
+        {"organization_prn": "o", "name": "p"},
+    ),
+    (
+        ["products-v2", "list", "--search", "name:'p'"],
+        "GET",
+        "/products",
+        {"search": "name:'p'"},
+        None,
+    ),
+    (
+        [
+            "cohorts",
+            "create",
+            "--organization-prn",
+            "o",
+            "--product-prn",
+            "prn:product",
+            "--name",
+            "c",
+            "--description",
+            "d",
+        ],
+        "POST",
+        "/cohorts",
+        {},
+        {
+            "organization_prn": "o",
+            "product_prn": "prn:product",
+            "name": "c",
+            "description": "d",
+        },
+    ),
+    (
+        ["cohorts", "list", "--search", "s", "--limit", "10"],
+        "GET",
+        "/cohorts",
+        {"search": "s", "limit": "10"},
+        None,
+    ),
+    (
+        [
+            "artifacts",
+            "create",
+            "--organization-prn",
+            "o",
+            "--name",
+            "a",
+            "--description",
+            "d",
+            "--custom-metadata",
+            '{"peridiod": {"installer": "file"}}',
+        ],
+        "POST",
+        "/artifacts",
+        {},
+        {
+            "organization_prn": "o",
+            "name": "a",
+            "description": "d",
+            "custom_metadata": {"peridiod": {"installer": "file"}},
+        },
+    ),
+    (
+        ["artifacts", "list", "--search", "s"],
+        "GET",
+        "/artifacts",
+        {"search": "s"},
+        None,
+    ),
+    (
+        [
+            "artifact-versions",
+            "create",
+            "--artifact-prn",
+            "prn:artifact",
+            "--version",
+            "v1",
+            "--description",
+            "v1",
+        ],
+        "POST",
+        "/artifact_versions",
+        {},
+        {"artifact_prn": "prn:artifact", "version": "v1", "description": "v1"},
+    ),
+    (
+        ["artifact-versions", "list", "--search", "s"],
+        "GET",
+        "/artifact_versions",
+        {"search": "s"},
+        None,
+    ),
+    (
+        ["binaries", "list", "--search", "s"],
+        "GET",
+        "/binaries",
+        {"search": "s"},
+        None,
+    ),
+    (
+        [
+            "bundles",
+            "create",
+            "--organization-prn",
+            "o",
+            "--name",
+            "b",
+            "--artifact-version-prns",
+            "prn:v1 prn:v2",
+        ],
+        "POST",
+        "/bundles",
+        {},
+        {
+            "organization_prn": "o",
+            "name": "b",
+            "artifact_version_prns": ["prn:v1", "prn:v2"],
+        },
+    ),
+    (
+        ["bundles", "list", "--search", "s"],
+        "GET",
+        "/bundles",
+        {"search": "s"},
+        None,
+    ),
+    (
+        [
+            "releases",
+            "create",
+            "--organization-prn",
+            "o",
+            "--bundle-prn",
+            "prn:bundle",
+            "--cohort-prn",
+            "prn:cohort",
+            "--name",
+            "r",
+            "--version",
+            "2.0.0",
+            "--version-requirement",
+            "~> 1.1",
+            "--disabled",
+            "true",
+            "--phase-value",
+            "0.5",
+            "--phase-tags",
+            "canary beta",
+        ],
+        "POST",
+        "/releases",
+        {},
+        {
+            "organization_prn": "o",
+            "bundle_prn": "prn:bundle",
+            "cohort_prn": "prn:cohort",
+            "name": "r",
+            "version": "2.0.0",
+            "version_requirement": "~> 1.1",
+            "disabled": True,
+            "phase_value": 0.5,
+            "phase_tags": ["canary", "beta"],
+        },
+    ),
+    (
+        ["releases", "list", "--search", "s"],
+        "GET",
+        "/releases",
+        {"search": "s"},
+        None,
+    ),
+    (
+        [
+            "devices",
+            "create",
+            "--product-name",
+            "edge inference",
+            "--identifier",
+            "EI-ML-0001",
+            "--cohort-prn",
+            "prn:cohort",
+            "--target",
+            "arm64-v8",
+            "--tags",
+            "canary beta",
+        ],
+        "POST",
+        "/products/edge inference/devices",
+        {},
+        {
+            "identifier": "EI-ML-0001",
+            "cohort_prn": "prn:cohort",
+            "target": "arm64-v8",
+            "tags": ["canary", "beta"],
+        },
+    ),
+    (
+        [
+            "device-certificates",
+            "create",
+            "--product-name",
+            "p",
+            "--device-identifier",
+            "EI-ML-0001",
+            "--certificate-path",
+            "{pem}",
+        ],
+        "POST",
+        "/products/p/devices/EI-ML-0001/certificates",
+        {},
+        {"cert": "{pem_base64}"},
+    ),
+    (
+        [
+            "signing-keys",
+            "create",
+            "--organization-prn",
+            "o",
+            "--value",
+            "key",
+            "--name",
+            "k",
+        ],
+        "POST",
+        "/signing_keys",
+        {},
+        {"organization_prn": "o", "value": "key", "name": "k"},
+    ),
+    (
+        ["signing-keys", "list", "--search", "s"],
+        "GET",
+        "/signing_keys",
+        {"search": "s"},
+        None,
+    ),
+    (
+        ["ca-certificates", "get", "--ca-certificate-serial", "0A1B"],
+        "GET",
+        "/ca_certificates/0A1B",
+        {},
+        None,
+    ),
+    (
+        ["ca-certificates", "create-verification-code"],
+        "POST",
+        "/ca_certificates/verification_codes",
+        {},
+        None,
+    ),
+    (
+        [
+            "ca-certificates",
+            "create",
+            "--certificate-path",
+            "{pem}",
+            "--verification-certificate-path",
+            "{pem}",
+            "--description",
+            "Intermediate CA",
+            "--jitp-cohort-prn",
+            "prn:cohort",
+            "--jitp-product-name",
+            "p",
+            "--jitp-tags",
+            "JITP",
+            "--jitp-description",
+            "JITP",
+            "--jitp-target",
+            "arm64-v8",
+        ],
+        "POST",
+        "/ca_certificates",
+        {},
+        {
+            "certificate": "{pem_base64}",
+            "verification_certificate": "{pem_base64}",
+            "description": "Intermediate CA",
+            "jitp": {
+                "cohort_prn": "prn:cohort",
+                "product_name": "p",
+                "tags": ["JITP"],
+                "description": "JITP",
+                "target": "arm64-v8",
+            },
+        },
+    ),
+]
+
+
+def peridio(*args):
+    return ["peridio", "--profile", "test", *args]
+
+
+def substitute(value, replacements):
+    if isinstance(value, str):
+        return replacements.get(value, value)
+    if isinstance(value, list):
+        return [substitute(item, replacements) for item in value]
+    if isinstance(value, dict):
+        return {k: substitute(v, replacements) for k, v in value.items()}
+    return value
+
+
+def test_route_cases_cover_every_route():
+    covered = {tuple(argv[:2]) for argv, *_ in ROUTE_CASES}
+    # binaries create runs a multi-request upload, see test_upload.py.
+    assert covered | {("binaries", "create")} == set(ROUTES)
+
+
+@pytest.mark.parametrize(
+    "argv, method, path, query, payload",
+    ROUTE_CASES,
+    ids=[" ".join(case[0][:2]) for case in ROUTE_CASES],
+)
+def test_cli_arguments_map_to_api_requests(
+    api, standin, tmp_path, argv, method, path, query, payload
+):
+    pem = tmp_path / "certificate.pem"
+    pem.write_bytes(b"-----BEGIN CERTIFICATE-----\n")
+    replacements = {
+        "{pem}": str(pem),
+        "{pem_base64}": base64.b64encode(pem.read_bytes()).decode("utf-8"),
+    }
+
+    result = api.cli(peridio(*substitute(argv, replacements)))
+
+    assert result.returncode == 0
+    [request] = standin.requests
+    assert (request.method, request.path, request.query) == (
+        method,
+        path,
+        query,
+    )
+    if payload is None:
+        assert request.body == b""
+    else:
+        assert json.loads(request.body) == substitute(payload, replacements)
+
+
+def test_requests_share_one_keep_alive_connection(api, standin):
+    for _ in range(5):
+        assert api.cli(peridio("users", "me")).returncode == 0
+
+    assert len(standin.requests) == 5
+    assert len({request.client for request in standin.requests}) == 1
+
+
+def drop_once_reused(standin, method, path, payload):
+    """
+    Answer method requests for path, except that the first one arriving on
+    a reused connection is read and then dropped without an answer, as
+    when a server closes an idle keep-alive connection mid-request.
+    """
+    dropped = []
+
+    def handler(request):
+        reused = any(
+            earlier.client == request.client
+            for earlier in standin.requests[:-1]
+        )
+        if reused and not dropped:
+            dropped.append(request)
+            return None
+        return 201 if method == "POST" else 200, payload
+
+    standin.route(method, path, handler)
+
+
+def test_idempotent_request_is_retried_after_connection_drops(api, standin):
+    drop_once_reused(standin, "GET", "/users/me", {"user": {}})
+
+    first = api.cli(peridio("users", "me"))
+    second = api.cli(peridio("users", "me"))
+
+    assert first.returncode == 0
+    assert second.returncode == 0
+    assert len(standin.requests_for("GET", "/users/me")) == 3
+
+
+def test_sent_post_is_not_retried_after_connection_drops(api, standin):
+    standin.route("GET", "/users/me", lambda r: (200, {"user": {}}))
+    drop_once_reused(standin, "POST", "/products", {"product": {}})
+    api.cli(peridio("users", "me"))
+
+    with pytest.raises(
+        (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+    ):
+        api.api("POST", "/products", {"organization_prn": "o", "name": "p"})
+
+    assert len(standin.requests_for("POST", "/products")) == 1
+
+
+def test_sent_post_failure_is_reported_as_cli_failure(api, standin):
+    standin.route("GET", "/users/me", lambda r: (200, {"user": {}}))
+    drop_once_reused(standin, "POST", "/products", {"product": {}})
+    api.cli(peridio("users", "me"))
+
+    result = api.cli(peridio("products-v2", "create", "--name", "p"))
+
+    assert result.returncode == 1
+    assert result.stdout == ""
+    assert result.stderr != ""
+    assert len(standin.requests_for("POST", "/products")) == 1
+
+
+def test_success_is_returned_on_stdout(api, standin):
+    standin.route(
+        "POST", "/products", lambda r: (201, {"product": {"prn": "prn:p"}})
+    )
+
+    result = api.cli(
+        peridio("products-v2", "create", "--organization-prn", "o")
+    )
+
+    assert result.returncode == 0
+    assert result.stderr == ""
+    assert json.loads(result.stdout)["product"]["prn"] == "prn:p"
+
+
+def test_error_status_is_returned_on_stderr(api, standin):
+    error = {"errors": {"name": ["has already been taken"]}}
+    standin.route("POST", "/products", lambda r: (422, error))
+
+    result = api.cli(peridio("products-v2", "create", "--name", "p"))
+
+    assert result.returncode == 1
+    assert result.stdout == ""
+    assert json.loads(result.stderr) == error
+
+
+def test_unsupported_command_fails_without_a_request(api, standin):
+    result = api.cli(peridio("webhooks", "create"))
+
+    assert result.returncode == 1
+    assert "Unsupported API operation" in result.stderr
+    assert standin.requests == []
@@ -0,0 +1,40 @@
+import os
+
+from peridio_evk.binary_store import (
+    get_binary_store_path,
+    hash_file,
+    store_binary,
+)
+
+
+def write(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_identical_content_is_stored_once(config_dir, tmp_path):
+    first = write(tmp_path / "first", b"x" * 100)
+    second = write(tmp_path / "second", b"x" * 100)
+
+    digest = store_binary(first)
+
+    assert store_binary(second) == digest
+    assert os.path.samefile(first, second)
+    assert os.path.samefile(
+        first, os.path.join(get_binary_store_path(), digest)
+    )
+
+
+def test_store_entry_changed_in_place_is_not_linked(config_dir, tmp_path):
+    first = write(tmp_path / "first", b"x" * 100)
+    digest = store_binary(first)
+    with open(first, "r+b") as f:
+        f.write(b"changed")
+
+    second = write(tmp_path / "second", b"x" * 100)
+    assert store_binary(second) == digest
+
+    blob_path = os.path.join(get_binary_store_path(), digest)
+    assert hash_file(blob_path) == digest
+    assert open(second, "rb").read() == b"x" * 100
+    assert os.path.samefile(second, blob_path)
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from peridio_evk import delta
+from peridio_evk.delta import apply_delta, create_delta
+
+
+@pytest.fixture
+def versions(tmp_path):
+    old = os.urandom(64 * 4096)
+    new = old[: 20 * 4096] + os.urandom(8 * 4096) + old[30 * 4096 :] + b"tail"
+    old_path = tmp_path / "old"
+    new_path = tmp_path / "new"
+    old_path.write_bytes(old)
+    new_path.write_bytes(new)
+    return old_path, new_path
+
+
+def test_delta_rebuilds_the_new_file(versions, tmp_path):
+    old_path, new_path = versions
+    delta_path = tmp_path / "delta"
+    out_path = tmp_path / "out"
+
+    result = create_delta(old_path, new_path, delta_path)
+    apply_delta(old_path, delta_path, out_path)
+
+    assert out_path.read_bytes() == new_path.read_bytes()
+    assert result["ratio"] < 0.2
+
+
+def test_delta_is_applied_in_chunks(versions, tmp_path, monkeypatch):
+    monkeypatch.setattr(delta, "DELTA_READ_SIZE", 7)
+    old_path, new_path = versions
+    delta_path = tmp_path / "delta"
+    out_path = tmp_path / "out"
+
+    create_delta(old_path, new_path, delta_path)
+    apply_delta(old_path, delta_path, out_path)
+
+    assert out_path.read_bytes() == new_path.read_bytes()
+
+
+def test_truncated_delta_is_rejected(versions, tmp_path):
+    old_path, new_path = versions
+    delta_path = tmp_path / "delta"
+    create_delta(old_path, new_path, delta_path)
+    delta_path.write_bytes(delta_path.read_bytes()[:-100])
+
+    with pytest.raises(ValueError):
+        apply_delta(old_path, delta_path, tmp_path / "out")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["delta", "new", "old"]
+
+
+def test_delta_requires_its_source(versions, tmp_path):
+    old_path, new_path = versions
+    delta_path = tmp_path / "delta"
+    create_delta(old_path, new_path, delta_path)
+
+    with pytest.raises(ValueError, match="does not match"):
+        apply_delta(new_path, delta_path, tmp_path / "out")
@@ -0,0 +1,58 @@
+import hashlib
+
+import pytest
+
+from peridio_evk import utils
+from peridio_evk.utils import GENERATE_BLOCK_SIZE, generate_random_bytes_file
+
+
+def test_seeded_content_is_reproducible(tmp_path):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+
+    generate_random_bytes_file(first, 100000, "seed", chunk_size=8192)
+    generate_random_bytes_file(second, 100000, "seed", chunk_size=65536)
+
+    assert first.read_bytes() == second.read_bytes()
+    assert first.stat().st_size == 100000
+
+
+def test_new_version_keeps_most_of_its_base(tmp_path):
+    base = tmp_path / "base"
+    version = tmp_path / "version"
+    generate_random_bytes_file(base, 100 * GENERATE_BLOCK_SIZE, "v1")
+
+    generate_random_bytes_file(
+        version,
+        100 * GENERATE_BLOCK_SIZE,
+        "v2",
+        base_path=base,
+        change_fraction=0.1,
+    )
+
+    old, new = base.read_bytes(), version.read_bytes()
+    kept = sum(
+        old[i : i + GENERATE_BLOCK_SIZE] == new[i : i + GENERATE_BLOCK_SIZE]
+        for i in range(0, len(old), GENERATE_BLOCK_SIZE)
+    )
+    assert 75 <= kept < 100
+
+
+def test_failure_leaves_no_partial_file(tmp_path, monkeypatch):
+    path = tmp_path / "binary"
+    shake_256 = hashlib.shake_256
+    calls = []
+
+    def failing_shake_256(data):
+        calls.append(data)
+        if len(calls) > 10:
+            raise RuntimeError("interrupted")
+        return shake_256(data)
+
+    monkeypatch.setattr(utils.hashlib, "shake_256", failing_shake_256)
+
+    with pytest.raises(RuntimeError):
+        generate_random_bytes_file(path, 100000, "seed", chunk_size=8192)
+
+    assert len(calls) > 2  # some chunks were written before the failure
+    assert list(tmp_path.iterdir()) == []
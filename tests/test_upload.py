@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+
+import pytest
+
+from peridio_evk.upload import (
+    UploadError,
+    get_checkpoint_path,
+    upload_binary_parts,
+    write_checkpoint,
+)
+
+BINARY_PRN = "prn:1:binary"
+PART_SIZE = 1024
+
+
+class BinaryEndpoints:
+    """
+    The binary routes of the stand-in: parts are registered once per index,
+    and a second registration of an index is rejected like Peridio Cloud
+    does.
+    """
+
+    def __init__(self, standin):
+        self.standin = standin
+        self.parts = {}
+        self.uploads = {}
+        self.put_failures = {}
+        self.active_puts = 0
+        self.max_active_puts = 0
+        self.lock = threading.Lock()
+        standin.route("POST", "/binaries", self.create_binary)
+        standin.route("POST", f"/binaries/{BINARY_PRN}/parts", self.add_part)
+        standin.route("GET", f"/binaries/{BINARY_PRN}/parts", self.list_parts)
+        standin.route("PUT", "/upload/", self.put_part)
+        standin.route("PATCH", f"/binaries/{BINARY_PRN}", self.patch_binary)
+
+    def create_binary(self, request):
+        return 201, {"binary": {"prn": BINARY_PRN}}
+
+    def add_part(self, request):
+        index = json.loads(request.body)["index"]
+        with self.lock:
+            if index in self.parts:
+                return 409, {"errors": {"index": ["has already been taken"]}}
+            self.parts[index] = {
+                "index": index,
+                "presigned_upload_url": f"{self.standin.url}/upload/{index}",
+            }
+            return 201, {"binary_part": self.parts[index]}
+
+    def list_parts(self, request):
+        with self.lock:
+            return 200, {"binary_parts": list(self.parts.values())}
+
+    def put_part(self, request):
+        index = int(request.path.rsplit("/", 1)[1])
+        with self.lock:
+            self.active_puts += 1
+            self.max_active_puts = max(self.max_active_puts, self.active_puts)
+        time.sleep(0.02)
+        with self.lock:
+            self.active_puts -= 1
+            failures = self.put_failures.get(index, [])
+            if failures:
+                return failures.pop(0), {"error": "unavailable"}
+            self.uploads[index] = request.body
+        return 200, {}
+
+    def patch_binary(self, request):
+        state = json.loads(request.body)["state"]
+        return 200, {"binary": {"prn": BINARY_PRN, "state": state}}
+
+    def content(self):
+        return b"".join(self.uploads[i] for i in sorted(self.uploads))
+
+
+@pytest.fixture
+def binaries(standin):
+    return BinaryEndpoints(standin)
+
+
+@pytest.fixture
+def content_path(tmp_path):
+    path = tmp_path / "binary"
+    # Four parts, the last one short.
+    path.write_bytes(bytes(range(256)) * 12 + b"tail")
+    return path
+
+
+def upload(api, content_path, checkpoint, jobs=4, slots=None):
+    checkpoint_path = get_checkpoint_path("prn:1:version", "x86_64", "hash")
+    write_checkpoint(checkpoint_path, checkpoint)
+    upload_binary_parts(
+        api,
+        BINARY_PRN,
+        str(content_path),
+        checkpoint_path,
+        checkpoint,
+        jobs,
+        slots,
+    )
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def new_checkpoint(completed=()):
+    return {
+        "binary_prn": BINARY_PRN,
+        "part_size": PART_SIZE,
+        "completed": list(completed),
+    }
+
+
+def test_binaries_create_uploads_signs_and_removes_checkpoint(
+    api, standin, binaries, content_path, config_dir
+):
+    api.part_size = PART_SIZE
+    result = api.cli(
+        [
+            "peridio",
+            "--profile",
+            "test",
+            "binaries",
+            "create",
+            "--artifact-version-prn",
+            "prn:1:version",
+            "--target",
+            "x86_64",
+            "--content-path",
+            str(content_path),
+            "--custom-metadata",
+            '{"peridio_evk": {"delta": {"target": "x86_64"}}}',
+        ]
+    )
+
+    assert result.returncode == 0
+    [create] = standin.requests_for("POST", "/binaries")
+    assert json.loads(create.body)["custom_metadata"] == {
+        "peridio_evk": {"delta": {"target": "x86_64"}}
+    }
+    assert json.loads(result.stdout)["binary"]["state"] == "signed"
+    assert binaries.content() == content_path.read_bytes()
+    states = [
+        json.loads(r.body)["state"]
+        for r in standin.requests_for("PATCH", f"/binaries/{BINARY_PRN}")
+    ]
+    assert states == ["hashable", "signed"]
+    assert not list((config_dir / "evk-data" / "uploads").glob("*.json"))
+
+
+def test_resume_uploads_only_missing_parts(
+    api, standin, binaries, content_path
+):
+    checkpoint = upload(api, content_path, new_checkpoint(completed=[1, 3]))
+
+    registered = [
+        json.loads(r.body)["index"]
+        for r in standin.requests_for("POST", f"/binaries/{BINARY_PRN}/parts")
+    ]
+    assert sorted(registered) == [2, 4]
+    assert checkpoint["completed"] == [1, 2, 3, 4]
+
+
+def test_failed_put_is_retried_with_the_registered_part(
+    api, standin, binaries, content_path
+):
+    binaries.put_failures[2] = [503]
+
+    checkpoint = upload(api, content_path, new_checkpoint())
+
+    assert checkpoint["completed"] == [1, 2, 3, 4]
+    assert binaries.content() == content_path.read_bytes()
+    assert len(standin.requests_for("PUT", "/upload/2")) == 2
+    # The retry's registration is rejected as a duplicate and the part's
+    # URL is looked up instead.
+    assert len(standin.requests_for("GET", f"/binaries/{BINARY_PRN}/parts"))
+
+
+def test_resume_reuses_a_part_registered_before_the_interruption(
+    api, standin, binaries, content_path
+):
+    binaries.parts[2] = {
+        "index": 2,
+        "presigned_upload_url": f"{standin.url}/upload/2",
+    }
+
+    checkpoint = upload(api, content_path, new_checkpoint(completed=[1, 3, 4]))
+
+    assert checkpoint["completed"] == [1, 2, 3, 4]
+    assert binaries.uploads[2] == content_path.read_bytes()[1024:2048]
+
+
+def test_client_error_is_not_retried(api, standin, binaries, content_path):
+    binaries.put_failures[1] = [403]
+
+    with pytest.raises(UploadError) as error:
+        upload(api, content_path, new_checkpoint(completed=[2, 3, 4]))
+
+    assert error.value.status == 403
+    assert len(standin.requests_for("PUT", "/upload/1")) == 1
+
+
+def test_shared_slots_bound_parts_in_flight(api, binaries, content_path):
+    upload(
+        api,
+        content_path,
+        new_checkpoint(),
+        jobs=4,
+        slots=threading.BoundedSemaphore(1),
+    )
+
+    assert binaries.max_active_puts == 1